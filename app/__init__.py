@@ -41,8 +41,27 @@ app_settings = os.getenv(
 )
 app.config.from_object(app_settings)
 
-# Initialize Flask Sql Alchemy
-db = SQLAlchemy(app)
+# fail at startup on a password hasher this python can't run
+from app.auth import hashers
+
+hashers.init_app(app)
+
+# json responses
+from app.encoder import JSONEncoder
+
+app.json_encoder = JSONEncoder
+
+# prometheus metrics
+from app import metrics
+
+# Initialize Flask Sql Alchemy, pool checkouts are timed for the metrics
+db = SQLAlchemy(app, engine_options={'poolclass': metrics.TimedQueuePool})
+
+# Server-Timing headers and timing logs
+from app import timing
+
+timing.init_app(app)
+metrics.init_app(app)
 
 # Import the application views
 from app import views
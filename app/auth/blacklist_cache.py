@@ -0,0 +1,102 @@
+import threading
+import time
+from app import app
+from app.cache import BloomFilter, CacheStats
+
+
+class BlacklistCache:
+	"""
+	Per-worker cache of blacklisted tokens.
+
+	A bloom filter answers "is this token revoked?" without a database round trip
+	whenever the answer is no, which is the case for almost every request. Positive
+	answers are confirmed against a small exact set of known revoked tokens and
+	then against the database, so false positives never reject a valid token.
+
+	Tokens revoked by other workers are picked up by an incremental reload of the
+	table every BLACKLIST_CACHE_REFRESH_SECONDS.
+	"""
+
+	def __init__(self):
+		self.stats = CacheStats('token_blacklist')
+		self.false_positives = 0
+		self.lock = threading.Lock()
+		self.clear()
+
+	def clear(self):
+		"""forget everything, the filter is rebuilt from the database on next use"""
+		with self.lock:
+			self.bloom = None
+			self.confirmed = set()
+			self.last_id = 0
+			self.synced_at = 0.0
+
+	def sync(self, load_since):
+		"""
+		load tokens blacklisted since the last sync into the filter
+		:param load_since: callable returning (id, jti) rows with an id greater than its argument
+		:return:
+		"""
+		now = time.monotonic()
+		with self.lock:
+			if self.bloom is not None and now - self.synced_at < app.config['BLACKLIST_CACHE_REFRESH_SECONDS']:
+				return
+
+			if self.bloom is None or self.bloom.is_full:
+				self.bloom = BloomFilter(
+					max(app.config['BLACKLIST_CACHE_CAPACITY'], 2 * self.bloom.count if self.bloom else 0),
+					app.config['BLACKLIST_CACHE_ERROR_RATE']
+				)
+				self.last_id = 0
+
+			# re-read a few rows behind the high-water mark, ids of concurrent logouts can commit out of order
+			for row_id, jti in load_since(max(0, self.last_id - app.config['BLACKLIST_CACHE_SYNC_OVERLAP'])):
+				if jti not in self.bloom:
+					self.bloom.add(jti)
+				self.last_id = max(self.last_id, row_id)
+
+			self.synced_at = now
+
+	def add(self, jti):
+		"""
+		record a token blacklisted by this worker
+		:param jti: token key
+		:return:
+		"""
+		with self.lock:
+			if self.bloom is not None:
+				self.bloom.add(jti)
+			if len(self.confirmed) >= app.config['BLACKLIST_CACHE_EXACT_SIZE']:
+				self.confirmed.clear()
+			self.confirmed.add(jti)
+
+	def contains(self, jti, lookup):
+		"""
+		check if a token is blacklisted
+		:param jti: token key
+		:param lookup: callable that checks the database, only called when the filter can't rule the token out
+		:return: bool
+		"""
+		if jti not in self.bloom:
+			self.stats.hit()
+			return False
+
+		if jti in self.confirmed:
+			self.stats.hit()
+			return True
+
+		self.stats.miss()
+		if lookup(jti):
+			self.add(jti)
+			return True
+		self.false_positives += 1
+		return False
+
+	def as_dict(self):
+		stats = self.stats.as_dict()
+		stats['false_positives'] = self.false_positives
+		stats['size'] = self.bloom.count if self.bloom else 0
+		return stats
+
+
+blacklist_cache = BlacklistCache()
@@ -0,0 +1,170 @@
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash, gen_salt
+from app import app
+import bcrypt
+import hashlib
+import hmac
+import os
+import threading
+
+
+class Pbkdf2Hasher:
+	"""werkzeug's pbkdf2:sha256 hashes. The cost is the iteration count"""
+	name = 'pbkdf2'
+	available = True
+
+	def identify(self, hashed):
+		return hashed.startswith('pbkdf2:')
+
+	def hash(self, password, cost):
+		return generate_password_hash(password, method=f'pbkdf2:sha256:{cost}')
+
+	def verify(self, password, hashed):
+		return check_password_hash(hashed, password)
+
+	def cost(self, hashed):
+		method = hashed.split('$', 1)[0].split(':')
+		return int(method[2]) if len(method) > 2 else None
+
+
+class BcryptHasher:
+	"""bcrypt hashes. The cost is the log2 number of rounds"""
+	name = 'bcrypt'
+	available = True
+
+	def identify(self, hashed):
+		return hashed.startswith('$2')
+
+	def hash(self, password, cost):
+		return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=cost)).decode('utf-8')
+
+	def verify(self, password, hashed):
+		return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+	def cost(self, hashed):
+		return int(hashed.split('$')[2])
+
+
+class ScryptHasher:
+	"""
+	scrypt hashes from hashlib, stored in werkzeug's scrypt:n:r:p$salt$hash format.
+	The cost is log2(n)
+	"""
+	name = 'scrypt'
+	# hashlib.scrypt only exists when python was built against an OpenSSL that has it
+	available = hasattr(hashlib, 'scrypt')
+	block_size = 8
+	parallelism = 1
+
+	def identify(self, hashed):
+		return hashed.startswith('scrypt:')
+
+	def _derive(self, password, salt, n, r, p):
+		if not self.available:
+			raise RuntimeError('scrypt hashes need a python whose hashlib has scrypt')
+		return hashlib.scrypt(
+			password.encode('utf-8'), salt=salt.encode('utf-8'),
+			n=n, r=r, p=p, maxmem=132 * n * r * p
+		).hex()
+
+	def hash(self, password, cost):
+		n = 2 ** cost
+		salt = gen_salt(16)
+		digest = self._derive(password, salt, n, self.block_size, self.parallelism)
+		return f'scrypt:{n}:{self.block_size}:{self.parallelism}${salt}${digest}'
+
+	def verify(self, password, hashed):
+		method, salt, digest = hashed.split('$', 2)
+		n, r, p = (int(arg) for arg in method.split(':')[1:])
+		return hmac.compare_digest(self._derive(password, salt, n, r, p), digest)
+
+	def cost(self, hashed):
+		n = int(hashed.split('$', 1)[0].split(':')[1])
+		return n.bit_length() - 1
+
+
+HASHERS = {hasher.name: hasher for hasher in (Pbkdf2Hasher(), BcryptHasher(), ScryptHasher())}
+
+
+def init_app(app):
+	"""
+	check the configured PASSWORD_HASHER can hash on this python, so a bad setting
+	stops the app from starting instead of failing the first register
+	:param app: flask app
+	"""
+	name = app.config['PASSWORD_HASHER']
+	if name not in HASHERS:
+		raise RuntimeError(f'unknown PASSWORD_HASHER {name!r}, use one of {", ".join(HASHERS)}')
+	if not HASHERS[name].available:
+		raise RuntimeError(f'PASSWORD_HASHER {name!r} is not available on this python')
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def run_hashing(func, *args):
+	"""
+	Run a hashing function on the bounded hashing thread pool. hashlib and bcrypt
+	release the GIL while hashing, so other request threads keep running. With
+	PASSWORD_HASH_WORKERS = 0 the function runs on the calling thread
+	:param func: hashing function
+	:return: the function's result
+	"""
+	global _executor, _executor_pid
+
+	workers = app.config.get('PASSWORD_HASH_WORKERS')
+	if not workers:
+		return func(*args)
+
+	# threads don't survive a fork, preforked workers each build their own pool
+	if _executor is None or _executor_pid != os.getpid():
+		with _executor_lock:
+			if _executor is None or _executor_pid != os.getpid():
+				_executor = ThreadPoolExecutor(max_workers=workers)
+				_executor_pid = os.getpid()
+
+	return _executor.submit(func, *args).result()
+
+
+def identify(hashed):
+	"""
+	find the hasher that created a hash
+	:param hashed: password hash
+	:return: hasher
+	"""
+	for hasher in HASHERS.values():
+		if hasher.identify(hashed):
+			return hasher
+	raise ValueError('unknown password hash format')
+
+
+def hash_password(password):
+	"""
+	hash a password with the configured PASSWORD_HASHER and PASSWORD_HASH_COST
+	:param password: password
+	:return: password hash
+	"""
+	hasher = HASHERS[app.config['PASSWORD_HASHER']]
+	return run_hashing(hasher.hash, password, app.config['PASSWORD_HASH_COST'])
+
+
+def verify_password(password, hashed):
+	"""
+	check a password against a hash made by any of the hashers
+	:param password: password
+	:param hashed: password hash
+	:return: bool
+	"""
+	return run_hashing(identify(hashed).verify, password, hashed)
+
+
+def needs_rehash(hashed):
+	"""
+	check if a hash was made with a different hasher or cost than configured
+	:param hashed: password hash
+	:return: bool
+	"""
+	hasher = identify(hashed)
+	return hasher.name != app.config['PASSWORD_HASHER'] or hasher.cost(hashed) != app.config['PASSWORD_HASH_COST']
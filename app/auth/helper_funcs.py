@@ -1,9 +1,87 @@
 from flask import request, make_response, jsonify
+from app import app
 from app.models import User
+from app.auth.user_cache import get_user_snapshot
+from app.timing import timed
 from functools import wraps
 import re
 
 
+class Principal:
+	"""
+	Identity and role of the caller, read from the token claims
+	instead of the users table
+	"""
+	__slots__ = ('id', 'is_admin')
+
+	def __init__(self, user_id, is_admin):
+		self.id = user_id
+		self.is_admin = is_admin
+
+	def __repr__(self):
+		return f'<principal: {self.id}>'
+
+
+def authenticate_request():
+	"""
+	Decode the auth token sent in the Authorization header
+	:return: (token claims, None) or (None, error response)
+	"""
+	token = None
+
+	if 'Authorization' in request.headers:
+		auth_header = request.headers['Authorization']
+		try:
+			token = auth_header.split(" ")[1]
+		except IndexError:
+			return None, (make_response(jsonify({
+				'status': 'failed',
+				'message': 'Provide a valid auth token'
+			})), 403)
+
+	if not token:
+		return None, (make_response(jsonify({
+			'status': 'failed',
+			'message': 'Token is missing'
+		})), 401)
+
+	claims = User.decode_token_claims(token)
+	if isinstance(claims, str):
+		return None, (make_response(jsonify({
+			'status': 'failed',
+			'message': claims
+		})), 401)
+
+	return claims, None
+
+
+def load_current_user(claims):
+	"""
+	Load the user a token was issued to. With USER_CACHE_ENABLED the user is a
+	read-only UserSnapshot from the per-process user cache. In stateless mode
+	tokens issued before the user's token version was bumped are rejected
+	:param claims: token claims
+	:return: (user, None) or (None, error response)
+	"""
+	if app.config.get('USER_CACHE_ENABLED'):
+		current_user = get_user_snapshot(claims['sub'], User.get_by_id)
+	else:
+		current_user = User.query.filter_by(id=claims['sub']).first()
+	message = 'Invalid token'
+
+	if current_user and app.config.get('AUTH_STATELESS') and claims.get('ver', 0) != current_user.token_version:
+		current_user = None
+		message = 'Token is outdated, Please login In'
+
+	if not current_user:
+		return None, (make_response(jsonify({
+			'status': 'failed',
+			'message': message
+		})), 401)
+
+	return current_user, None
+
+
 def token_required(f):
 	"""
 	Decorator function to ensure that a resource is access by only authenticated users`
@@ -14,35 +92,37 @@ def token_required(f):
 
 	@wraps(f)
 	def decorated_function(*args, **kwargs):
-		token = None
-
-		if 'Authorization' in request.headers:
-			auth_header = request.headers['Authorization']
-			try:
-				token = auth_header.split(" ")[1]
-			except IndexError:
-				return make_response(jsonify({
-					'status': 'failed',
-					'message': 'Provide a valid auth token'
-				})), 403
-
-		if not token:
-			return make_response(jsonify({
-				'status': 'failed',
-				'message': 'Token is missing'
-			})), 401
+		with timed('auth'):
+			claims, error = authenticate_request()
+			if not error:
+				current_user, error = load_current_user(claims)
+		if error:
+			return error
 
-		try:
-			decode_response = User.decode_token(token)
-			current_user = User.query.filter_by(id=decode_response).first()
-		except:
-			message = 'Invalid token'
-			if isinstance(decode_response, str):
-				message = decode_response
-			return make_response(jsonify({
-				'status': 'failed',
-				'message': message
-			})), 401
+		return f(current_user, *args, **kwargs)
+
+	return decorated_function
+
+
+def principal_required(f):
+	"""
+	Decorator for resources that only need the caller's id and role. With
+	AUTH_STATELESS the view gets a Principal built from the token claims and
+	the users table is never queried, otherwise it behaves like token_required
+	:param f:
+	:return:
+	"""
+
+	@wraps(f)
+	def decorated_function(*args, **kwargs):
+		with timed('auth'):
+			claims, error = authenticate_request()
+			if not error and app.config.get('AUTH_STATELESS') and 'adm' in claims:
+				current_user = Principal(claims['sub'], claims['adm'])
+			elif not error:
+				current_user, error = load_current_user(claims)
+		if error:
+			return error
 
 		return f(current_user, *args, **kwargs)
 
@@ -0,0 +1,57 @@
+from collections import namedtuple
+from app import app
+from app.cache import LRUCache
+
+
+class UserSnapshot(namedtuple('UserSnapshot', [
+	'id', 'username', 'email', 'is_admin', 'token_version', 'date_created', 'date_modified'
+])):
+	"""
+	Read-only copy of a user row. Snapshots aren't attached to any session,
+	so they can be shared between requests without leaking ORM state
+	"""
+	__slots__ = ()
+
+	@classmethod
+	def from_user(cls, user):
+		return cls(
+			id=user.id,
+			username=user.username,
+			email=user.email,
+			is_admin=user.is_admin,
+			token_version=user.token_version,
+			date_created=user.date_created,
+			date_modified=user.date_modified
+		)
+
+	def serialize(self):
+		"""returns a json object of the user"""
+		return {
+			'id': self.id,
+			'username': self.username,
+			'email': self.email,
+			'date_created': self.date_created,
+			'date_modified': self.date_modified
+		}
+
+
+# per-process cache of authenticated users keyed by user id. Writes made by other
+# processes become visible once an entry's USER_CACHE_TTL_SECONDS run out
+user_cache = LRUCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL_SECONDS'], 'user')
+
+
+def get_user_snapshot(user_id, load):
+	"""
+	Resolve a user through the cache
+	:param user_id: user id
+	:param load: callable that loads the User row on a miss
+	:return: UserSnapshot or None
+	"""
+	snapshot = user_cache.get(user_id)
+	if snapshot is None:
+		user = load(user_id)
+		if user is None:
+			return None
+		snapshot = UserSnapshot.from_user(user)
+		user_cache.set(user_id, snapshot)
+	return snapshot
@@ -1,8 +1,9 @@
-from flask import Blueprint, request, make_response, jsonify
+from flask import Blueprint, request, make_response, jsonify, abort
 from flask.views import MethodView
-from app.models import User, BlacklistToken
+from app import app
+from app.models import User, BlacklistToken, RefreshToken
 from app.auth.helper_funcs import response, response_auth, token_required, format_inputs
-from cerberus import Validator
+from app.timing import Validator
 import re
 
 auth = Blueprint('auth', __name__)
@@ -55,9 +56,17 @@ reset_password_schema = {
 	}
 }
 
+refresh_schema = {
+	'refresh_token': {
+		'type': 'string',
+		'required': True
+	}
+}
+
 validate_user_schema = Validator(user_schema)
 validate_login_schema = Validator(login_schema)
 validate_reset_password_schema = Validator(reset_password_schema)
+validate_refresh_schema = Validator(refresh_schema)
 
 
 class RegisterUser(MethodView):
@@ -125,12 +134,21 @@ class LoginUser(MethodView):
 				user = User.query.filter(User.username == username).first()
 
 				if user and user.verify_password(password):
-					return make_response(jsonify({
+					# upgrade hashes made with an older hasher or cost while the password is at hand
+					if user.password_needs_rehash():
+						user.password = password
+						user.save()
+
+					login_data = {
 						'status': 'success',
 						'message': 'successfully logged in',
 						'auth_token': user.generate_token(user.id).decode("utf-8"),
 						"is_admin": user.is_admin
-					})), 200
+					}
+					if app.config.get('AUTH_REFRESH_TOKENS'):
+						login_data['refresh_token'] = user.generate_refresh_token().decode("utf-8")
+
+					return make_response(jsonify(login_data)), 200
 				return response('error', "user doesn't exist or password is incorrect or username and email do not match", 401)
 
 			return response('error', validate_login_schema.errors, 401)
@@ -150,13 +168,49 @@ class LogoutUser(MethodView):
 			else:
 				decoded_token_response = User.decode_token(auth_token)
 				if not isinstance(decoded_token_response, str):
-					token = BlacklistToken(token=auth_token)
-					token.blacklist()
+					if app.config.get('AUTH_REFRESH_TOKENS'):
+						# access tokens expire on their own, revoke the refresh token(s)
+						post_data = request.get_json(silent=True) or {}
+						if isinstance(post_data.get('refresh_token'), str):
+							RefreshToken.revoke(post_data['refresh_token'], decoded_token_response)
+						else:
+							RefreshToken.revoke_all(decoded_token_response)
+					else:
+						token = BlacklistToken(token=auth_token)
+						token.blacklist()
 					return response('success', 'successfully logged out', 200)
 				return response('error', decoded_token_response, 401)
 		return response('error', 'provide an Authorization header', 403)
 
 
+class RefreshUserToken(MethodView):
+	"""class to exchange a refresh token for new tokens"""
+
+	def post(self):
+		if not app.config.get('AUTH_REFRESH_TOKENS'):
+			abort(404)
+
+		if request.content_type == 'application/json':
+			post_data = request.get_json()
+
+			if validate_refresh_schema.validate(post_data):
+				rotated = RefreshToken.rotate(post_data.get('refresh_token'))
+				if isinstance(rotated, str):
+					return response('error', rotated, 401)
+
+				user, auth_token, refresh_token = rotated
+				return make_response(jsonify({
+					'status': 'success',
+					'message': 'token refreshed',
+					'auth_token': auth_token.decode("utf-8"),
+					'refresh_token': refresh_token.decode("utf-8"),
+					"is_admin": user.is_admin
+				})), 200
+
+			return response('error', validate_refresh_schema.errors, 400)
+		return response('error', 'content-type must be json', 400)
+
+
 @auth.route('/reset-password', methods=['POST'])
 @token_required
 def reset_password(current_user):
@@ -172,16 +226,23 @@ def reset_password(current_user):
 			if old_password == new_password:
 				return response('error', 'old password cannot be the same as new password', 406)
 
+			# current_user can be a cached read-only snapshot, update the stored user
+			user = User.get_by_id(current_user.id)
+
 			# check if old password match. If they do, update password
-			if current_user.verify_password(old_password):
-				current_user.password = new_password
-				current_user.save()
+			if user.verify_password(old_password):
+				user.password = new_password
+				user.bump_token_version()
+				user.save()
 
 				# log out user
-				auth_header = request.headers.get('Authorization')
-				auth_token = auth_header.split(" ")[1]
-				token = BlacklistToken(token=auth_token)
-				token.blacklist()
+				if app.config.get('AUTH_REFRESH_TOKENS'):
+					RefreshToken.revoke_all(user.id)
+				else:
+					auth_header = request.headers.get('Authorization')
+					auth_token = auth_header.split(" ")[1]
+					token = BlacklistToken(token=auth_token)
+					token.blacklist()
 				return response('success', 'password reset successful', 200)
 			return response('error', "password don't match", 401)
 
@@ -193,8 +254,10 @@ def reset_password(current_user):
 registration_view = RegisterUser.as_view('register')
 login_view = LoginUser.as_view('login')
 logout_view = LogoutUser.as_view('logout')
+refresh_view = RefreshUserToken.as_view('refresh')
 
 # end point rules
 auth.add_url_rule('/register', view_func=registration_view, methods=['POST'])
 auth.add_url_rule('/login', view_func=login_view, methods=['POST'])
 auth.add_url_rule('/logout', view_func=logout_view, methods=['POST'])
+auth.add_url_rule('/refresh', view_func=refresh_view, methods=['POST'])
@@ -0,0 +1,262 @@
+from functools import wraps
+from flask import request, make_response, Response
+from app import app, db
+from app.cache import LRUCache, CacheStats
+from app.models import Book, CatalogVersion
+from datetime import timezone
+import hashlib
+import pickle
+
+try:
+	import uwsgi
+except ImportError:
+	uwsgi = None
+
+
+class LocalCacheBackend:
+	"""per-process LRU of responses"""
+
+	def __init__(self, size):
+		self.cache = LRUCache(size)
+
+	def get(self, key):
+		return self.cache.get(key)
+
+	def set(self, key, value):
+		self.cache.set(key, value)
+
+	def clear(self):
+		self.cache.clear()
+
+
+class UwsgiCacheBackend:
+	"""
+	uWSGI's shared cache, one copy of each response for all workers. The cache
+	has to be declared in uwsgi.ini with the name in BOOKS_CACHE_UWSGI_NAME
+	"""
+
+	def __init__(self, name):
+		self.name = name
+
+	def get(self, key):
+		value = uwsgi.cache_get(key, self.name)
+		if value is None:
+			return None
+		return pickle.loads(value)
+
+	def set(self, key, value):
+		uwsgi.cache_update(key, pickle.dumps(value), 0, self.name)
+
+	def clear(self):
+		uwsgi.cache_clear(self.name)
+
+
+class ResponseCache:
+	"""
+	Cache of catalog responses. Every entry carries the catalog version it was
+	rendered at and is only served while that is still the current version, so
+	a write is visible to the next request as soon as it commits.
+	"""
+
+	def __init__(self, backend):
+		self.backend = backend
+		self.stats = CacheStats('books_response')
+		self.stale = 0
+
+	def get(self, key, version):
+		"""
+		:param key: request key
+		:param version: current catalog version
+		:return: (status, mimetype, body) or None
+		"""
+		entry = self.backend.get(key)
+		if entry is not None and entry[0] == version:
+			self.stats.hit()
+			return entry[1:]
+
+		if entry is not None:
+			self.stale += 1
+		self.stats.miss()
+		return None
+
+	def set(self, key, version, status, mimetype, body):
+		self.backend.set(key, (version, status, mimetype, body))
+
+	def clear(self):
+		self.backend.clear()
+		self.stats.reset()
+		self.stale = 0
+
+	def as_dict(self):
+		stats = self.stats.as_dict()
+		stats['stale'] = self.stale
+		return stats
+
+
+def create_backend(config):
+	"""
+	:param config: app config
+	:return: the backend named by BOOKS_CACHE_BACKEND, uwsgi falls back to local outside uWSGI
+	"""
+	if config['BOOKS_CACHE_BACKEND'] == 'uwsgi' and uwsgi is not None:
+		return UwsgiCacheBackend(config['BOOKS_CACHE_UWSGI_NAME'])
+	return LocalCacheBackend(config['BOOKS_CACHE_SIZE'])
+
+
+response_cache = ResponseCache(create_backend(app.config))
+
+
+def request_key():
+	"""
+	the path, the query args in a fixed order and whether ndjson was asked for
+	:return: cache key
+	"""
+	args = '&'.join(f'{name}={value}' for name, value in sorted(request.args.items(multi=True)))
+	ndjson = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+	key = f'{request.path}?{args}#{ndjson}'
+	# uwsgi cache keys have a size limit
+	return hashlib.blake2b(key.encode('utf-8'), digest_size=20).hexdigest()
+
+
+def list_version():
+	"""
+	version of book lists, they show every book's title and availability. Read
+	once per request
+	:return: (catalog version, availability version)
+	"""
+	# kept in the environ, g outlives the request when an app context is already pushed
+	if 'books.list_version' not in request.environ:
+		request.environ['books.list_version'] = CatalogVersion.current()
+	return request.environ['books.list_version']
+
+
+def book_version(book_id):
+	"""
+	version of a single book, its date_modified, read once per request. Loans
+	and returns set it too, so they only retire the cached responses of their own book
+	:param book_id: book id from the url
+	:return: datetime, None if there is no such book
+	"""
+	if 'books.date_modified' not in request.environ:
+		try:
+			book_id = int(book_id)
+		except ValueError:
+			date_modified = None
+		else:
+			date_modified = db.session.query(Book.date_modified).filter(Book.id == book_id).scalar()
+		request.environ['books.date_modified'] = date_modified
+	return request.environ['books.date_modified']
+
+
+def cached_response(version):
+	"""
+	serve a catalog GET from response_cache while its version is unchanged.
+	Streamed responses and errors are never stored
+	:param version: callable of the view's url args returning the version, None skips the cache
+	:return:
+	"""
+
+	def decorator(f):
+		@wraps(f)
+		def decorated(*args, **kwargs):
+			if not app.config.get('BOOKS_CACHE_ENABLED'):
+				return f(*args, **kwargs)
+
+			# read before rendering, so the entry is never newer than its version
+			current = version(**kwargs)
+			if current is None:
+				return f(*args, **kwargs)
+
+			key = request_key()
+			cached = response_cache.get(key, current)
+			if cached is not None:
+				status, mimetype, body = cached
+				rv = Response(body, status=status, mimetype=mimetype)
+				rv.headers['X-Cache'] = 'HIT'
+				return rv
+
+			rv = make_response(f(*args, **kwargs))
+			if rv.status_code in (200, 204) and not rv.is_streamed:
+				response_cache.set(key, current, rv.status_code, rv.mimetype, rv.get_data())
+				rv.headers['X-Cache'] = 'MISS'
+			return rv
+
+		return decorated
+
+	return decorator
+
+
+def list_validators():
+	"""
+	validators of a book list: the ETag hashes the list version with the request
+	key. There is no Last-Modified, loans and returns don't leave a time behind
+	:return: (etag, None)
+	"""
+	version, availability = list_version()
+	etag = hashlib.blake2b(f'{version}:{availability}:{request_key()}'.encode('utf-8'), digest_size=16).hexdigest()
+	return etag, None
+
+
+def book_validators(book_id):
+	"""
+	validators of a single book from its date_modified, None if there is no such book
+	:param book_id: book id from the url
+	:return: (etag, last_modified) or None
+	"""
+	date_modified = book_version(book_id)
+	if date_modified is None:
+		return None
+	etag = hashlib.blake2b(f'{book_id}:{date_modified.isoformat()}'.encode('utf-8'), digest_size=16).hexdigest()
+	return etag, date_modified
+
+
+def not_modified(etag, last_modified):
+	"""
+	whether the client's copy is current. If-None-Match wins over If-Modified-Since
+	:param etag: current etag
+	:param last_modified: current last modified time in utc, or None
+	:return: bool
+	"""
+	if request.if_none_match:
+		return request.if_none_match.contains(etag)
+
+	since = request.if_modified_since
+	if since is None or last_modified is None:
+		return False
+	if since.tzinfo is not None:
+		since = since.astimezone(timezone.utc).replace(tzinfo=None)
+	# http dates have no fractions of a second
+	return last_modified.replace(microsecond=0) <= since
+
+
+def conditional_response(validators):
+	"""
+	answer conditional GETs with 304 from the validators alone, no rows are
+	loaded or serialized. Full 200 responses get the ETag and Last-Modified when there is one
+	:param validators: callable of the view's url args returning (etag, last_modified) or None
+	:return:
+	"""
+
+	def decorator(f):
+		@wraps(f)
+		def decorated(*args, **kwargs):
+			current = validators(**kwargs)
+			if current is None:
+				return f(*args, **kwargs)
+
+			etag, last_modified = current
+			if not_modified(etag, last_modified):
+				rv = Response(status=304)
+			else:
+				rv = make_response(f(*args, **kwargs))
+				if rv.status_code != 200:
+					return rv
+
+			rv.set_etag(etag)
+			if last_modified is not None:
+				rv.last_modified = last_modified
+			return rv
+
+		return decorated
+
+	return decorator
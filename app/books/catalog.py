@@ -0,0 +1,144 @@
+from app import db
+from app.models import Book, CatalogVersion
+from app.books.helper_funcs import stream_books
+from itertools import islice
+import csv
+import io
+import json
+
+# staged rows are normalized like format_inputs and validated like book_schema
+MERGE_STAGED_BOOKS = """
+	INSERT INTO books (title, isbn, is_borrowed, date_created, date_modified)
+	SELECT DISTINCT ON (isbn) title, isbn, false, now(), now()
+	FROM (
+		SELECT line, lower(regexp_replace(btrim({title}), ' +', ' ', 'g')) AS title, btrim({isbn}) AS isbn
+		FROM books_staging
+	) AS staged
+	WHERE title <> '' AND length(title) <= {title_length} AND isbn ~ '^[0-9]{{10}}$'
+	ORDER BY isbn, line DESC
+	ON CONFLICT (isbn) DO UPDATE SET title = EXCLUDED.title, date_modified = now()
+	WHERE books.title IS DISTINCT FROM EXCLUDED.title
+"""
+
+EXPORT_COLUMNS = ['id', 'title', 'isbn', 'is_borrowed', 'date_created', 'date_modified']
+
+
+class CsvStream:
+	"""file-like object that writes rows as csv text while copy_expert reads it"""
+
+	def __init__(self, rows, batch_size=1000):
+		self.rows = iter(rows)
+		self.batch_size = batch_size
+		self.buffer = ''
+
+	def read(self, size=-1):
+		while size < 0 or len(self.buffer) < size:
+			chunk = io.StringIO()
+			csv.writer(chunk).writerows(islice(self.rows, self.batch_size))
+			if not chunk.tell():
+				break
+			self.buffer += chunk.getvalue()
+
+		if size < 0:
+			data, self.buffer = self.buffer, ''
+		else:
+			data, self.buffer = self.buffer[:size], self.buffer[size:]
+		return data
+
+
+def ndjson_rows(lines):
+	"""
+	read title and isbn from ndjson lines. Lines that aren't books become
+	empty rows, which the merge counts as invalid
+	:param lines: iterator of lines
+	:return: generator of (title, isbn)
+	"""
+	for line in lines:
+		if not line.strip():
+			continue
+		try:
+			book = json.loads(line)
+		except ValueError:
+			book = None
+		if not isinstance(book, dict):
+			yield None, None
+			continue
+		title, isbn = book.get('title'), book.get('isbn')
+		yield title if isinstance(title, str) else None, isbn if isinstance(isbn, str) else None
+
+
+def import_books(path):
+	"""
+	Load books from a csv file with a header row or from an ndjson file. Rows are
+	streamed into a staging table with COPY, then merged into books with an
+	upsert on isbn, so the file is never held in memory
+	:param path: .csv, .ndjson or .jsonl file
+	:return: (rows read, books created or updated)
+	"""
+	with open(path, newline='') as book_file:
+		if path.endswith('.csv'):
+			header = next(csv.reader([book_file.readline()]), [])
+			columns = [column.strip().lower() for column in header]
+			if 'title' not in columns or 'isbn' not in columns:
+				raise ValueError('csv header must name the title and isbn columns')
+			source = book_file
+		elif path.endswith(('.ndjson', '.jsonl')):
+			columns = ['title', 'isbn']
+			source = CsvStream(ndjson_rows(book_file))
+		else:
+			raise ValueError('file must be .csv, .ndjson or .jsonl')
+
+		# header names never reach the sql, staged columns are numbered
+		staged_columns = [f'c{i}' for i in range(len(columns))]
+		cursor = db.session.connection().connection.cursor()
+		cursor.execute(
+			f"CREATE TEMP TABLE books_staging (line bigserial, {', '.join(f'{c} text' for c in staged_columns)}) "
+			"ON COMMIT DROP"
+		)
+		cursor.copy_expert(
+			f"COPY books_staging ({', '.join(staged_columns)}) FROM STDIN WITH (FORMAT csv)",
+			source
+		)
+		rows_read = cursor.rowcount
+
+	cursor.execute(MERGE_STAGED_BOOKS.format(
+		title=staged_columns[columns.index('title')],
+		isbn=staged_columns[columns.index('isbn')],
+		title_length=Book.title.type.length
+	))
+	rows_merged = cursor.rowcount
+	if rows_merged:
+		# merge the title search entries now, searches would scan them on every query until autovacuum does
+		cursor.execute("SELECT gin_clean_pending_list('ix_books_title_search')")
+		CatalogVersion.bump()
+	db.session.commit()
+	return rows_read, rows_merged
+
+
+def export_books(path, batch_size=1000):
+	"""
+	Write every book to a csv file with COPY TO, or to an ndjson file through a
+	server side cursor. Either way memory use doesn't grow with the catalog
+	:param path: .csv, .ndjson or .jsonl file
+	:param batch_size: rows fetched per round trip for ndjson
+	:return: rows written
+	"""
+	if not path.endswith(('.csv', '.ndjson', '.jsonl')):
+		raise ValueError('file must be .csv, .ndjson or .jsonl')
+
+	with open(path, 'w', newline='') as book_file:
+		if path.endswith('.csv'):
+			cursor = db.session.connection().connection.cursor()
+			cursor.copy_expert(
+				f"COPY (SELECT {', '.join(EXPORT_COLUMNS)} FROM books ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER true)",
+				book_file
+			)
+			rows_written = cursor.rowcount
+		else:
+			rows_written = 0
+			for chunk in stream_books(iter(Book.iter_all(batch_size)), batch_size, ndjson=True):
+				book_file.write(chunk)
+				rows_written += chunk.count('\n')
+
+	db.session.commit()
+	return rows_written
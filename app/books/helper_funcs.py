@@ -1,4 +1,7 @@
-from flask import abort, jsonify, make_response
+from flask import abort, jsonify, make_response, json as flask_json
+from itertools import islice
+import base64
+import json
 
 
 def check_admin(user):
@@ -137,3 +140,65 @@ def response_with_pagination(books, previous_page, next_page, count):
 			"books": books
 		}
 	)), 200
+
+
+def encode_cursor(order, key):
+	"""
+	make an opaque pagination cursor
+	:param order: 'id', 'title' or 'rank'
+	:param key: sort key of the last book on the page
+	:return: url safe string
+	"""
+	return base64.urlsafe_b64encode(json.dumps([order, key]).encode('utf-8')).decode('utf-8')
+
+
+def decode_cursor(cursor):
+	"""
+	read a cursor made by encode_cursor
+	:param cursor: cursor string
+	:return: (order, key)
+	"""
+	try:
+		order, key = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+	except (ValueError, TypeError):
+		raise ValueError('invalid cursor')
+
+	if not isinstance(key, list):
+		raise ValueError('invalid cursor')
+	if order == 'id' and len(key) == 1 and isinstance(key[0], int):
+		return order, key
+	if order == 'title' and len(key) == 2 and isinstance(key[0], str) and isinstance(key[1], int):
+		return order, key
+	if order == 'rank' and len(key) == 2 and isinstance(key[0], (int, float)) and isinstance(key[1], int):
+		return order, key
+	raise ValueError('invalid cursor')
+
+
+def stream_books(books, batch_size, ndjson=False):
+	"""
+	Serialize books in batches for a streaming response, either one json
+	object per line or a single {"books": [...]} document
+	:param books: iterator of books
+	:param batch_size: books per chunk
+	:param ndjson: emit newline delimited json
+	:return: generator of strings
+	"""
+	separator = '\n' if ndjson else ','
+	if not ndjson:
+		yield '{"books": ['
+
+	first = True
+	while True:
+		batch = list(islice(books, batch_size))
+		if not batch:
+			break
+
+		chunk = separator.join(flask_json.dumps(book.serialize()) for book in batch)
+		if ndjson:
+			yield chunk + '\n'
+		else:
+			yield chunk if first else separator + chunk
+		first = False
+
+	if not ndjson:
+		yield ']}'
@@ -0,0 +1,140 @@
+from array import array
+from bisect import bisect_left, bisect_right
+import threading
+import time
+
+
+class SuggestIndex:
+	"""
+	Per-worker sorted index of book titles for prefix suggestions.
+
+	Titles are kept in code point order next to their ids, so the books whose
+	title starts with a prefix are a contiguous run found with one bisection.
+	Title changes committed by this worker are applied in place. Changes made
+	by other workers move titles_version past the index's, which is checked at
+	most every refresh interval and triggers a reload.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.clear()
+
+	def clear(self):
+		"""forget everything, the index is cold until the next load"""
+		with self.lock:
+			self.titles = []
+			self.ids = array('q')
+			self.titles_version = None
+			self.checked_at = 0.0
+			self.loading = False
+
+	@property
+	def is_warm(self):
+		return self.titles_version is not None
+
+	def load(self, rows, titles_version):
+		"""
+		replace the index
+		:param rows: iterable of (title, id)
+		:param titles_version: titles_version the rows were read at
+		:return:
+		"""
+		entries = sorted(rows)
+		titles = [title for title, book_id in entries]
+		ids = array('q', (book_id for title, book_id in entries))
+		del entries
+		with self.lock:
+			self.titles, self.ids = titles, ids
+			self.titles_version = titles_version
+			self.checked_at = time.monotonic()
+			self.loading = False
+
+	def due(self, refresh_seconds):
+		"""
+		whether the index is cold or its titles_version should be checked, only
+		one caller gets True until load or checked is called
+		:param refresh_seconds: seconds between checks
+		:return: bool
+		"""
+		with self.lock:
+			if self.loading or (self.is_warm and time.monotonic() - self.checked_at < refresh_seconds):
+				return False
+			self.loading = True
+			return True
+
+	def checked(self):
+		"""the titles_version is current, nothing to load"""
+		with self.lock:
+			self.checked_at = time.monotonic()
+			self.loading = False
+
+	def search(self, prefix, limit):
+		"""
+		:param prefix: normalized title prefix
+		:param limit: max suggestions
+		:return: list of (id, title) in title order, None while the index is cold
+		"""
+		with self.lock:
+			if not self.is_warm:
+				return None
+			titles, ids = self.titles, self.ids
+			start = bisect_left(titles, prefix)
+			suggestions = []
+			for position in range(start, min(start + limit, len(titles))):
+				if not titles[position].startswith(prefix):
+					break
+				suggestions.append((ids[position], titles[position]))
+			return suggestions
+
+	def apply(self, changes, titles_version, bumps):
+		"""
+		apply title changes committed by this worker. Unless they are the only
+		changes since the index was loaded, a reload is due instead
+		:param changes: list of ('add' or 'remove', book id, title or None when unknown)
+		:param titles_version: titles_version after the changes
+		:param bumps: times the changes bumped titles_version
+		:return:
+		"""
+		with self.lock:
+			if not self.is_warm:
+				return
+			if self.titles_version + bumps != titles_version:
+				self.checked_at = 0.0
+				return
+
+			for action, book_id, title in changes:
+				if action == 'add':
+					self._insert(book_id, title)
+				else:
+					self._remove(book_id, title)
+			self.titles_version = titles_version
+
+	def _insert(self, book_id, title):
+		low = bisect_left(self.titles, title)
+		high = bisect_right(self.titles, title, low)
+		position = low + bisect_left(self.ids[low:high], book_id)
+		self.titles.insert(position, title)
+		self.ids.insert(position, book_id)
+
+	def _remove(self, book_id, title):
+		if title is None:
+			# deleted books that were never loaded, find them by id
+			try:
+				position = self.ids.index(book_id)
+			except ValueError:
+				return
+		else:
+			low = bisect_left(self.titles, title)
+			high = bisect_right(self.titles, title, low)
+			try:
+				position = low + self.ids[low:high].index(book_id)
+			except ValueError:
+				return
+		del self.titles[position]
+		del self.ids[position]
+
+	def __len__(self):
+		return len(self.titles)
+
+
+suggest_index = SuggestIndex()
@@ -1,8 +1,22 @@
-from flask import Blueprint, request, abort, make_response, jsonify
-from app.auth.helper_funcs import token_required, format_inputs
-from app.models import Book
-from app.books.helper_funcs import check_admin, response, response_for_book, response_for_created_book, get_user_book_list, get_paginated_list
-from cerberus import Validator
+from flask import Blueprint, request, abort, make_response, jsonify, Response, stream_with_context
+from app import app, db
+from app.auth.helper_funcs import token_required, principal_required, format_inputs
+from app.models import Book, CatalogVersion
+from app.books.cache import cached_response, conditional_response, list_validators, book_validators, list_version, book_version
+from app.books.suggest import suggest_index
+from app.books.helper_funcs import check_admin, response, response_for_book, response_for_created_book, get_user_book_list, get_paginated_list, encode_cursor, decode_cursor, stream_books
+from itertools import chain
+import re
+import threading
+from app.timing import Validator
+import json
+import math
+
+# books.id is a postgres integer
+MAX_ID = 2 ** 31 - 1
+
+# the books.title column is a varchar, longer titles fail the insert
+TITLE_MAX_LENGTH = Book.title.type.length
 
 # schemas
 book_schema = {
@@ -36,27 +50,94 @@ pagination_schema = {
 	}
 }
 
+cursor_schema = {
+	'limit': {
+		'type': 'string',
+		'regex': '^[0-9]+$'
+	},
+	'after': {
+		'type': 'string'
+	},
+	'order': {
+		'type': 'string',
+		'allowed': ['id', 'title']
+	},
+	'include_total': {
+		'type': 'string',
+		'allowed': ['true', 'false']
+	}
+}
+
+search_schema = {
+	'q': {
+		'type': 'string',
+		'required': True,
+		'empty': False
+	},
+	'limit': {
+		'type': 'string',
+		'regex': '^[0-9]+$'
+	},
+	'after': {
+		'type': 'string'
+	}
+}
+
+suggest_schema = {
+	'prefix': {
+		'type': 'string',
+		'required': True,
+		'empty': False
+	},
+	'limit': {
+		'type': 'string',
+		'regex': '^[0-9]+$'
+	}
+}
+
 # schema validations
 validate_book_schema = Validator(book_schema)
 validate_update_book_schema = Validator(update_book_schema)
 validate_pagination_schema = Validator(pagination_schema)
+validate_cursor_schema = Validator(cursor_schema)
+validate_search_schema = Validator(search_schema)
+validate_suggest_schema = Validator(suggest_schema)
 
 # initialize blueprint
 books = Blueprint('books', __name__)
 
 
 @books.route('')
-@token_required
+@principal_required
+@conditional_response(list_validators)
+@cached_response(list_version)
 def api_get_all_books(current_user):
 	"""
 	retrieve all books in the database
 	:return:
 	"""
 
-	all_books = Book.get_all()
 	books_result = []
 	req_args = request.args
 
+	# multi-get, ?ids=1,2,3 or ?isbn=...,...
+	if 'ids' in req_args or 'isbn' in req_args:
+		return get_books_by_keys(req_args)
+
+	# stream the whole list when asked, ?stream=1 is the only arg allowed with it
+	ndjson = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+	if set(req_args) <= {'stream'} and (req_args.get('stream') == '1' or ndjson):
+		return stream_all_books(ndjson)
+
+	# any other stream value asks for the list as usual
+	if 'stream' in req_args:
+		req_args = req_args.copy()
+		req_args.pop('stream')
+
+	# keyset pagination, used when a cursor is given or a limit comes without a page
+	if {'after', 'order', 'include_total'} & set(req_args) or ('limit' in req_args and 'page' not in req_args):
+		return get_books_page_after(req_args)
+
 	# check if pagination args are provided
 	if req_args:
 		if validate_pagination_schema.validate(req_args):
@@ -98,6 +179,7 @@ def api_get_all_books(current_user):
 
 		return make_response(jsonify({'error': validate_pagination_schema.errors})), 400
 
+	all_books = Book.get_all()
 	for single_book in all_books:
 		book_obj = single_book.serialize()
 		books_result.append(book_obj)
@@ -115,6 +197,225 @@ def api_get_all_books(current_user):
 	)
 
 
+def get_books_by_keys(req_args):
+	"""
+	retrieve many books by id or isbn in as few queries as the chunk size allows.
+	Books come in the requested order, keys without a book are listed as missing
+	:param req_args: request args with ids or isbn and nothing else
+	:return: http response
+	"""
+	if len(req_args) != 1:
+		return make_response(jsonify({'error': "ids and isbn can't be combined with other args"})), 400
+
+	name, value = next(iter(req_args.items()))
+	# repeated keys are looked up and returned once
+	keys = list(dict.fromkeys(key.strip() for key in value.split(',') if key.strip()))
+	if not keys:
+		return make_response(jsonify({'error': f"{name} must list at least one key"})), 400
+	if len(keys) > app.config['BOOKS_MULTI_GET_MAX_KEYS']:
+		return make_response(jsonify({'error': f"at most {app.config['BOOKS_MULTI_GET_MAX_KEYS']} keys per request"})), 400
+
+	if name == 'ids':
+		# isdigit() would let through digits like '²' that int() refuses
+		if not all(re.fullmatch('[0-9]+', key) for key in keys):
+			return make_response(jsonify({'error': "ids must be integers"})), 400
+		keys = list(dict.fromkeys(int(key) for key in keys))
+		if max(keys) > MAX_ID:
+			return make_response(jsonify({'error': f"ids must be at most {MAX_ID}"})), 400
+		column = Book.id
+	else:
+		column = Book.isbn
+
+	found = Book.get_many(column, keys, app.config['BOOKS_MULTI_GET_CHUNK_SIZE'])
+	return make_response(jsonify({
+		"books": [found[key].serialize() for key in keys if key in found],
+		"missing": [key for key in keys if key not in found]
+	}))
+
+
+def stream_all_books(ndjson):
+	"""
+	retrieve all books as a streaming response, read through a server side
+	cursor so memory use doesn't grow with the catalog
+	:param ndjson: respond with newline delimited json
+	:return: http response
+	"""
+	all_books = iter(Book.iter_all(app.config['BOOKS_STREAM_BATCH_SIZE']))
+	first_book = next(all_books, None)
+
+	# check if there are no books and return 204
+	if first_book is None:
+		return make_response(jsonify({'': ''})), 204
+
+	body = stream_books(chain([first_book], all_books), app.config['BOOKS_STREAM_BATCH_SIZE'], ndjson)
+	mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+	return Response(stream_with_context(body), mimetype=mimetype)
+
+
+def get_books_page_after(req_args):
+	"""
+	retrieve a page of books after a cursor. Counting the pages is optional
+	because it's the expensive part on a large catalog
+	:param req_args: request args
+	:return: http response
+	"""
+	if not validate_cursor_schema.validate(req_args):
+		return make_response(jsonify({'error': validate_cursor_schema.errors})), 400
+
+	page_limit = min(req_args.get('limit', app.config['BOOKS_PAGE_LIMIT'], int), app.config['BOOKS_MAX_PAGE_LIMIT'])
+	if page_limit < 1:
+		return make_response(jsonify({'error': "limit must be greater than 0"})), 400
+
+	order = req_args.get('order', 'id')
+	after = None
+	if 'after' in req_args:
+		try:
+			cursor_order, after = decode_cursor(req_args['after'])
+		except ValueError as e:
+			return make_response(jsonify({'error': str(e)})), 400
+
+		if 'order' in req_args and cursor_order != order:
+			return make_response(jsonify({'error': "cursor does not match order"})), 400
+		order = cursor_order
+
+	page = Book.get_page_after(order, after, page_limit)
+	has_next = len(page) > page_limit
+	page = page[:page_limit]
+
+	result = {
+		"books": [book.serialize() for book in page],
+		"has_next": has_next,
+		"next_cursor": encode_cursor(order, page[-1].sort_key(order)) if has_next else None,
+		"limit": page_limit
+	}
+	if req_args.get('include_total') == 'true':
+		result['total_pages'] = math.ceil(Book.query.count() / page_limit)
+
+	return make_response(jsonify(result))
+
+
+@books.route('/search')
+@principal_required
+@conditional_response(list_validators)
+@cached_response(list_version)
+def api_search_books(current_user):
+	"""
+	full text search of book titles, best matches first
+	:param current_user:
+	:return:
+	"""
+	req_args = request.args
+	if not validate_search_schema.validate(req_args):
+		return make_response(jsonify({'error': validate_search_schema.errors})), 400
+
+	page_limit = min(req_args.get('limit', app.config['BOOKS_PAGE_LIMIT'], int), app.config['BOOKS_MAX_PAGE_LIMIT'])
+	if page_limit < 1:
+		return make_response(jsonify({'error': "limit must be greater than 0"})), 400
+
+	after = None
+	if 'after' in req_args:
+		try:
+			order, after = decode_cursor(req_args['after'])
+		except ValueError as e:
+			return make_response(jsonify({'error': str(e)})), 400
+		if order != 'rank':
+			return make_response(jsonify({'error': "invalid cursor"})), 400
+
+	page = Book.search(format_inputs(req_args['q']), after, page_limit)
+	has_next = len(page) > page_limit
+	page = page[:page_limit]
+
+	return make_response(jsonify({
+		"books": [book.serialize() for book, rank in page],
+		"has_next": has_next,
+		"next_cursor": encode_cursor('rank', [page[-1][1], page[-1][0].id]) if has_next else None,
+		"limit": page_limit
+	}))
+
+
+@books.route('/suggest')
+@principal_required
+def api_suggest_books(current_user):
+	"""
+	titles starting with a prefix, for search as you type. Served from the
+	worker's suggest index, or from the database while the index is cold
+	:param current_user:
+	:return:
+	"""
+	req_args = request.args
+	if not validate_suggest_schema.validate(req_args):
+		return make_response(jsonify({'error': validate_suggest_schema.errors})), 400
+
+	limit = min(req_args.get('limit', app.config['BOOKS_SUGGEST_LIMIT'], int), app.config['BOOKS_SUGGEST_MAX_LIMIT'])
+	# normalized like format_inputs, but a trailing space still means the word is complete
+	prefix = re.sub(' +', ' ', req_args['prefix'].lower().lstrip())
+	if limit < 1 or not prefix:
+		return make_response(jsonify({'error': "prefix and limit must not be empty"})), 400
+
+	suggestions, source = suggest_titles(prefix, limit)
+	rv = make_response(jsonify({
+		"suggestions": [{"id": book_id, "title": title} for book_id, title in suggestions]
+	}))
+	rv.headers['X-Suggest-Source'] = source
+	return rv
+
+
+def suggest_titles(prefix, limit):
+	"""
+	:param prefix: normalized title prefix
+	:param limit: max suggestions
+	:return: (list of (id, title), 'memory' or 'database')
+	"""
+	if app.config.get('BOOKS_SUGGEST_INDEX_ENABLED'):
+		if suggest_index.due(app.config['BOOKS_SUGGEST_REFRESH_SECONDS']):
+			refresh_suggest_index()
+
+		suggestions = suggest_index.search(prefix, limit)
+		if suggestions is not None:
+			return suggestions, 'memory'
+
+	return Book.suggest(prefix, limit), 'database'
+
+
+def refresh_suggest_index():
+	"""reload the suggest index if it's cold or titles changed on another worker, call after suggest_index.due()"""
+	if suggest_index.is_warm and CatalogVersion.titles() == suggest_index.titles_version:
+		return suggest_index.checked()
+
+	if not app.config['BOOKS_SUGGEST_LOAD_IN_BACKGROUND']:
+		return load_suggest_index()
+
+	def load():
+		with app.app_context():
+			load_suggest_index()
+
+	threading.Thread(target=load, daemon=True).start()
+
+
+def load_suggest_index():
+	"""load every title into the suggest index"""
+	try:
+		# a connection of its own, so the version and the titles come from one snapshot
+		with db.engine.connect().execution_options(isolation_level='REPEATABLE READ') as connection:
+			with connection.begin():
+				titles_version = connection.execute(
+					'SELECT coalesce(max(titles_version), 0) FROM catalog_version'
+				).scalar()
+				rows = connection.execution_options(stream_results=True).execute(db.select([Book.title, Book.id]))
+				suggest_index.load((tuple(row) for row in rows), titles_version)
+	finally:
+		if not suggest_index.is_warm:
+			suggest_index.checked()
+
+
+@books.before_app_first_request
+def warm_suggest_index():
+	"""start loading the suggest index when the worker starts serving"""
+	if app.config.get('BOOKS_SUGGEST_INDEX_ENABLED') and app.config['BOOKS_SUGGEST_LOAD_IN_BACKGROUND']:
+		if suggest_index.due(app.config['BOOKS_SUGGEST_REFRESH_SECONDS']):
+			refresh_suggest_index()
+
+
 @books.route('', methods=['POST'])
 @token_required
 def api_create_book(current_user):
@@ -155,8 +456,104 @@ def api_create_book(current_user):
 	return response('error', 'Content-type must be json', 202)
 
 
-@books.route('/<book_id>')
+def clean_book(book_data):
+	"""
+	validate and format a book the same way api_create_book does
+	:param book_data: dict with title and isbn
+	:return: (book dict, None) or (None, error)
+	"""
+	if not isinstance(book_data, dict):
+		return None, 'book must be an object'
+	if not validate_book_schema.validate(book_data):
+		return None, validate_book_schema.errors
+
+	title = format_inputs(book_data.get('title'))
+	isbn = format_inputs(book_data.get('isbn'))
+
+	if len(title) == 0:
+		return None, "title cannot be empty"
+	if len(title) > TITLE_MAX_LENGTH:
+		return None, f"title must be at most {TITLE_MAX_LENGTH} characters"
+	if len(isbn) != 10:
+		return None, "isbn length must be 10"
+	if not isbn.isnumeric():
+		return None, 'isbn must only include numbers'
+	return {'title': title, 'isbn': isbn}, None
+
+
+@books.route('/bulk', methods=['POST'])
 @token_required
+def api_create_books_in_bulk(current_user):
+	"""
+	create books from a json array or ndjson body. Valid rows are inserted in
+	batches of BOOKS_BULK_BATCH_SIZE, isbns that already exist are skipped
+	:param current_user:
+	:return: result of every row
+	"""
+
+	check_admin(current_user)
+
+	try:
+		if request.mimetype == 'application/x-ndjson':
+			rows = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+		elif request.mimetype == 'application/json':
+			rows = json.loads(request.get_data(as_text=True))
+		else:
+			return response('error', 'Content-type must be json or ndjson', 400)
+	except ValueError:
+		return response('error', 'body is not valid json', 400)
+
+	if not isinstance(rows, list):
+		return response('error', 'body must be a list of books', 400)
+	if len(rows) > app.config['BOOKS_BULK_MAX_ROWS']:
+		return response('error', f"at most {app.config['BOOKS_BULK_MAX_ROWS']} books can be created at once", 400)
+
+	results = []
+	new_books = []
+	seen_isbns = set()
+	for row, book_data in enumerate(rows):
+		book, error = clean_book(book_data)
+		if error:
+			results.append({'row': row, 'status': 'error', 'message': error})
+		elif book['isbn'] in seen_isbns:
+			results.append({'row': row, 'status': 'duplicate', 'isbn': book['isbn']})
+		else:
+			seen_isbns.add(book['isbn'])
+			new_books.append(book)
+			results.append({'row': row, 'status': 'created', 'isbn': book['isbn']})
+
+	batch_size = app.config['BOOKS_BULK_BATCH_SIZE']
+	created = {}
+	for start in range(0, len(new_books), batch_size):
+		created.update(Book.insert_many(new_books[start:start + batch_size]))
+	if created:
+		CatalogVersion.bump()
+	db.session.commit()
+
+	for result in results:
+		if result['status'] == 'created':
+			if result['isbn'] in created:
+				result['id'] = created[result['isbn']]
+			else:
+				result['status'] = 'duplicate'
+
+	counts = {'created': 0, 'duplicate': 0, 'error': 0}
+	for result in results:
+		counts[result['status']] += 1
+
+	return make_response(jsonify({
+		'status': 'success',
+		'created': counts['created'],
+		'duplicates': counts['duplicate'],
+		'errors': counts['error'],
+		'results': results
+	})), 201 if counts['created'] else 200
+
+
+@books.route('/<book_id>')
+@principal_required
+@conditional_response(book_validators)
+@cached_response(book_version)
 def api_get_book_with_id(current_user, book_id):
 	"""
 	retrieves a book with id
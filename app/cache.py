@@ -0,0 +1,145 @@
+from collections import OrderedDict
+import hashlib
+import math
+import threading
+import time
+from app.metrics import cache_counters
+
+
+class CacheStats:
+	"""counts hits and misses of an in-process cache, also exported as metrics when it has a name"""
+
+	def __init__(self, name=None):
+		self.hits = 0
+		self.misses = 0
+		self.counters = cache_counters(name) if name else None
+
+	def hit(self):
+		self.hits += 1
+		if self.counters:
+			self.counters[0].inc()
+
+	def miss(self):
+		self.misses += 1
+		if self.counters:
+			self.counters[1].inc()
+
+	@property
+	def hit_ratio(self):
+		"""fraction of lookups answered by the cache"""
+		total = self.hits + self.misses
+		if total == 0:
+			return 0.0
+		return self.hits / total
+
+	def reset(self):
+		self.hits = 0
+		self.misses = 0
+
+	def as_dict(self):
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'hit_ratio': self.hit_ratio
+		}
+
+
+class BloomFilter:
+	"""
+	Probabilistic set of strings. Membership tests can return false positives
+	but never false negatives, so a negative answer is always safe to trust.
+	"""
+
+	def __init__(self, capacity, error_rate=0.01):
+		self.capacity = capacity
+		self.error_rate = error_rate
+		self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+		self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+		self.bits = bytearray((self.size + 7) // 8)
+		self.count = 0
+
+	def _positions(self, key):
+		"""
+		derive the bit positions of a key with double hashing
+		:param key: string
+		:return: list of bit positions
+		"""
+		digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+		h1 = int.from_bytes(digest[:8], 'little')
+		h2 = int.from_bytes(digest[8:], 'little') | 1
+		return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+	def add(self, key):
+		for position in self._positions(key):
+			self.bits[position >> 3] |= 1 << (position & 7)
+		self.count += 1
+
+	def __contains__(self, key):
+		return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+	@property
+	def is_full(self):
+		"""past capacity the false positive rate grows beyond error_rate"""
+		return self.count > self.capacity
+
+
+class LRUCache:
+	"""
+	Bounded, thread-safe least recently used cache. Entries also expire
+	ttl seconds after they were stored when a ttl is given. A named cache
+	exports its hits and misses as metrics
+	"""
+
+	def __init__(self, maxsize, ttl=None, name=None):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.data = OrderedDict()
+		self.lock = threading.Lock()
+		self.stats = CacheStats(name)
+		self.evictions = 0
+		self.expirations = 0
+
+	def get(self, key, default=None):
+		with self.lock:
+			entry = self.data.get(key)
+			if entry is None:
+				self.stats.miss()
+				return default
+
+			value, expires_at = entry
+			if expires_at is not None and expires_at <= time.monotonic():
+				del self.data[key]
+				self.expirations += 1
+				self.stats.miss()
+				return default
+
+			self.data.move_to_end(key)
+			self.stats.hit()
+			return value
+
+	def set(self, key, value):
+		expires_at = time.monotonic() + self.ttl if self.ttl else None
+		with self.lock:
+			self.data[key] = (value, expires_at)
+			self.data.move_to_end(key)
+			while len(self.data) > self.maxsize:
+				self.data.popitem(last=False)
+				self.evictions += 1
+
+	def invalidate(self, key):
+		with self.lock:
+			self.data.pop(key, None)
+
+	def clear(self):
+		with self.lock:
+			self.data.clear()
+
+	def __len__(self):
+		return len(self.data)
+
+	def as_dict(self):
+		stats = self.stats.as_dict()
+		stats['evictions'] = self.evictions
+		stats['expirations'] = self.expirations
+		stats['size'] = len(self.data)
+		return stats
@@ -9,8 +9,47 @@ class BaseConfig:
 	DEBUG = False
 	SECRET_KEY = os.getenv('SECRET_KEY', 'my_very_very_VERY_loooong_password')
 	SQLALCHEMY_TRACK_MODIFICATIONS = False
+	JSON_ENGINE = 'orjson'
+	JSONIFY_PRETTYPRINT_REGULAR = False
+	SERVER_TIMING_ENABLED = True
+	METRICS_ENABLED = True
+	# /metrics answers 404 when off and, with a token, only to Authorization: Bearer <token>
+	METRICS_ENDPOINT_ENABLED = True
+	METRICS_AUTH_TOKEN = None
 	AUTH_TOKEN_EXPIRY_DAYS = 30
 	AUTH_TOKEN_EXPIRY_SECONDS = 3000
+	AUTH_STATELESS = False
+	AUTH_REFRESH_TOKENS = False
+	AUTH_ACCESS_TOKEN_EXPIRY_SECONDS = 900
+	AUTH_REFRESH_TOKEN_EXPIRY_DAYS = 30
+	PASSWORD_HASHER = 'pbkdf2'
+	PASSWORD_HASH_COST = 50000
+	PASSWORD_HASH_WORKERS = 4
+	BLACKLIST_CACHE_ENABLED = True
+	BLACKLIST_CACHE_CAPACITY = 100000
+	BLACKLIST_CACHE_ERROR_RATE = 0.01
+	BLACKLIST_CACHE_EXACT_SIZE = 10000
+	BLACKLIST_CACHE_REFRESH_SECONDS = 5
+	BLACKLIST_CACHE_SYNC_OVERLAP = 100
+	USER_CACHE_ENABLED = True
+	USER_CACHE_SIZE = 1024
+	USER_CACHE_TTL_SECONDS = 10
+	BOOKS_PAGE_LIMIT = 20
+	BOOKS_MAX_PAGE_LIMIT = 100
+	BOOKS_STREAM_BATCH_SIZE = 1000
+	BOOKS_BULK_BATCH_SIZE = 1000
+	BOOKS_BULK_MAX_ROWS = 100000
+	BOOKS_MULTI_GET_MAX_KEYS = 1000
+	BOOKS_MULTI_GET_CHUNK_SIZE = 250
+	BOOKS_CACHE_ENABLED = True
+	BOOKS_CACHE_BACKEND = 'local'
+	BOOKS_CACHE_SIZE = 1024
+	BOOKS_CACHE_UWSGI_NAME = 'books'
+	BOOKS_SUGGEST_INDEX_ENABLED = True
+	BOOKS_SUGGEST_LOAD_IN_BACKGROUND = True
+	BOOKS_SUGGEST_REFRESH_SECONDS = 5
+	BOOKS_SUGGEST_LIMIT = 10
+	BOOKS_SUGGEST_MAX_LIMIT = 50
 
 
 class DevelopmentConfig(BaseConfig):
@@ -33,14 +72,32 @@ class TestingConfig(BaseConfig):
 	AUTH_TOKEN_EXPIRY_DAYS = 0
 	AUTH_TOKEN_EXPIRY_SECONDS = 3
 	AUTH_TOKEN_EXPIRATION_TIME_DURING_TESTS = 5
+	PASSWORD_HASH_COST = 1000
+	BOOKS_SUGGEST_LOAD_IN_BACKGROUND = False
+
+
+class BenchmarkConfig(BaseConfig):
+	"""
+	Load test configuration, the test database with tokens that outlast a run
+	and the password cost of generated users
+	"""
+	SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL_TEST', postgres_local_base + 'test_' + database_name)
+	AUTH_TOKEN_EXPIRY_SECONDS = 3600
+	PASSWORD_HASH_COST = 1000
 
 
 class ProductionConfig(BaseConfig):
 	"""
 	Production application configuration
 	"""
-	DEBUG = True
+	DEBUG = False
 	SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', postgres_local_base + database_name)
-	BCRYPT_HASH_PREFIX = 13
+	PASSWORD_HASHER = 'bcrypt'
+	PASSWORD_HASH_COST = 12
 	AUTH_TOKEN_EXPIRY_DAYS = 30
 	AUTH_TOKEN_EXPIRY_SECONDS = 20
+	AUTH_REFRESH_TOKENS = True
+	BOOKS_CACHE_BACKEND = 'uwsgi'
+	# metrics name every endpoint and their traffic, they're only served to a scraper with the token
+	METRICS_AUTH_TOKEN = os.getenv('METRICS_AUTH_TOKEN')
+	METRICS_ENDPOINT_ENABLED = METRICS_AUTH_TOKEN is not None
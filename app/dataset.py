@@ -0,0 +1,247 @@
+from app import db
+from app.models import CatalogVersion
+from datetime import datetime, timedelta
+from itertools import accumulate
+from multiprocessing import Pool
+import csv
+import hashlib
+import io
+import math
+import random
+
+WORDS = (
+	'art', 'blue', 'book', 'city', 'dark', 'dream', 'earth', 'fire', 'garden', 'ghost', 'gold', 'heart',
+	'history', 'house', 'island', 'king', 'last', 'light', 'lost', 'love', 'moon', 'night', 'ocean', 'queen',
+	'river', 'road', 'secret', 'shadow', 'silver', 'song', 'star', 'stone', 'storm', 'summer', 'time', 'war',
+	'water', 'wild', 'winter', 'world'
+)
+
+# dates are offsets from a fixed point so the same seed always gives the same rows
+EPOCH = datetime(2018, 1, 1)
+
+PASSWORD = 'loadtest#Password1'
+
+
+class TextStream:
+	"""file-like object over an iterator of strings, for copy_expert"""
+
+	def __init__(self, chunks):
+		self.chunks = iter(chunks)
+		self.buffer = ''
+		self.position = 0
+
+	def read(self, size=-1):
+		if self.position >= len(self.buffer):
+			self.buffer = next(self.chunks, '')
+			self.position = 0
+
+		end = len(self.buffer) if size < 0 else self.position + size
+		data = self.buffer[self.position:end]
+		self.position = end
+		return data
+
+
+def password_hash(seed, iterations):
+	"""
+	a pbkdf2 hash of PASSWORD in werkzeug's format, salted from the seed so it's
+	the same on every run. Every generated user shares it
+	:param seed: dataset seed
+	:param iterations: pbkdf2 iterations
+	:return: password hash
+	"""
+	salt = hashlib.sha256(f'{seed}:salt'.encode('utf-8')).hexdigest()[:16]
+	digest = hashlib.pbkdf2_hmac('sha256', PASSWORD.encode('utf-8'), salt.encode('utf-8'), iterations).hex()
+	return f'pbkdf2:sha256:{iterations}${salt}${digest}'
+
+
+def chunk_random(seed, table, chunk):
+	"""every chunk has its own generator, so rows don't depend on how chunks are spread over workers"""
+	return random.Random(f'{seed}:{table}:{chunk}')
+
+
+def book_rows(spec, chunk, first_id, last_id):
+	"""
+	csv rows of books first_id to last_id
+	:return: csv text
+	"""
+	rng = chunk_random(spec['seed'], 'books', chunk)
+	out = io.StringIO()
+	writer = csv.writer(out)
+	for book_id in range(first_id, last_id + 1):
+		title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+		# multiplying by a number coprime to 10 ** 10 keeps isbns unique
+		isbn = f'{(book_id * 7919) % 10 ** 10:010}'
+		created = EPOCH + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+		writer.writerow([book_id, title, isbn, 'f', created, created])
+	return out.getvalue()
+
+
+def user_rows(spec, chunk, first_id, last_id):
+	"""
+	csv rows of users first_id to last_id
+	:return: csv text
+	"""
+	rng = chunk_random(spec['seed'], 'users', chunk)
+	out = io.StringIO()
+	writer = csv.writer(out)
+	for user_id in range(first_id, last_id + 1):
+		created = EPOCH + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+		writer.writerow([
+			user_id, f'{spec["prefix"]}{user_id}', f'{spec["prefix"]}{user_id}@mail.com',
+			spec['password_hash'], 'f', 0, created, created
+		])
+	return out.getvalue()
+
+
+_book_weights = {}
+
+
+def book_weights(books, skew):
+	"""
+	cumulative zipf weights of book popularity ranks, cached per worker process
+	:param books: number of books
+	:param skew: zipf exponent, 0 borrows every book equally
+	:return: list of cumulative weights
+	"""
+	key = (books, skew)
+	if key not in _book_weights:
+		_book_weights.clear()
+		_book_weights[key] = list(accumulate(1 / rank ** skew for rank in range(1, books + 1)))
+	return _book_weights[key]
+
+
+def popular_book(rank, books):
+	"""
+	spread popularity ranks over book ids so hot books aren't all the oldest ones
+	:param rank: popularity rank from 0
+	:param books: number of books
+	:return: book offset from 0
+	"""
+	# a step near books / golden ratio coprime to books visits every offset once
+	step = int(books * 0.6180339887) | 1
+	while math.gcd(step, books) != 1:
+		step += 2
+	return (rank * step) % books
+
+
+def loan_rows(spec, chunk, first_id, last_id):
+	"""
+	csv rows of returned loans first_id to last_id. Books are drawn from a zipf
+	distribution, users uniformly
+	:return: csv text
+	"""
+	rng = chunk_random(spec['seed'], 'loans', chunk)
+	ranks = rng.choices(range(spec['books']), cum_weights=book_weights(spec['books'], spec['skew']), k=last_id - first_id + 1)
+	out = io.StringIO()
+	writer = csv.writer(out)
+	for loan_id, rank in zip(range(first_id, last_id + 1), ranks):
+		book_id = spec['first_book'] + popular_book(rank, spec['books'])
+		user_id = spec['first_user'] + rng.randrange(spec['users'])
+		borrowed = EPOCH + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+		returned = borrowed + timedelta(seconds=rng.randrange(3600, 30 * 24 * 3600))
+		writer.writerow([loan_id, user_id, book_id, borrowed, returned])
+	return out.getvalue()
+
+
+def _run_chunk(job):
+	func, spec, chunk, first_id, last_id = job
+	return func(spec, chunk, first_id, last_id)
+
+
+def generate_chunks(func, spec, first_id, count, chunk_size, pool=None):
+	"""
+	generate csv text for count rows in chunks, in order
+	:param func: row generator
+	:param spec: dataset parameters
+	:param first_id: id of the first row
+	:param count: number of rows
+	:param chunk_size: rows per chunk
+	:param pool: worker pool, None generates on this process
+	:return: iterator of csv text
+	"""
+	jobs = (
+		(func, spec, chunk, first_id + start, first_id + min(start + chunk_size, count) - 1)
+		for chunk, start in enumerate(range(0, count, chunk_size))
+	)
+	if pool is None:
+		return map(_run_chunk, jobs)
+	return pool.imap(_run_chunk, jobs)
+
+
+def generate(books, users, loans, open_loans=0, skew=1.0, seed=0, workers=1, chunk_size=10000, password_iterations=1000):
+	"""
+	Fill the database with a synthetic catalog, users and loan history. Rows are
+	written with COPY and generated by worker processes when workers > 1. The
+	same seed gives the same rows whatever the number of workers
+	:param books: number of books
+	:param users: number of users
+	:param loans: number of returned loans
+	:param open_loans: number of books currently on loan, at most one per book
+	:param skew: zipf exponent of book popularity
+	:param seed: random seed
+	:param workers: generator processes
+	:param chunk_size: rows generated per task
+	:param password_iterations: pbkdf2 iterations of the users' shared password hash
+	:return: dict of rows written per table
+	"""
+	if books < 1 or users < 1:
+		raise ValueError('at least one book and one user are needed')
+	if open_loans > books:
+		raise ValueError('there can be at most one open loan per book')
+	if db.session.execute('SELECT EXISTS (SELECT 1 FROM books) OR EXISTS (SELECT 1 FROM borrowed_books)').scalar():
+		raise ValueError('books and borrowed_books must be empty')
+
+	first_user = db.session.execute('SELECT coalesce(max(id), 0) + 1 FROM users').scalar()
+	spec = {
+		'seed': seed,
+		'books': books,
+		'users': users,
+		'skew': skew,
+		'first_book': 1,
+		'first_user': first_user,
+		'prefix': f'loaduser{seed}-',
+		'password_hash': password_hash(seed, password_iterations)
+	}
+
+	cursor = db.session.connection().connection.cursor()
+	tables = (
+		('books (id, title, isbn, is_borrowed, date_created, date_modified)', book_rows, 1, books),
+		('users (id, username, email, password_hash, is_admin, token_version, date_created, date_modified)', user_rows, first_user, users),
+		('borrowed_books (id, user_id, book_id, borrow_date, return_date)', loan_rows, 1, loans),
+	)
+
+	pool = Pool(workers) if workers > 1 else None
+	try:
+		for table, func, first_id, count in tables:
+			if count:
+				chunks = generate_chunks(func, spec, first_id, count, chunk_size, pool)
+				cursor.copy_expert(f'COPY {table} FROM STDIN WITH (FORMAT csv)', TextStream(chunks))
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+
+	# open loans are newer than the history and go to distinct books
+	rng = chunk_random(seed, 'open_loans', 0)
+	open_rows = io.StringIO()
+	writer = csv.writer(open_rows)
+	for loan_id, book_id in enumerate(sorted(rng.sample(range(1, books + 1), open_loans)), start=loans + 1):
+		writer.writerow([
+			loan_id, first_user + rng.randrange(users), book_id,
+			EPOCH + timedelta(days=366, seconds=rng.randrange(24 * 3600))
+		])
+	open_rows.seek(0)
+	cursor.copy_expert('COPY borrowed_books (id, user_id, book_id, borrow_date) FROM STDIN WITH (FORMAT csv)', open_rows)
+	cursor.execute(
+		'UPDATE books SET is_borrowed = true '
+		'WHERE id IN (SELECT book_id FROM borrowed_books WHERE return_date IS NULL)'
+	)
+
+	# searches scan the gin index's pending list until it's merged, do it now rather than on autovacuum
+	cursor.execute("SELECT gin_clean_pending_list('ix_books_title_search')")
+	for table in ('books', 'users', 'borrowed_books'):
+		cursor.execute(f"SELECT setval('{table}_id_seq', (SELECT max(id) FROM {table}))")
+		cursor.execute(f'ANALYZE {table}')
+	CatalogVersion.bump()
+	db.session.commit()
+	return {'books': books, 'users': users, 'borrowed_books': loans + open_loans}
@@ -0,0 +1,38 @@
+from flask import current_app
+from flask.json import JSONEncoder as FlaskJSONEncoder
+from app.timing import timed
+import re
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+NON_ASCII = re.compile('[^\x00-\x7f]')
+
+
+class JSONEncoder(FlaskJSONEncoder):
+	"""
+	Encodes responses with orjson when it's installed and JSON_ENGINE is 'orjson',
+	else with the standard library encoder. Both write the same json: datetimes
+	go through flask's default as HTTP dates and, with JSON_AS_ASCII, non ascii
+	text is escaped.
+	"""
+
+	def encode(self, o):
+		with timed('json'):
+			return self.encode_with_engine(o)
+
+	def encode_with_engine(self, o):
+		if orjson is None or current_app.config['JSON_ENGINE'] != 'orjson' or self.indent not in (None, 2):
+			return super().encode(o)
+
+		option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+		if self.sort_keys:
+			option |= orjson.OPT_SORT_KEYS
+		if self.indent:
+			option |= orjson.OPT_INDENT_2
+		encoded = orjson.dumps(o, default=self.default, option=option).decode('utf-8')
+		# orjson can't escape, the few responses with non ascii text are encoded again
+		if self.ensure_ascii and NON_ASCII.search(encoded):
+			return super().encode(o)
+		return encoded
@@ -0,0 +1,128 @@
+from flask import Response, abort, current_app, request, _request_ctx_stack
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.multiprocess import MultiProcessCollector
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+import hmac
+import os
+import time
+
+# Metrics are kept per process. Under uWSGI every worker writes them to mmapped
+# files in PROMETHEUS_MULTIPROC_DIR and a scrape adds up the files of all workers,
+# the directory has to be set before prometheus_client is imported
+
+REQUESTS = Counter(
+	'http_requests_total', 'HTTP requests served',
+	['blueprint', 'endpoint', 'method', 'status']
+)
+REQUEST_LATENCY = Histogram(
+	'http_request_duration_seconds', 'Time to serve a request',
+	['blueprint', 'endpoint']
+)
+DB_QUERIES = Counter(
+	'db_queries_total', 'SQL statements executed, outside requests the endpoint is empty',
+	['blueprint', 'endpoint']
+)
+DB_POOL_CHECKOUT = Histogram(
+	'db_pool_checkout_seconds', 'Time waited for a pooled database connection',
+	buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5, 30)
+)
+CACHE_LOOKUPS = Counter(
+	'cache_lookups_total', 'Cache lookups, the hit ratio is the rate of hits over the rate of all lookups',
+	['cache', 'result']
+)
+
+# requests that matched no route share one label, so unknown urls can't grow the label set
+UNMATCHED = '<unmatched>'
+
+
+def cache_counters(name):
+	"""
+	:param name: cache label
+	:return: (hit counter, miss counter)
+	"""
+	return CACHE_LOOKUPS.labels(name, 'hit'), CACHE_LOOKUPS.labels(name, 'miss')
+
+
+class TimedQueuePool(QueuePool):
+	"""QueuePool that records how long checkouts wait, opening a new connection included"""
+
+	def _do_get(self):
+		start = time.perf_counter()
+		try:
+			return super()._do_get()
+		finally:
+			DB_POOL_CHECKOUT.observe(time.perf_counter() - start)
+
+
+def multiprocess_dir():
+	"""the multiprocess directory, None when metrics are only kept in memory"""
+	return os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+
+def registry():
+	"""
+	:return: registry of every worker's metrics in multiprocess mode, else of this process
+	"""
+	path = multiprocess_dir()
+	if path is None:
+		return REGISTRY
+	collected = CollectorRegistry()
+	MultiProcessCollector(collected, path)
+	return collected
+
+
+def request_labels():
+	return request.blueprint or '', request.endpoint or UNMATCHED
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+	ctx = _request_ctx_stack.top
+	if ctx is not None and 'app.metrics.started' in ctx.request.environ:
+		ctx.request.environ['app.metrics.queries'] += 1
+	else:
+		DB_QUERIES.labels('', '').inc()
+
+
+def metrics():
+	if not current_app.config['METRICS_ENDPOINT_ENABLED']:
+		abort(404)
+	token = current_app.config['METRICS_AUTH_TOKEN']
+	authorization = request.headers.get('Authorization', '').encode('utf-8')
+	if token is not None and not hmac.compare_digest(authorization, f'Bearer {token}'.encode('utf-8')):
+		return Response('unauthorized', status=401, headers={'WWW-Authenticate': 'Bearer'})
+	return Response(generate_latest(registry()), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+	"""
+	Count requests, their status and latency per endpoint when METRICS_ENABLED,
+	and serve every metric at /metrics in the Prometheus text format, restricted
+	by METRICS_ENDPOINT_ENABLED and METRICS_AUTH_TOKEN
+	:param app: flask app
+	:return:
+	"""
+
+	@app.before_request
+	def start_request_metrics():
+		if app.config.get('METRICS_ENABLED'):
+			request.environ['app.metrics.started'] = time.perf_counter()
+			request.environ['app.metrics.queries'] = 0
+
+	@app.after_request
+	def record_request_metrics(response):
+		started = request.environ.pop('app.metrics.started', None)
+		if started is None:
+			return response
+
+		blueprint, endpoint = request_labels()
+		REQUEST_LATENCY.labels(blueprint, endpoint).observe(time.perf_counter() - started)
+		REQUESTS.labels(blueprint, endpoint, request.method, str(response.status_code)).inc()
+		queries = request.environ.pop('app.metrics.queries')
+		if queries:
+			DB_QUERIES.labels(blueprint, endpoint).inc(queries)
+		return response
+
+	app.add_url_rule('/metrics', 'metrics', metrics)
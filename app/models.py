@@ -1,12 +1,24 @@
 from app import db, app
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.auth import hashers
+from app.auth.blacklist_cache import blacklist_cache
+from app.auth.user_cache import user_cache
+from app.books.suggest import suggest_index
+from sqlalchemy import event
+from sqlalchemy.orm.base import NO_VALUE
+from sqlalchemy.dialects import postgresql
+from itertools import chain
+import hashlib
 import jwt
+import uuid
 from datetime import datetime, timedelta
 
 
 class Book(db.Model):
 	"""instances a book"""
 	__tablename__ = 'books'
+	__table_args__ = (
+		db.Index('ix_books_title_id', 'title', 'id'),
+	)
 
 	id = db.Column(db.Integer, primary_key=True)
 	title = db.Column(db.String(150), nullable=False)
@@ -30,6 +42,109 @@ class Book(db.Model):
 	def get_all():
 		return Book.query.all()
 
+	@staticmethod
+	def insert_many(books):
+		"""
+		Insert books in one multi-row statement. Books whose isbn already exists
+		are skipped instead of failing the whole statement
+		:param books: list of dicts with title and isbn
+		:return: dict of isbn to id of the books inserted
+		"""
+		statement = postgresql.insert(Book.__table__).values(books).on_conflict_do_nothing(
+			index_elements=['isbn']
+		).returning(Book.id, Book.isbn)
+		return {isbn: book_id for book_id, isbn in db.session.execute(statement)}
+
+	@staticmethod
+	def iter_all(batch_size):
+		"""
+		iterate over every book through a server side cursor, holding at most
+		batch_size rows in memory
+		:param batch_size: rows fetched per round trip
+		:return: iterator of books
+		"""
+		return Book.query.order_by(Book.id).execution_options(stream_results=True).yield_per(batch_size)
+
+	@staticmethod
+	def get_page_after(order, after, limit):
+		"""
+		Keyset pagination. Seeks past the last book of the previous page on the
+		primary key or on ix_books_title_id instead of counting OFFSET rows
+		:param order: 'id' or 'title'
+		:param after: sort key of the last book on the previous page, None for the first page
+		:param limit: page size
+		:return: up to limit + 1 books, the extra one tells there is a next page
+		"""
+		query = Book.query
+		if order == 'title':
+			if after:
+				query = query.filter(db.tuple_(Book.title, Book.id) > db.tuple_(*after))
+			query = query.order_by(Book.title, Book.id)
+		else:
+			if after:
+				query = query.filter(Book.id > after[0])
+			query = query.order_by(Book.id)
+		return query.limit(limit + 1).all()
+
+	@staticmethod
+	def search(text, after, limit):
+		"""
+		Full text search of titles through the GIN index on TITLE_SEARCH, best
+		matches first. Pages seek past the rank and id of the previous page
+		:param text: search terms, a title matches when it has every word
+		:param after: [rank, id] of the last book on the previous page, None for the first page
+		:param limit: page size
+		:return: up to limit + 1 (book, rank) rows, the extra one tells there is a next page
+		"""
+		terms = db.func.plainto_tsquery('simple', text)
+		# ts_rank is a real, as a double it survives the round trip through the cursor exactly
+		rank = db.cast(db.func.ts_rank(TITLE_SEARCH, terms), postgresql.DOUBLE_PRECISION)
+		query = db.session.query(Book, rank).filter(TITLE_SEARCH.op('@@')(terms))
+		if after:
+			query = query.filter(db.or_(rank < after[0], db.and_(rank == after[0], Book.id > after[1])))
+		return query.order_by(rank.desc(), Book.id).limit(limit + 1).all()
+
+	@staticmethod
+	def get_many(column, keys, chunk_size):
+		"""
+		Books whose column is one of keys, with one = ANY(:keys) query per chunk.
+		The keys are a single array parameter, so every chunk runs the same statement
+		:param column: Book.id or Book.isbn
+		:param keys: list of ids or isbns
+		:param chunk_size: keys per query
+		:return: dict of key to book
+		"""
+		found = {}
+		for start in range(0, len(keys), chunk_size):
+			chunk = db.bindparam('keys', keys[start:start + chunk_size], type_=postgresql.ARRAY(column.type))
+			for book in Book.query.filter(column == db.any_(chunk)):
+				found[getattr(book, column.key)] = book
+		return found
+
+	@staticmethod
+	def suggest(prefix, limit):
+		"""
+		books whose title starts with prefix, in the suggest index's order. Used
+		while that index is cold, the LIKE is served by the pg_trgm index on title
+		:param prefix: normalized title prefix
+		:param limit: max suggestions
+		:return: list of (id, title)
+		"""
+		pattern = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+		return db.session.query(Book.id, Book.title).filter(
+			Book.title.like(pattern, escape='\\')
+		).order_by(Book.title.collate('C'), Book.id).limit(limit).all()
+
+	def sort_key(self, order):
+		"""
+		the values a page ordered by order is sorted on
+		:param order: 'id' or 'title'
+		:return: list
+		"""
+		if order == 'title':
+			return [self.title, self.id]
+		return [self.id]
+
 	def delete(self):
 		db.session.delete(self)
 		db.session.commit()
@@ -49,14 +164,222 @@ class Book(db.Model):
 		return f"<Book {self.title}"
 
 
+# titles are lowercased with single spaces by format_inputs, the simple config only
+# splits words. Searches use this same expression, so Postgres matches it to the index
+TITLE_SEARCH = db.func.to_tsvector('simple', Book.__table__.c.title)
+db.Index('ix_books_title_search', TITLE_SEARCH, postgresql_using='gin')
+
+# bumped after every loan and return. nextval takes no row lock and isn't rolled
+# back, so concurrent loans never wait on each other for it
+BOOK_AVAILABILITY = db.Sequence('book_availability_version', metadata=db.Model.metadata)
+
+
+class CatalogVersion(db.Model):
+	"""
+	Counter bumped by every write to the catalog, in the write's own transaction.
+	Cached catalog responses are tagged with it and with the availability
+	sequence, a response cached before a write stops matching as soon as the
+	write commits
+	"""
+	__tablename__ = 'catalog_version'
+	id = db.Column(db.Integer, primary_key=True)
+	version = db.Column(db.BigInteger, nullable=False, default=0)
+	# moves only when titles change, borrowing and returning don't touch it
+	titles_version = db.Column(db.BigInteger, nullable=False, default=0)
+
+	@staticmethod
+	def bump(titles=True):
+		"""
+		increment the version, the caller commits
+		:param titles: titles were added, changed or deleted, increments titles_version too
+		:return: the new titles_version
+		"""
+		return db.session.execute(
+			'INSERT INTO catalog_version (id, version, titles_version) VALUES (1, 1, :titles) '
+			'ON CONFLICT (id) DO UPDATE SET version = catalog_version.version + 1, '
+			'titles_version = catalog_version.titles_version + EXCLUDED.titles_version '
+			'RETURNING titles_version',
+			{'titles': int(titles)}
+		).scalar()
+
+	@staticmethod
+	def bump_availability():
+		"""
+		Move the availability version after a loan or return has committed. A
+		response read before the bump is rendered either before the write or after
+		it and is stored under the old version, which the bump retires
+		"""
+		db.session.execute("SELECT nextval('book_availability_version')")
+
+	@staticmethod
+	def current():
+		"""
+		the committed version and the availability version
+		:return: (int, int)
+		"""
+		row = db.session.execute(
+			# the first nextval returns the start value, is_called tells it apart from no bump yet
+			'SELECT catalog_version.version, '
+			'CASE WHEN availability.is_called THEN availability.last_value ELSE 0 END AS availability '
+			'FROM book_availability_version AS availability '
+			'LEFT JOIN catalog_version ON catalog_version.id = 1'
+		).first()
+		return row.version or 0, row.availability
+
+	@staticmethod
+	def titles():
+		"""
+		the committed titles_version
+		:return: int
+		"""
+		return db.session.execute('SELECT titles_version FROM catalog_version WHERE id = 1').scalar() or 0
+
+
+def title_changes(session):
+	"""
+	the changes a flush makes to book titles
+	:param session: flushing session
+	:return: (books touched, list of ('add' or 'remove', book id, title or None))
+	"""
+	touched = False
+	changes = []
+	for obj in chain(session.new, session.dirty, session.deleted):
+		if not isinstance(obj, Book):
+			continue
+		touched = True
+		title = db.inspect(obj).attrs.title
+		if obj in session.new:
+			changes.append(('add', obj.id, obj.title))
+		elif obj in session.deleted:
+			changes.append(('remove', obj.id, title.loaded_value if title.loaded_value is not NO_VALUE else None))
+		elif title.history.added:
+			changes.append(('remove', obj.id, title.history.deleted[0] if title.history.deleted else None))
+			changes.append(('add', obj.id, obj.title))
+	return touched, changes
+
+
+@event.listens_for(db.session, 'after_flush')
+def bump_catalog_version_on_flush(session, flush_context):
+	"""
+	books added, changed or deleted through the ORM, Book.save and Book.delete
+	included, bump the version. Title changes wait for the commit to reach the suggest index
+	"""
+	touched, changes = title_changes(session)
+	if not touched:
+		return
+
+	titles_version = CatalogVersion.bump(titles=bool(changes))
+	if changes:
+		session.info.setdefault('title_changes', []).extend(changes)
+		session.info['title_bumps'] = session.info.get('title_bumps', 0) + 1
+		session.info['titles_version'] = titles_version
+
+
+@event.listens_for(db.session, 'after_commit')
+def apply_title_changes(session):
+	"""hand committed title changes to this worker's suggest index"""
+	changes = session.info.pop('title_changes', None)
+	bumps = session.info.pop('title_bumps', 0)
+	titles_version = session.info.pop('titles_version', None)
+	if changes:
+		suggest_index.apply(changes, titles_version, bumps)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_title_changes(session):
+	for key in ('title_changes', 'title_bumps', 'titles_version'):
+		session.info.pop(key, None)
+
+
+@event.listens_for(db.session, 'after_bulk_update')
+@event.listens_for(db.session, 'after_bulk_delete')
+def bump_catalog_version_on_bulk(update_context):
+	"""as above for Book.query.update() and Book.query.delete(), the suggest index reloads"""
+	if update_context.mapper.class_ is Book:
+		CatalogVersion.bump()
+
+
+# flag the book as lent and open the loan in one round trip
+BORROW_BOOK = db.text(
+	'WITH borrowed AS ('
+	'UPDATE books SET is_borrowed = true, date_modified = now() '
+	'WHERE id = :book_id AND is_borrowed IS NOT true RETURNING id'
+	') '
+	'INSERT INTO borrowed_books (user_id, book_id, borrow_date) '
+	'SELECT :user_id, id, now() FROM borrowed RETURNING id'
+)
+
+# close the open loan and make the book available in one round trip
+RETURN_BOOK = db.text(
+	'WITH returned AS ('
+	'UPDATE borrowed_books SET return_date = now() '
+	'WHERE book_id = :book_id AND user_id = :user_id AND return_date IS NULL RETURNING book_id'
+	') '
+	'UPDATE books SET is_borrowed = false, date_modified = now() '
+	'FROM returned WHERE books.id = returned.book_id RETURNING books.id'
+)
+
+
 class BorrowedBook(db.Model):
 	__tablename__ = 'borrowed_books'
+	__table_args__ = (
+		# open loans are a small slice of an ever growing table
+		db.Index('ix_borrowed_books_open_user_id', 'user_id', postgresql_where=db.text('return_date IS NULL')),
+		db.Index('ix_borrowed_books_open_book_id', 'book_id', postgresql_where=db.text('return_date IS NULL')),
+		db.Index('ix_borrowed_books_user_id_return_date', 'user_id', 'return_date'),
+	)
 	id = db.Column(db.Integer, primary_key=True)
 	user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
 	book_id = db.Column(db.Integer, db.ForeignKey('books.id'))
 	borrow_date = db.Column(db.DateTime, default=db.func.current_timestamp())
 	return_date = db.Column(db.DateTime)
 
+	@staticmethod
+	def borrow(book_id, user_id):
+		"""
+		Lend a book in a single statement. The conditional update only matches a
+		book that isn't on loan, so of two concurrent borrows exactly one wins
+		:param book_id: book id
+		:param user_id: user id
+		:return: id of the new loan, None if the book is missing or on loan
+		"""
+		loan_id = db.session.execute(BORROW_BOOK, {'book_id': book_id, 'user_id': user_id}).scalar()
+		db.session.commit()
+		if loan_id is not None:
+			CatalogVersion.bump_availability()
+		return loan_id
+
+	@staticmethod
+	def return_book(book_id, user_id):
+		"""
+		Close a user's open loan of a book and make the book available again in a
+		single statement
+		:param book_id: book id
+		:param user_id: user id
+		:return: True if the user had the book on loan
+		"""
+		book_id = db.session.execute(RETURN_BOOK, {'book_id': book_id, 'user_id': user_id}).scalar()
+		db.session.commit()
+		if book_id is not None:
+			CatalogVersion.bump_availability()
+		return book_id is not None
+
+	@staticmethod
+	def query_with_books(user_id, returned):
+		"""
+		a user's borrowed books joined to the books table, so each row's book is
+		loaded by the same query
+		:param user_id: user id
+		:param returned: True for the borrowing history, False for books not returned yet
+		:return: query
+		"""
+		query = BorrowedBook.query.join(BorrowedBook.books).options(db.contains_eager(BorrowedBook.books))
+		if returned:
+			query = query.filter(BorrowedBook.return_date != None)
+		else:
+			query = query.filter(BorrowedBook.return_date == None)
+		return query.filter(BorrowedBook.user_id == user_id).order_by(BorrowedBook.id)
+
 
 class User(db.Model):
 	"""defines users"""
@@ -66,6 +389,7 @@ class User(db.Model):
 	email = db.Column(db.String(100), index=True, unique=True, nullable=False)
 	password_hash = db.Column(db.String, nullable=False)
 	is_admin = db.Column(db.Boolean, default=False)
+	token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 	date_created = db.Column(db.DateTime, default=db.func.current_timestamp())
 	date_modified = db.Column(
 		db.DateTime, default=db.func.current_timestamp(),
@@ -84,21 +408,32 @@ class User(db.Model):
 		"""
 		Set password to a hashed password
 		"""
-		self.password_hash = generate_password_hash(password)
+		self.password_hash = hashers.hash_password(password)
 
 	def verify_password(self, password):
 		"""
 		Check if hashed password matches actual password
 		"""
-		return check_password_hash(self.password_hash, password)
+		return hashers.verify_password(password, self.password_hash)
+
+	def password_needs_rehash(self):
+		"""
+		Check if the password was hashed with an older hasher or cost
+		"""
+		return hashers.needs_rehash(self.password_hash)
 
 	def save(self):
 		"""
 		save user to database
 		"""
 		db.session.add(self)
+		db.session.flush()
+		# the token is made before commit expires the user, reading it back would take another select
+		user_id = self.id
+		token = self.generate_token(user_id)
 		db.session.commit()
-		return self.generate_token(self.id)
+		user_cache.invalidate(user_id)
+		return token
 
 	def __repr__(self):
 		return f'<user: {self.username}>'
@@ -107,15 +442,24 @@ class User(db.Model):
 		""" Generates the access token"""
 
 		try:
-			# set up a payload with an expiration time
+			# set up a payload with an expiration time, measured from the same instant as iat
+			now = datetime.utcnow()
 			payload = {
-				'exp': datetime.utcnow() + timedelta(
+				'exp': now + timedelta(
 					days=app.config.get('AUTH_TOKEN_EXPIRY_DAYS'),
 					seconds=app.config.get('AUTH_TOKEN_EXPIRY_SECONDS')
 				),
-				'iat': datetime.utcnow(),
-				'sub': user_id
+				'iat': now,
+				'sub': user_id,
+				'jti': uuid.uuid4().hex,
+				'adm': bool(self.is_admin),
+				'ver': self.token_version or 0
 			}
+
+			# short-lived access tokens are never blacklisted, they simply expire
+			if app.config.get('AUTH_REFRESH_TOKENS'):
+				payload['exp'] = now + timedelta(seconds=app.config.get('AUTH_ACCESS_TOKEN_EXPIRY_SECONDS'))
+				payload['typ'] = 'access'
 			# create the byte string token using the payload and the SECRET key
 			jwt_string = jwt.encode(
 				payload=payload,
@@ -129,16 +473,67 @@ class User(db.Model):
 			# return an error in string format if an exception occurs
 			return str(e)
 
+	def generate_refresh_token(self):
+		"""
+		Issue a refresh token and store it so it can be rotated and revoked
+		:return: token
+		"""
+		now = datetime.utcnow()
+		payload = {
+			'exp': now + timedelta(days=app.config.get('AUTH_REFRESH_TOKEN_EXPIRY_DAYS')),
+			'iat': now,
+			'sub': self.id,
+			'jti': uuid.uuid4().hex,
+			'typ': 'refresh'
+		}
+		db.session.add(RefreshToken(jti=payload['jti'], user_id=payload['sub'], expires_at=payload['exp']))
+		db.session.commit()
+
+		return jwt.encode(
+			payload=payload,
+			key=str(app.config['SECRET_KEY']),
+			algorithm='HS256'
+		)
+
+	def bump_token_version(self):
+		"""
+		invalidate the role claims of every token issued so far. The change is
+		saved with the user's next commit
+		"""
+		self.token_version = (self.token_version or 0) + 1
+
 	@staticmethod
 	def decode_token(token):
 		"""Decodes the access token from the Authorization header."""
+		payload = User.decode_token_claims(token)
+		if isinstance(payload, str):
+			return payload
+		return payload['sub']
+
+	@staticmethod
+	def decode_token_claims(token):
+		"""
+		Decodes the access token and returns all of its claims
+		:param token: token
+		:return: payload dict, or an error string
+		"""
 		try:
 			# try to decode the token using our SECRET variable
 			payload = jwt.decode(token, str(app.config['SECRET_KEY']), algorithms='HS256')
-			is_token_blacklisted = BlacklistToken.check_blacklist(token)
+			token_type = payload.get('typ')
+
+			# refresh tokens are only accepted by the refresh endpoint
+			if token_type == 'refresh':
+				return "Invalid token. Please register or login"
+
+			# with refresh tokens enabled, access tokens are short-lived and never blacklisted
+			if token_type == 'access' and app.config.get('AUTH_REFRESH_TOKENS'):
+				return payload
+
+			is_token_blacklisted = BlacklistToken.check_blacklist(BlacklistToken.token_key(token, payload))
 			if is_token_blacklisted:
 				return 'Token was Blacklisted, Please login In'
-			return payload['sub']
+			return payload
 		except jwt.ExpiredSignatureError:
 			# the token is expired, return an error string
 			return "Expired token. Please login to get a new token"
@@ -168,21 +563,193 @@ class User(db.Model):
 
 
 class BlacklistToken(db.Model):
-	"""table stores invalid tokens"""
+	"""
+	table stores invalid tokens by their jti claim, together with the token's
+	expiry so that rows can be purged once the token would be rejected anyway
+	"""
 
 	__tablename__ = 'black_list_tokens'
 	id = db.Column(db.Integer, primary_key=True)
-	token = db.Column(db.String, unique=True, nullable=False)
-	blacklisted_on = db.Column(db.DateTime, nullable=False, default=datetime.now())
+	jti = db.Column(db.String(64), unique=True, nullable=False)
+	expires_at = db.Column(db.DateTime, nullable=False, index=True)
+	blacklisted_on = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+	def __init__(self, token):
+		payload = jwt.decode(token, algorithms=['HS256'], options={'verify_signature': False, 'verify_exp': False})
+		self.jti = BlacklistToken.token_key(token, payload)
+		self.expires_at = datetime.utcfromtimestamp(payload['exp'])
 
 	def blacklist(self):
 		db.session.add(self)
 		db.session.commit()
+		blacklist_cache.add(self.jti)
+
+	@staticmethod
+	def token_key(token, payload):
+		"""
+		returns the key a token is blacklisted under. Tokens issued before the jti claim
+		existed are keyed by the sha256 digest of the token
+		:param token: token
+		:param payload: decoded token payload
+		:return: string
+		"""
+		jti = payload.get('jti')
+		if jti:
+			return jti
+		if isinstance(token, str):
+			token = token.encode('utf-8')
+		return hashlib.sha256(token).hexdigest()
+
+	@staticmethod
+	def check_blacklist(jti):
+		"""
+		check if a token has been blacklisted. With BLACKLIST_CACHE_ENABLED most
+		lookups are answered by the worker's blacklist cache without a query
+		:param jti: token key
+		:return: bool
+		"""
+		if app.config.get('BLACKLIST_CACHE_ENABLED'):
+			blacklist_cache.sync(BlacklistToken.blacklisted_since)
+			return blacklist_cache.contains(jti, BlacklistToken.is_blacklisted)
+		return BlacklistToken.is_blacklisted(jti)
 
 	@staticmethod
-	def check_blacklist(token):
-		res = BlacklistToken.query.filter_by(token=token).first()
+	def is_blacklisted(jti):
+		"""check the database for a blacklisted token"""
+		res = BlacklistToken.query.filter_by(jti=jti).first()
 
 		if res:
 			return True
 		return False
+
+	@staticmethod
+	def blacklisted_since(last_id):
+		"""
+		stream unexpired blacklisted tokens added after last_id
+		:param last_id: id
+		:return: (id, jti) rows
+		"""
+		return db.session.query(BlacklistToken.id, BlacklistToken.jti).filter(
+			BlacklistToken.id > last_id,
+			BlacklistToken.expires_at > datetime.utcnow()
+		).order_by(BlacklistToken.id).yield_per(1000)
+
+	@staticmethod
+	def purge_expired(batch_size=1000):
+		"""
+		delete blacklisted tokens that have expired, one batch per transaction
+		:param batch_size: rows deleted per batch
+		:return: number of deleted rows
+		"""
+		return purge_expired_rows(BlacklistToken, batch_size)
+
+
+class RefreshToken(db.Model):
+	"""refresh tokens issued to users. Each one can be exchanged for new tokens once"""
+
+	__tablename__ = 'refresh_tokens'
+	id = db.Column(db.Integer, primary_key=True)
+	jti = db.Column(db.String(32), unique=True, nullable=False)
+	user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+	expires_at = db.Column(db.DateTime, nullable=False, index=True)
+	revoked_at = db.Column(db.DateTime)
+	created_on = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+	@staticmethod
+	def rotate(token):
+		"""
+		Exchange a refresh token for a new access and refresh token. Presenting a
+		token that was already used revokes all of the user's refresh tokens
+		:param token: refresh token
+		:return: (user, access token, refresh token), or an error string
+		"""
+		try:
+			payload = jwt.decode(token, str(app.config['SECRET_KEY']), algorithms='HS256')
+		except jwt.ExpiredSignatureError:
+			return "Expired token. Please login to get a new token"
+		except jwt.InvalidTokenError:
+			return "Invalid token. Please register or login"
+
+		if payload.get('typ') != 'refresh':
+			return "Invalid token. Please register or login"
+
+		refresh_token = RefreshToken.query.filter_by(jti=payload['jti']).with_for_update().first()
+		if not refresh_token:
+			db.session.rollback()
+			return "Invalid token. Please register or login"
+
+		if refresh_token.revoked_at:
+			# a rotated token came back, it may have leaked
+			RefreshToken.revoke_all(refresh_token.user_id)
+			return 'Token was revoked, Please login In'
+
+		refresh_token.revoked_at = datetime.utcnow()
+		db.session.commit()
+
+		user = User.get_by_id(refresh_token.user_id)
+		return user, user.generate_token(user.id), user.generate_refresh_token()
+
+	@staticmethod
+	def revoke(token, user_id):
+		"""
+		revoke one of a user's refresh tokens
+		:param token: refresh token
+		:param user_id: owner of the token
+		:return: bool
+		"""
+		try:
+			payload = jwt.decode(token, str(app.config['SECRET_KEY']), algorithms='HS256')
+		except jwt.InvalidTokenError:
+			return False
+
+		revoked = RefreshToken.query.filter(
+			RefreshToken.jti == payload.get('jti'),
+			RefreshToken.user_id == user_id,
+			RefreshToken.revoked_at == None
+		).update({'revoked_at': datetime.utcnow()}, synchronize_session=False)
+		db.session.commit()
+		return revoked > 0
+
+	@staticmethod
+	def revoke_all(user_id):
+		"""
+		revoke every refresh token of a user
+		:param user_id: user id
+		:return:
+		"""
+		RefreshToken.query.filter(
+			RefreshToken.user_id == user_id,
+			RefreshToken.revoked_at == None
+		).update({'revoked_at': datetime.utcnow()}, synchronize_session=False)
+		db.session.commit()
+
+	@staticmethod
+	def purge_expired(batch_size=1000):
+		"""
+		delete refresh tokens that have expired, one batch per transaction
+		:param batch_size: rows deleted per batch
+		:return: number of deleted rows
+		"""
+		return purge_expired_rows(RefreshToken, batch_size)
+
+
+def purge_expired_rows(model, batch_size):
+	"""
+	delete rows whose expires_at has passed, one batch per transaction
+	:param model: model with id and expires_at columns
+	:param batch_size: rows deleted per batch
+	:return: number of deleted rows
+	"""
+	deleted = 0
+	while True:
+		expired = db.session.query(model.id).filter(
+			model.expires_at < datetime.utcnow()
+		).limit(batch_size)
+		count = model.query.filter(
+			model.id.in_(expired.subquery())
+		).delete(synchronize_session=False)
+		db.session.commit()
+		deleted += count
+
+		if count < batch_size:
+			return deleted
@@ -0,0 +1,138 @@
+from contextlib import contextmanager
+from flask import request, _request_ctx_stack
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import cerberus
+import json
+import logging
+import time
+
+logger = logging.getLogger('app.timing')
+
+# phases reported besides the database, in header order
+PHASES = ('auth', 'validation', 'json')
+
+
+class RequestTimer:
+	"""time spent by one request in SQL and in the phases of PHASES"""
+	__slots__ = ('started', 'durations', 'queries')
+
+	def __init__(self):
+		self.started = time.perf_counter()
+		self.durations = dict.fromkeys(('db',) + PHASES, 0.0)
+		self.queries = 0
+
+	def add(self, name, seconds):
+		self.durations[name] += seconds
+
+	def server_timing(self, total):
+		"""
+		:param total: request time in seconds
+		:return: Server-Timing header value, durations in milliseconds
+		"""
+		metrics = [f'db;dur={self.durations["db"] * 1000:.2f};desc="{self.queries} queries"']
+		metrics.extend(f'{name};dur={self.durations[name] * 1000:.2f}' for name in PHASES)
+		metrics.append(f'total;dur={total * 1000:.2f}')
+		return ', '.join(metrics)
+
+	def log_record(self, response, total):
+		"""
+		:param response: the response
+		:param total: request time in seconds
+		:return: dict for the log line
+		"""
+		record = {
+			'method': request.method,
+			'path': request.path,
+			'endpoint': request.endpoint,
+			'status': response.status_code,
+			'queries': self.queries,
+			'total_ms': round(total * 1000, 2)
+		}
+		for name, seconds in self.durations.items():
+			record[f'{name}_ms'] = round(seconds * 1000, 2)
+		return record
+
+
+def current_timer():
+	"""the timer of the request being served, None outside requests or when timing is off"""
+	# the context stack directly, the request proxy costs more than the timing itself
+	ctx = _request_ctx_stack.top
+	if ctx is None:
+		return None
+	return ctx.request.environ.get('app.timer')
+
+
+@contextmanager
+def timed(name):
+	"""
+	add the time spent in the block to a phase of the current request
+	:param name: one of PHASES
+	:return:
+	"""
+	timer = current_timer()
+	if timer is None:
+		yield
+		return
+
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		timer.add(name, time.perf_counter() - start)
+
+
+class Validator(cerberus.Validator):
+	"""cerberus Validator that reports its time as the validation phase"""
+
+	def validate(self, *args, **kwargs):
+		with timed('validation'):
+			return super().validate(*args, **kwargs)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+	if current_timer() is not None:
+		conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+	timer = current_timer()
+	started = conn.info.get('query_started')
+	if timer is not None and started:
+		timer.add('db', time.perf_counter() - started.pop())
+		timer.queries += 1
+
+
+@event.listens_for(Engine, 'handle_error')
+def drop_query_timer(exception_context):
+	started = exception_context.connection.info.get('query_started') if exception_context.connection else None
+	if started:
+		started.pop()
+
+
+def init_app(app):
+	"""
+	Time every request when SERVER_TIMING_ENABLED. The numbers are sent in a
+	Server-Timing header and logged as one json line on the app.timing logger
+	:param app: flask app
+	:return:
+	"""
+
+	@app.before_request
+	def start_request_timer():
+		if app.config.get('SERVER_TIMING_ENABLED'):
+			request.environ['app.timer'] = RequestTimer()
+
+	@app.after_request
+	def report_request_timer(response):
+		timer = request.environ.pop('app.timer', None)
+		if timer is None:
+			return response
+
+		total = time.perf_counter() - timer.started
+		response.headers['Server-Timing'] = timer.server_timing(total)
+		if logger.isEnabledFor(logging.INFO):
+			logger.info(json.dumps(timer.log_record(response, total)))
+		return response
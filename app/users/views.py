@@ -3,8 +3,8 @@ from app.books.helper_funcs import check_admin
 from app.auth.helper_funcs import token_required
 from app.models import Book, User, BorrowedBook
 from app.books.helper_funcs import check_admin, response, response_for_book, response_for_created_book, response_with_pagination, get_user_book_list
-from cerberus import Validator
-from app import db
+from app.timing import Validator
+from app import app, db
 
 users = Blueprint('users', __name__)
 
@@ -19,7 +19,8 @@ pagination_schema = {
 	},
 	'returned': {
 		'type': 'string',
-		'required': True
+		'required': True,
+		'allowed': ['true', 'false']
 	},
 	'user_id': {
 		'type': 'string',
@@ -42,112 +43,70 @@ def api_books_not_returned_or_history(current_user):
 
 	req_args = request.args
 
-	# check if args exists. This will deal with books not returned
-	if req_args:
-		if validate_pagination_schema.validate(req_args) and req_args.get('returned') == 'false':
-			try:
-				borrowed_books = None
-				page_limit = req_args.get('limit', None, int)
-				page_number = req_args.get('page', None, int)
-
-				# if username in args check if it's admin
-				if 'user_id' in req_args:
-					check_admin(current_user)
-
-					user_id = int(req_args.get('user_id'))
-
-					borrowed_books = BorrowedBook.query.filter(
-						db.and_(
-							BorrowedBook.return_date == None,
-							BorrowedBook.user_id == user_id
-						)
-					).all()
-
-				else:
-					# find the book in the borrowed book table
-					borrowed_books = BorrowedBook.query.filter(
-						db.and_(
-							BorrowedBook.return_date == None,
-							BorrowedBook.user_id == current_user.id
-						)
-					).paginate(per_page=page_limit, page=page_number)
-
-				books_list = []
-
-				# match all the books borrowed ID's to the books table
-				for single_book in borrowed_books.items:
-					match_book = Book.query.filter_by(id=single_book.book_id).first()
-					books_list.append(match_book)
-
-				# check if book_results is empty return 204
-				if len(books_list) < 1:
-					return make_response(jsonify({'': ''})), 204
-
-				return make_response(
-					jsonify({
-						"books": [book.serialize() for book in books_list],
-						"has_next": borrowed_books.has_next,
-						"has_prev": borrowed_books.has_prev,
-						"next_page_num": borrowed_books.next_num,
-						"prev_page_num": borrowed_books.prev_num,
-						"total_pages": borrowed_books.pages,
-						"current_page": borrowed_books.page
-					})
-				)
-			except Exception as e:
-				return make_response(
-					jsonify(
-						{
-							# 'error': str(e)
-							'error': "something went wrong"
-						}
-					)
-				), 400
+	# without args return the first page of the user's borrowing history
+	if not req_args:
+		req_args = {'limit': str(app.config['BOOKS_PAGE_LIMIT']), 'page': '1', 'returned': 'true'}
 
+	if not validate_pagination_schema.validate(req_args):
 		return make_response(jsonify({'error': validate_pagination_schema.errors})), 400
 
-	else:  # find user's book borrowing history
-		try:
-			# query for all borrowed books history
-			borrowed_books = BorrowedBook.query.filter(
-				db.and_(
-					BorrowedBook.return_date != None,
-					BorrowedBook.user_id == current_user.id
-				)
-			).all()
-
-			books_list = []
-
-			for single_book in borrowed_books:
-				match_book = Book.query.filter_by(id=single_book.book_id).first()
-				book_data = None
-				if match_book:
-					book_data = {
-						'id': match_book.id,
-						'title': match_book.title,
-						'isbn': match_book.isbn,
-						'borrow_date': single_book.borrow_date,
-						'return_date': single_book.return_date
-					}
-					books_list.append(book_data)
-
-			# check if book_results is empty return 204
-			if len(books_list) < 1:
-				return make_response(jsonify({'': ''})), 204
-
-			return make_response(
-				jsonify({
-					"books": books_list
-				})
+	returned = req_args.get('returned') == 'true'
+	user_id = current_user.id
+
+	# if user_id in args check if it's admin
+	if 'user_id' in req_args:
+		check_admin(current_user)
+
+	try:
+		page_limit = int(req_args.get('limit'))
+		page_number = int(req_args.get('page'))
+
+		if 'user_id' in req_args:
+			user_id = int(req_args.get('user_id'))
+
+		# borrowed books come with their book from a single join
+		borrowed_books = BorrowedBook.query_with_books(user_id, returned).paginate(
+			per_page=page_limit,
+			page=page_number
+		)
+	except Exception as e:
+		return make_response(
+			jsonify(
+				{
+					'error': "something went wrong"
+				}
 			)
-		except Exception as e:
-			return make_response(
-				jsonify(
-					{
-						'error': str(e)
-					}
-				)
-			), 400
+		), 400
+
+	if returned:
+		books_list = [
+			{
+				'id': single_book.books.id,
+				'title': single_book.books.title,
+				'isbn': single_book.books.isbn,
+				'borrow_date': single_book.borrow_date,
+				'return_date': single_book.return_date
+			}
+			for single_book in borrowed_books.items
+		]
+	else:
+		books_list = [single_book.books.serialize() for single_book in borrowed_books.items]
+
+	# check if book_results is empty return 204
+	if len(books_list) < 1:
+		return make_response(jsonify({'': ''})), 204
+
+	return make_response(
+		jsonify({
+			"books": books_list,
+			"has_next": borrowed_books.has_next,
+			"has_prev": borrowed_books.has_prev,
+			"next_page_num": borrowed_books.next_num,
+			"prev_page_num": borrowed_books.prev_num,
+			"total_pages": borrowed_books.pages,
+			"current_page": borrowed_books.page
+		})
+	)
 
 
 @users.route('/<book_id>', methods=['POST'])
@@ -165,27 +124,15 @@ def api_borrow_book(current_user, book_id):
 	except ValueError:  # if it's not integer raise an error
 		return response('error', 'please provide a book id. ID must be integer', 400)
 	else:
-		book_instance = Book.query.filter_by(id=book_id).first()  # find book in the database
+		# borrowing is one conditional statement, so two users can't get the same book
+		if BorrowedBook.borrow(int(book_id), current_user.id):
+			return response('success', f'book with ID no.{book_id} has been borrowed', 200)
 
 		# if book doesn't exists return 404
-		if not book_instance:
+		if not Book.query.get(int(book_id)):
 			return response('error', f"book with ID {book_id} not found", 404)
 
-		# check if book is borrowed
-		if book_instance.is_borrowed:
-			return response('message', f'book with ID no.{book_id} is currently unavailable', 400)
-
-		# if book exists user can borrow it
-		borrow_book = BorrowedBook()
-		borrow_book.user_id = current_user.id
-		borrow_book.book_id = book_instance.id
-		book_instance.is_borrowed = True
-
-		# add borrowed book to the borrow database
-		db.session.add(borrow_book)
-		db.session.commit()
-
-		return response('success', f'book with ID no.{book_id} has been borrowed', 200)
+		return response('message', f'book with ID no.{book_id} is currently unavailable', 400)
 
 
 @users.route('/<book_id>', methods=['PUT'])
@@ -202,22 +149,11 @@ def api_return_book(current_user, book_id):
 	except ValueError:  # if it's not integer raise an error
 		return response('error', 'please provide a book id. ID must be integer', 400)
 	else:
-		book_borrowed = Book.query.filter_by(id=book_id).first()  # find book in the database
-		book_return = BorrowedBook.query.filter(db.and_(
-			BorrowedBook.book_id == book_id,
-			BorrowedBook.user_id == current_user.id,
-			BorrowedBook.return_date == None
-		)).first()
+		if BorrowedBook.return_book(int(book_id), current_user.id):
+			return response('success', f'book with id {book_id} has been returned', 200)
 
 		# if book doesn't exists return 404
-		if not book_borrowed:
+		if not Book.query.get(int(book_id)):
 			return response('error', "book not found", 404)
 
-		# check if book is borrowed
-		if book_borrowed.is_borrowed:
-			book_borrowed.is_borrowed = False
-			book_return.return_date = db.func.current_timestamp()
-			db.session.commit()
-			return response('success', f'book with id {book_id} has been returned', 200)
-
 		return response('message', f'you did not borrow book with id {book_id}', 403)
@@ -0,0 +1,57 @@
+"""
+Times an authenticated request with long lived, blacklisted tokens against
+short lived access tokens that skip the blacklist.
+
+usage: python -m benchmarks.bench_auth_tokens [--iterations N] [--blacklisted N]
+"""
+from app import app, db
+from app.models import User, BlacklistToken
+from app.auth.blacklist_cache import blacklist_cache
+from benchmarks.utils import benchmark_app, time_per_call, report
+from datetime import datetime, timedelta
+import argparse
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--iterations', type=int, default=1000)
+	parser.add_argument('--blacklisted', type=int, default=10000, help='rows in the blacklist table')
+	args = parser.parse_args()
+
+	with benchmark_app():
+		db.session.bulk_insert_mappings(
+			BlacklistToken,
+			[
+				{'jti': f'revoked-{i}', 'expires_at': datetime.utcnow() + timedelta(days=1)}
+				for i in range(args.blacklisted)
+			]
+		)
+		user = User(username='bench', email='bench@mail.com', password='bench#Password1')
+		user.save()
+		client = app.test_client()
+
+		def authenticated_request(token):
+			headers = dict(Authorization=f'Bearer {token}')
+			return lambda: client.get('/api/v2/books/1', headers=headers)
+
+		token = user.generate_token(user.id).decode('utf-8')
+		app.config['BLACKLIST_CACHE_ENABLED'] = False
+		report('request, blacklist table', time_per_call(authenticated_request(token), args.iterations))
+
+		app.config['BLACKLIST_CACHE_ENABLED'] = True
+		blacklist_cache.clear()
+		report('request, blacklist cache', time_per_call(authenticated_request(token), args.iterations))
+
+		app.config['AUTH_REFRESH_TOKENS'] = True
+		token = user.generate_token(user.id).decode('utf-8')
+		report('request, access token', time_per_call(authenticated_request(token), args.iterations))
+
+		report('issue and rotate refresh token', time_per_call(lambda: client.post(
+			'/api/v2/auth/refresh',
+			content_type='application/json',
+			data='{"refresh_token": "%s"}' % user.generate_refresh_token().decode('utf-8')
+		), args.iterations // 10))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,41 @@
+"""
+Times User.decode_token with and without the per-worker blacklist cache.
+
+usage: python -m benchmarks.bench_blacklist_cache [--iterations N] [--blacklisted N]
+"""
+from app import app, db
+from app.models import User, BlacklistToken
+from app.auth.blacklist_cache import blacklist_cache
+from benchmarks.utils import benchmark_app, time_per_call, report
+from datetime import datetime, timedelta
+import argparse
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--iterations', type=int, default=2000)
+	parser.add_argument('--blacklisted', type=int, default=10000, help='rows in the blacklist table')
+	args = parser.parse_args()
+
+	with benchmark_app():
+		db.session.bulk_insert_mappings(
+			BlacklistToken,
+			[
+				{'jti': f'revoked-{i}', 'expires_at': datetime.utcnow() + timedelta(days=1)}
+				for i in range(args.blacklisted)
+			]
+		)
+		user = User(username='bench', email='bench@mail.com', password='bench#Password1')
+		token = user.save().decode('utf-8')
+
+		app.config['BLACKLIST_CACHE_ENABLED'] = False
+		report('decode_token, no cache', time_per_call(lambda: User.decode_token(token), args.iterations))
+
+		app.config['BLACKLIST_CACHE_ENABLED'] = True
+		blacklist_cache.clear()
+		report('decode_token, blacklist cache', time_per_call(lambda: User.decode_token(token), args.iterations))
+		print(blacklist_cache.as_dict())
+
+
+if __name__ == '__main__':
+	main()
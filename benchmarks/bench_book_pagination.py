@@ -0,0 +1,61 @@
+"""
+Times page 1 and a deep page of GET /api/v2/books with OFFSET pagination
+and with cursor pagination, ordered by id and by title.
+
+usage: python -m benchmarks.bench_book_pagination [--books N] [--page N] [--limit N] [--iterations N]
+"""
+from app import app, db
+from app.models import User, Book
+from app.books.helper_funcs import encode_cursor
+from benchmarks.utils import benchmark_app, time_per_call, report
+import argparse
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--books', type=int, default=1000000)
+	parser.add_argument('--page', type=int, default=10000, help='deep page number')
+	parser.add_argument('--limit', type=int, default=20)
+	parser.add_argument('--iterations', type=int, default=20)
+	args = parser.parse_args()
+
+	with benchmark_app():
+		db.session.execute(
+			"INSERT INTO books (title, isbn, is_borrowed, date_created, date_modified) "
+			"SELECT md5(i::text), lpad(i::text, 10, '0'), false, now(), now() FROM generate_series(1, :books) AS i",
+			{'books': args.books}
+		)
+		db.session.commit()
+		db.session.execute('ANALYZE books')
+
+		user = User(username='bench', email='bench@mail.com', password='bench#Password1', is_admin=True)
+		headers = dict(Authorization=f'Bearer {user.save().decode("utf-8")}')
+		client = app.test_client()
+
+		def get(url):
+			assert client.get(url, headers=headers).status_code == 200
+			return lambda: client.get(url, headers=headers)
+
+		offset = (args.page - 1) * args.limit
+		for page in (1, args.page):
+			report(
+				f'offset, page {page}',
+				time_per_call(get(f'/api/v2/books?limit={args.limit}&page={page}'), args.iterations)
+			)
+
+		for order, columns in (('id', (Book.id,)), ('title', (Book.title, Book.id))):
+			last_book = Book.query.order_by(*columns).offset(offset - 1).first()
+			for page, cursor in ((1, None), (args.page, encode_cursor(order, last_book.sort_key(order)))):
+				url = f'/api/v2/books?limit={args.limit}&order={order}'
+				if cursor:
+					url = f'/api/v2/books?limit={args.limit}&after={cursor}'
+				report(f'cursor by {order}, page {page}', time_per_call(get(url), args.iterations))
+
+			report(
+				f'cursor by {order}, page 1 with total_pages',
+				time_per_call(get(f'/api/v2/books?limit={args.limit}&order={order}&include_total=true'), args.iterations)
+			)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,53 @@
+"""
+Latency percentiles of GET /api/v2/books/search over generated titles, for
+common and rare terms, several words and a second page. The response cache is off.
+
+usage: python -m benchmarks.bench_book_search [--books N] [--limit N] [--iterations N]
+"""
+from app import app, db, dataset
+from app.models import User
+from benchmarks.utils import benchmark_app, latencies, report_percentiles
+import argparse
+import json
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--books', type=int, default=1000000)
+	parser.add_argument('--limit', type=int, default=20)
+	parser.add_argument('--iterations', type=int, default=200)
+	args = parser.parse_args()
+
+	with benchmark_app():
+		user = User(username='bench', email='bench@mail.com', password='bench#Password1', is_admin=True)
+		headers = dict(Authorization=f'Bearer {user.save().decode("utf-8")}')
+		dataset.generate(books=args.books, users=1, loans=0, seed=1)
+		client = app.test_client()
+
+		def get(url):
+			res = client.get(url, headers=headers)
+			assert res.status_code == 200
+			return json.loads(res.data.decode())
+
+		queries = (
+			('one common word', 'q=love'),
+			('two words', 'q=lost city'),
+			('two rarer words', 'q=silver moon'),
+			('no match', 'q=nothing'),
+		)
+		for name, query in queries:
+			url = f'/api/v2/books/search?{query}&limit={args.limit}'
+			matches = db.session.execute(
+				"SELECT count(*) FROM books WHERE to_tsvector('simple', title) @@ plainto_tsquery('simple', :q)",
+				{'q': query[2:]}
+			).scalar()
+			get(url)
+			report_percentiles(f'{name}, {matches} matches', latencies(lambda: client.get(url, headers=headers), args.iterations))
+
+		first_page = get(f'/api/v2/books/search?q=love&limit={args.limit}')
+		url = f'/api/v2/books/search?q=love&limit={args.limit}&after={first_page["next_cursor"]}'
+		report_percentiles('one common word, page 2', latencies(lambda: client.get(url, headers=headers), args.iterations))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,101 @@
+"""
+Measures the peak memory and time of GET /api/v2/books as one jsonify'd
+list, as streamed json and as ndjson. Times include the tracing overhead.
+The jsonify'd list grows with the catalog, it's skipped above --list-max-rows.
+
+usage: python -m benchmarks.bench_book_streaming [--rows N [N ...]] [--list-max-rows N]
+"""
+from app import app, db
+from app.models import User
+from benchmarks.utils import benchmark_app
+import argparse
+import gc
+import os
+import threading
+import time
+import tracemalloc
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def rss():
+	"""resident memory of this process in bytes"""
+	with open('/proc/self/statm') as statm:
+		return int(statm.read().split()[1]) * PAGE_SIZE
+
+
+def measure(func):
+	"""
+	run func while tracing python allocations and sampling resident memory
+	:param func: callable
+	:return: (seconds, peak traced bytes, peak rss growth in bytes)
+	"""
+	gc.collect()
+	baseline = rss()
+	peak = [baseline]
+	done = threading.Event()
+
+	def sample():
+		while not done.wait(0.005):
+			peak[0] = max(peak[0], rss())
+
+	sampler = threading.Thread(target=sample)
+	sampler.start()
+	tracemalloc.start()
+	start = time.perf_counter()
+	try:
+		func()
+	finally:
+		seconds = time.perf_counter() - start
+		traced_peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+		done.set()
+		sampler.join()
+	return seconds, traced_peak, max(peak[0], rss()) - baseline
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000])
+	parser.add_argument('--list-max-rows', type=int, default=100000)
+	args = parser.parse_args()
+
+	with benchmark_app():
+		user = User(username='bench', email='bench@mail.com', password='bench#Password1')
+		headers = dict(Authorization=f'Bearer {user.save().decode("utf-8")}')
+		client = app.test_client()
+
+		def read(url, **extra_headers):
+			def func():
+				res = client.get(url, headers=dict(headers, **extra_headers), buffered=False)
+				assert res.status_code == 200
+				for _ in res.iter_encoded():
+					pass
+				res.close()
+			return func
+
+		modes = (
+			('ndjson', read('/api/v2/books', Accept='application/x-ndjson')),
+			('streamed json', read('/api/v2/books?stream=1')),
+			('jsonify list', read('/api/v2/books')),
+		)
+
+		print(f'{"rows":>8} {"mode":<15} {"seconds":>8} {"traced MiB":>11} {"rss MiB":>8}')
+		for rows in sorted(args.rows):
+			db.session.execute('TRUNCATE books RESTART IDENTITY CASCADE')
+			db.session.execute(
+				"INSERT INTO books (title, isbn, is_borrowed, date_created, date_modified) "
+				"SELECT md5(i::text), lpad(i::text, 10, '0'), false, now(), now() FROM generate_series(1, :rows) AS i",
+				{'rows': rows}
+			)
+			db.session.commit()
+
+			for name, func in modes:
+				if name == 'jsonify list' and rows > args.list_max_rows:
+					continue
+				seconds, traced, resident = measure(func)
+				print(f'{rows:>8} {name:<15} {seconds:>8.2f} {traced / 2 ** 20:>11.1f} {resident / 2 ** 20:>8.1f}')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,56 @@
+"""
+Suggest index at scale: load time and memory per million titles, latency of
+prefix lookups in the index and through GET /api/v2/books/suggest, and of the
+database fallback.
+
+usage: python -m benchmarks.bench_book_suggest [--books N] [--iterations N]
+"""
+from app import app, dataset
+from app.models import User
+from app.books.suggest import suggest_index
+from app.books.views import load_suggest_index
+from benchmarks.utils import benchmark_app, latencies, report_percentiles
+import argparse
+import time
+import tracemalloc
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--books', type=int, default=1000000)
+	parser.add_argument('--iterations', type=int, default=1000)
+	args = parser.parse_args()
+
+	with benchmark_app():
+		user = User(username='bench', email='bench@mail.com', password='bench#Password1', is_admin=True)
+		headers = dict(Authorization=f'Bearer {user.save().decode("utf-8")}')
+		dataset.generate(books=args.books, users=1, loans=0, seed=1)
+		client = app.test_client()
+
+		suggest_index.clear()
+		tracemalloc.start()
+		start = time.perf_counter()
+		load_suggest_index()
+		seconds = time.perf_counter() - start
+		size, peak = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+		per_million = 1e6 / len(suggest_index) / 2 ** 20
+		print(f'loaded {len(suggest_index)} titles in {seconds:.1f}s')
+		print(f'index {size * per_million:.1f} MiB per million titles, {peak * per_million:.1f} MiB peak while loading')
+
+		prefixes = ('l', 'lost', 'lost c', 'silver moon s', 'zzz')
+		for prefix in prefixes:
+			report_percentiles(f'index, "{prefix}"', latencies(lambda: suggest_index.search(prefix, 10), args.iterations))
+
+		app.config['BOOKS_SUGGEST_LOAD_IN_BACKGROUND'] = False
+		for enabled, name in ((True, 'endpoint'), (False, 'endpoint, database')):
+			app.config['BOOKS_SUGGEST_INDEX_ENABLED'] = enabled
+			for prefix in prefixes:
+				url = f'/api/v2/books/suggest?prefix={prefix}'
+				assert client.get(url, headers=headers).status_code == 200
+				iterations = args.iterations if enabled else args.iterations // 50 or 1
+				report_percentiles(f'{name}, "{prefix}"', latencies(lambda: client.get(url, headers=headers), iterations))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,77 @@
+"""
+Measures borrow and return throughput with concurrent threads, each on its
+own books, and with every thread contending for a single book.
+
+usage: python -m benchmarks.bench_borrow [--threads N] [--loans N]
+"""
+from app import app, db
+from app.models import User, BorrowedBook
+from benchmarks.utils import benchmark_app
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import time
+
+
+def run_threads(threads, work):
+	"""
+	run work(thread index) on every thread
+	:param threads: number of threads
+	:param work: callable returning the number of operations done
+	:return: (operations, seconds)
+	"""
+	def run(index):
+		with app.app_context():
+			try:
+				return work(index)
+			finally:
+				db.session.remove()
+
+	start = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=threads) as executor:
+		operations = sum(executor.map(run, range(threads)))
+	return operations, time.perf_counter() - start
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--threads', type=int, default=8)
+	parser.add_argument('--loans', type=int, default=200, help='borrow and return cycles per thread')
+	args = parser.parse_args()
+
+	with benchmark_app():
+		db.session.execute(
+			"INSERT INTO books (title, isbn, is_borrowed) "
+			"SELECT 'book ' || i, lpad(i::text, 10, '0'), false FROM generate_series(1, :books) AS i",
+			{'books': args.threads}
+		)
+		db.session.add_all(
+			User(username=f'bench{i}', email=f'bench{i}@mail.com', password='bench#Password1')
+			for i in range(args.threads)
+		)
+		db.session.commit()
+		user_ids = [user.id for user in User.query.order_by(User.id).all()]
+
+		def own_book(index):
+			for _ in range(args.loans):
+				assert BorrowedBook.borrow(index + 1, user_ids[index])
+				assert BorrowedBook.return_book(index + 1, user_ids[index])
+			return 2 * args.loans
+
+		def shared_book(index):
+			done = 0
+			for _ in range(args.loans):
+				if BorrowedBook.borrow(1, user_ids[index]):
+					done += 1
+					BorrowedBook.return_book(1, user_ids[index])
+			return done
+
+		operations, seconds = run_threads(args.threads, own_book)
+		print(f'{args.threads} threads, own books: {operations / seconds:.0f} borrows and returns per second')
+
+		loans, seconds = run_threads(args.threads, shared_book)
+		print(f'{args.threads} threads, one book: {loans} loans, {args.threads * args.loans / seconds:.0f} borrow attempts per second')
+		assert BorrowedBook.query.filter(BorrowedBook.return_date == None).count() == 0
+
+
+if __name__ == '__main__':
+	main()
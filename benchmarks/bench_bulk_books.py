@@ -0,0 +1,52 @@
+"""
+Measures POST /api/v2/books/bulk throughput at several insert batch sizes,
+against one POST /api/v2/books request per book.
+
+usage: python -m benchmarks.bench_bulk_books [--books N] [--batch-sizes N [N ...]] [--single N]
+"""
+from app import app, db
+from app.models import User, Book
+from benchmarks.utils import benchmark_app
+import argparse
+import json
+import time
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--books', type=int, default=50000)
+	parser.add_argument('--batch-sizes', type=int, nargs='+', default=[100, 1000, 10000])
+	parser.add_argument('--single', type=int, default=1000, help='books created one request at a time')
+	args = parser.parse_args()
+
+	with benchmark_app():
+		user = User(username='bench', email='bench@mail.com', password='bench#Password1', is_admin=True)
+		headers = dict(Authorization=f'Bearer {user.save().decode("utf-8")}')
+		client = app.test_client()
+		body = json.dumps([{'title': f'book {i}', 'isbn': f'{i:010}'} for i in range(args.books)])
+
+		start = time.perf_counter()
+		for i in range(args.single):
+			client.post(
+				'/api/v2/books',
+				headers=headers,
+				content_type='application/json',
+				data=json.dumps({'title': f'book {i}', 'isbn': f'{i:010}'})
+			)
+		print(f'{"one request per book":<30} {args.single / (time.perf_counter() - start):>10.0f} books/s')
+
+		app.config['BOOKS_BULK_MAX_ROWS'] = args.books
+		for batch_size in args.batch_sizes:
+			Book.query.delete()
+			db.session.commit()
+			app.config['BOOKS_BULK_BATCH_SIZE'] = batch_size
+
+			start = time.perf_counter()
+			res = client.post('/api/v2/books/bulk', headers=headers, content_type='application/json', data=body)
+			seconds = time.perf_counter() - start
+			assert json.loads(res.data.decode())['created'] == args.books
+			print(f'{f"bulk, batches of {batch_size}":<30} {args.books / seconds:>10.0f} books/s')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,55 @@
+"""
+Times jsonify of book lists the size of a page and of the whole catalog, and
+reports the payload size. Compares the old pretty printed stdlib output with
+the compact stdlib and orjson engines.
+
+usage: python -m benchmarks.bench_json [--books N [N ...]] [--iterations N]
+"""
+from app import app
+from app.encoder import JSONEncoder
+from app.models import Book
+from benchmarks.utils import time_per_call, report
+from datetime import datetime
+from flask import jsonify, json as flask_json
+import argparse
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--books', type=int, nargs='+', default=[20, 10000])
+	parser.add_argument('--iterations', type=int, default=200)
+	args = parser.parse_args()
+
+	engines = (
+		('stdlib, pretty, http dates (before)', flask_json.JSONEncoder, 'stdlib', True),
+		('stdlib, compact', JSONEncoder, 'stdlib', False),
+		('orjson, compact', JSONEncoder, 'orjson', False),
+	)
+
+	with app.test_request_context():
+		for count in args.books:
+			now = datetime.utcnow()
+			books = []
+			for i in range(count):
+				book = Book(title=f'Hello Books {i}', isbn=f'{i:010}')
+				book.id, book.date_created, book.date_modified, book.is_borrowed = i + 1, now, now, False
+				books.append(book)
+
+			for name, encoder, engine, debug in engines:
+				app.json_encoder = encoder
+				app.config['JSON_ENGINE'] = engine
+				app.config['DEBUG'] = debug
+
+				def serialize():
+					return jsonify({'books': [book.serialize() for book in books]})
+
+				iterations = max(1, args.iterations * 20 // count)
+				seconds = time_per_call(serialize, iterations)
+				report(f'{count} books, {name}', seconds)
+				print(f'{"":<50} {len(serialize().get_data()):>12} bytes')
+
+	app.json_encoder = JSONEncoder
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,288 @@
+"""
+HTTP load test of the API under gunicorn. The test database is filled with a
+generated dataset, then virtual users run a mixed workload of logins, catalog
+pages, single book reads, borrow and return churn and admin writes at each
+concurrency level. Every virtual user draws its operations and books from its
+own seeded generator, so the same seed makes the same choices. Throughput, p50/p95/p99 latency and errors per endpoint are
+written as JSON to stdout, progress goes to stderr.
+
+Users log in with pbkdf2 at the dataset's 1000 iterations, see
+bench_password_hashing for the cost of production's bcrypt.
+
+usage: python -m benchmarks.bench_load [--books N] [--users N] [--loans N] [--seed N]
+	[--gunicorn-workers N] [--concurrency 1,8,32] [--duration S] [--warmup S] > results.json
+"""
+from app import dataset
+from app.models import User
+from benchmarks.utils import benchmark_app, git_commit, percentile
+from contextlib import contextmanager
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+# operations and how often virtual users pick them
+WORKLOAD = (
+	('browse', 35),
+	('book', 30),
+	('login', 10),
+	('borrow_return', 15),
+	('create', 5),
+	('update', 5)
+)
+
+# statuses that are a normal outcome of each endpoint, anything else is an error.
+# Borrowing a book someone else holds is refused, so is returning it. Updates answer 201
+EXPECTED = {
+	'login': {200},
+	'browse': {200, 204},
+	'book': {200},
+	'borrow': {200, 400},
+	'return': {200, 403},
+	'create': {201},
+	'update': {201}
+}
+
+ADMIN_PASSWORD = 'loadadmin#Password1'
+
+
+def free_port():
+	with socket.socket() as sock:
+		sock.bind(('127.0.0.1', 0))
+		return sock.getsockname()[1]
+
+
+@contextmanager
+def gunicorn(workers, timeout=30):
+	"""
+	serve the app with gunicorn on a free local port
+	:param workers: gunicorn worker processes
+	:param timeout: seconds to wait for the server to answer
+	:return: (host, port)
+	"""
+	port = free_port()
+	env = dict(os.environ, APP_SETTINGS='app.config.BenchmarkConfig')
+	server = subprocess.Popen(
+		[sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app'],
+		env=env
+	)
+	try:
+		deadline = time.monotonic() + timeout
+		while True:
+			if server.poll() is not None:
+				raise RuntimeError(f'gunicorn exited with {server.returncode}')
+			try:
+				conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+				conn.request('GET', '/')
+				conn.getresponse().read()
+				conn.close()
+				break
+			except OSError:
+				if time.monotonic() > deadline:
+					raise RuntimeError('gunicorn did not start')
+				time.sleep(0.2)
+		yield '127.0.0.1', port
+	finally:
+		server.terminate()
+		server.wait()
+
+
+class VirtualUser:
+	"""one client of the workload, with its own connection, token and random generator"""
+
+	def __init__(self, index, address, spec, admin_token, isbns):
+		self.index = index
+		self.isbns = isbns
+		self.conn = http.client.HTTPConnection(*address, timeout=30)
+		self.spec = spec
+		self.admin = {'Authorization': f'Bearer {admin_token}'}
+		self.rng = random.Random(f'{spec["seed"]}:load:{index}')
+		self.username = f'{spec["prefix"]}{spec["first_user"] + index % spec["users"]}'
+		self.results = {}
+		self.recording = False
+		self.headers = None
+
+	def request(self, name, method, url, body=None, headers=None):
+		"""
+		send one request and record its latency and status under name
+		:return: (status, body), the status is None when the connection failed
+		"""
+		headers = dict(headers or {})
+		if body is not None:
+			body = json.dumps(body)
+			headers['Content-Type'] = 'application/json'
+
+		start = time.perf_counter()
+		try:
+			self.conn.request(method, url, body=body, headers=headers)
+			res = self.conn.getresponse()
+			data = res.read()
+			status = res.status
+		except (OSError, http.client.HTTPException):
+			# a connection the server dropped is reopened by the next request
+			self.conn.close()
+			status, data = None, b''
+		seconds = time.perf_counter() - start
+
+		if self.recording:
+			latencies, statuses = self.results.setdefault(name, ([], {}))
+			latencies.append(seconds)
+			statuses[status] = statuses.get(status, 0) + 1
+		return status, data
+
+	def login(self):
+		status, data = self.request('login', 'POST', '/api/v2/auth/login', {'username': self.username, 'password': dataset.PASSWORD})
+		if status == 200:
+			self.headers = {'Authorization': f'Bearer {json.loads(data)["auth_token"]}'}
+
+	def book_id(self):
+		"""a book id drawn from the dataset's popularity distribution"""
+		books = self.spec['books']
+		rank = self.rng.choices(range(books), cum_weights=dataset.book_weights(books, self.spec['skew']))[0]
+		return self.spec['first_book'] + dataset.popular_book(rank, books)
+
+	def run(self, operation):
+		if operation == 'login':
+			self.login()
+		elif operation == 'browse':
+			# readers mostly stay on the first pages
+			page = min(int(self.rng.expovariate(0.2)) + 1, max(1, self.spec['books'] // 20))
+			self.request('browse', 'GET', f'/api/v2/books?limit=20&page={page}', headers=self.headers)
+		elif operation == 'book':
+			self.request('book', 'GET', f'/api/v2/books/{self.book_id()}', headers=self.headers)
+		elif operation == 'borrow_return':
+			book_id = self.book_id()
+			status, _ = self.request('borrow', 'POST', f'/api/v2/users/books/{book_id}', headers=self.headers)
+			if status == 200:
+				self.request('return', 'PUT', f'/api/v2/users/books/{book_id}', headers=self.headers)
+		elif operation == 'create':
+			isbn = str(next(self.isbns))
+			self.request('create', 'POST', '/api/v2/books', {'title': f'load book {isbn}', 'isbn': isbn}, self.admin)
+		elif operation == 'update':
+			title = ' '.join(self.rng.choice(dataset.WORDS) for _ in range(3))
+			self.request('update', 'PUT', f'/api/v2/books/{self.book_id()}', {'title': title}, self.admin)
+
+	def loop(self, record_at, stop_at):
+		"""run operations until stop_at, recording the ones started after record_at"""
+		operations, weights = zip(*WORKLOAD)
+		self.login()
+		while True:
+			now = time.monotonic()
+			if now >= stop_at:
+				break
+			self.recording = now >= record_at
+			self.run(self.rng.choices(operations, weights)[0])
+		self.conn.close()
+
+
+def run_level(concurrency, address, spec, admin_token, isbns, duration, warmup):
+	"""
+	run the workload with concurrency virtual users
+	:param isbns: iterator of unused isbns for created books
+	:return: dict of results
+	"""
+	clients = [VirtualUser(index, address, spec, admin_token, isbns) for index in range(concurrency)]
+	record_at = time.monotonic() + warmup
+	stop_at = record_at + duration
+	threads = [threading.Thread(target=client.loop, args=(record_at, stop_at)) for client in clients]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	endpoints = {}
+	for name in EXPECTED:
+		latencies, statuses = [], {}
+		for client in clients:
+			client_latencies, client_statuses = client.results.get(name, ([], {}))
+			latencies.extend(client_latencies)
+			for status, count in client_statuses.items():
+				statuses[status] = statuses.get(status, 0) + count
+		if not latencies:
+			continue
+		latencies.sort()
+		endpoints[name] = {
+			'requests': len(latencies),
+			'errors': sum(count for status, count in statuses.items() if status not in EXPECTED[name]),
+			'throughput_rps': round(len(latencies) / duration, 2),
+			'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+			'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+			'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+			'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)}
+		}
+
+	requests = sum(endpoint['requests'] for endpoint in endpoints.values())
+	return {
+		'concurrency': concurrency,
+		'duration_s': duration,
+		'requests': requests,
+		'errors': sum(endpoint['errors'] for endpoint in endpoints.values()),
+		'throughput_rps': round(requests / duration, 2),
+		'endpoints': endpoints
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--books', type=int, default=10000)
+	parser.add_argument('--users', type=int, default=1000)
+	parser.add_argument('--loans', type=int, default=50000)
+	parser.add_argument('--skew', type=float, default=1.0)
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--gunicorn-workers', type=int, default=2 * (os.cpu_count() or 1) + 1)
+	parser.add_argument('--concurrency', default='1,8,32', help='comma separated virtual users per level')
+	parser.add_argument('--duration', type=float, default=30, help='seconds recorded per level')
+	parser.add_argument('--warmup', type=float, default=5, help='seconds run before recording each level')
+	args = parser.parse_args()
+	levels = [int(level) for level in args.concurrency.split(',')]
+
+	with benchmark_app():
+		print(f'generating {args.books} books, {args.users} users, {args.loans} loans', file=sys.stderr)
+		rows = dataset.generate(args.books, args.users, args.loans, skew=args.skew, seed=args.seed)
+		admin = User(username='loadadmin', email='loadadmin@mail.com', password=ADMIN_PASSWORD, is_admin=True)
+		admin_token = admin.save().decode('utf-8')
+		spec = {
+			'seed': args.seed,
+			'books': args.books,
+			'users': args.users,
+			'skew': args.skew,
+			# the tables start empty, so generated ids start at 1
+			'first_book': 1,
+			'first_user': 1,
+			'prefix': f'loaduser{args.seed}-'
+		}
+
+		# above any generated isbn, which are less than 7919 times the number of books
+		isbns = itertools.count(9000000000)
+		results = []
+		with gunicorn(args.gunicorn_workers) as address:
+			for concurrency in levels:
+				print(f'{concurrency} virtual users for {args.warmup + args.duration:.0f}s', file=sys.stderr)
+				level = run_level(concurrency, address, spec, admin_token, isbns, args.duration, args.warmup)
+				print(f'  {level["throughput_rps"]:.1f} requests/s, {level["errors"]} errors', file=sys.stderr)
+				results.append(level)
+
+	report = {
+		'commit': git_commit(),
+		'python': platform.python_version(),
+		'cpus': os.cpu_count(),
+		'gunicorn_workers': args.gunicorn_workers,
+		'seed': args.seed,
+		'dataset': rows,
+		'workload': dict(WORKLOAD),
+		'levels': results
+	}
+	json.dump(report, sys.stdout, indent=2)
+	print()
+
+
+if __name__ == '__main__':
+	main()
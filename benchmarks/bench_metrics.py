@@ -0,0 +1,74 @@
+"""
+Overhead of the prometheus metrics: requests with METRICS_ENABLED on and off,
+a cache hit and a /metrics scrape. With --multiprocess the metrics live in
+mmapped files like they do under uWSGI.
+
+usage: python -m benchmarks.bench_metrics [--books N] [--iterations N] [--rounds N] [--multiprocess]
+"""
+import argparse
+import os
+import tempfile
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--books', type=int, default=1000)
+	parser.add_argument('--iterations', type=int, default=1000)
+	parser.add_argument('--rounds', type=int, default=5)
+	parser.add_argument('--multiprocess', action='store_true')
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as path:
+		# prometheus_client picks its storage when it's imported
+		if args.multiprocess:
+			os.environ['PROMETHEUS_MULTIPROC_DIR'] = path
+		run(args)
+
+
+def run(args):
+	from app import app, db
+	from app.cache import CacheStats
+	from app.models import User
+	from benchmarks.utils import benchmark_app, time_per_call, report
+
+	with benchmark_app():
+		db.session.execute(
+			"INSERT INTO books (title, isbn, is_borrowed, date_created, date_modified) "
+			"SELECT md5(i::text), lpad(i::text, 10, '0'), false, now(), now() FROM generate_series(1, :books) AS i",
+			{'books': args.books}
+		)
+		db.session.commit()
+		user = User(username='bench', email='bench@mail.com', password='bench#Password1', is_admin=True)
+		headers = dict(Authorization=f'Bearer {user.save().decode("utf-8")}')
+		client = app.test_client()
+
+		urls = (
+			('single book', '/api/v2/books/1'),
+			('list of 100', '/api/v2/books?limit=100&page=1'),
+		)
+		# on and off alternate and the best round counts, so drift on a busy machine cancels out
+		results = {}
+		for _ in range(args.rounds):
+			for enabled in (False, True):
+				app.config['METRICS_ENABLED'] = enabled
+				for name, url in urls:
+					assert client.get(url, headers=headers).status_code == 200
+					seconds = time_per_call(lambda: client.get(url, headers=headers), args.iterations)
+					results[name, enabled] = min(seconds, results.get((name, enabled), seconds))
+
+		for enabled in (False, True):
+			for name, _ in urls:
+				report(f'{name}, metrics {"on" if enabled else "off"}', results[name, enabled])
+
+		stats, named = CacheStats(), CacheStats('bench')
+		report('cache hit, not exported', time_per_call(stats.hit, args.iterations * 100))
+		report('cache hit, exported', time_per_call(named.hit, args.iterations * 100))
+		report('scrape /metrics', time_per_call(lambda: client.get('/metrics'), args.iterations))
+
+		for name, _ in urls:
+			overhead = results[name, True] - results[name, False]
+			print(f'{name}: {overhead * 1e6:+.1f} us per call, {overhead / results[name, False]:+.1%}')
+
+
+if __name__ == '__main__':
+	main()
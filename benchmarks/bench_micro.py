@@ -0,0 +1,270 @@
+"""
+Microbenchmarks of the hot Python paths outside the database: serializers,
+list helpers, input formatting, json envelopes, schema validation and tokens.
+Every case is timed at a realistic input size and its memory is traced with
+tracemalloc. No database is needed.
+
+--save writes the results to the baseline file, --compare checks them against
+it and exits with 1 when a case got slower or allocates more than the
+thresholds allow. Timings are taken relative to a fixed reference workload
+timed in the same rounds, so a machine that is busier or slower as a whole
+doesn't show up as a regression. They still only compare on the kind of
+machine the baseline was saved on, allocations on the same python version.
+
+usage: python -m benchmarks.bench_micro [--save | --compare] [--threshold F] [--alloc-threshold F] [--baseline PATH]
+	[--rounds N] [--retries N]
+"""
+from app import app
+from app.auth.helper_funcs import format_inputs
+from app.auth.views import validate_user_schema
+from app.books.helper_funcs import get_user_book_list, get_paginated_list, response_for_book, response_with_pagination
+from app.books.views import validate_book_schema, validate_pagination_schema
+from app.models import Book, User
+from benchmarks.utils import git_commit, time_per_call
+from datetime import datetime, timedelta
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tracemalloc
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baselines', 'micro.json')
+
+CREATED = datetime(2018, 1, 1)
+
+
+def reference():
+	"""plain interpreter work, dicts and strings like the serializers build"""
+	return [{'id': i, 'title': f'book {i}', 'is_borrowed': i % 7 == 0} for i in range(100)]
+
+
+def make_books(count):
+	"""transient books with every serialized column set"""
+	books = []
+	for book_id in range(1, count + 1):
+		book = Book(title=f'the secret garden of book {book_id}', isbn=f'{book_id:010}')
+		book.id = book_id
+		book.is_borrowed = book_id % 7 == 0
+		book.date_created = CREATED + timedelta(minutes=book_id)
+		book.date_modified = book.date_created
+		books.append(book)
+	return books
+
+
+def make_user():
+	user = User(username='tester', email='tester@mail.com', is_admin=True)
+	user.id = 1
+	user.token_version = 0
+	user.date_created = user.date_modified = CREATED
+	return user
+
+
+def cases():
+	"""
+	:return: list of (name, callable) run inside an app context
+	"""
+	page = make_books(20)
+	big_page = make_books(100)
+	catalog = get_user_book_list(make_books(1000))
+	user = make_user()
+	token = user.generate_token(user.id)
+
+	return [
+		('Book.serialize', page[0].serialize),
+		('User.serialize', user.serialize),
+		('get_user_book_list 20 books', lambda: get_user_book_list(page)),
+		('get_user_book_list 100 books', lambda: get_user_book_list(big_page)),
+		('get_paginated_list page of 20 in 1000', lambda: get_paginated_list(catalog, '/api/v2/books', 481, 20)),
+		('format_inputs', lambda: format_inputs('  The   Secret  Garden OF   Books  ')),
+		('jsonify single book', lambda: response_for_book(page[0].serialize())),
+		('jsonify page of 20 books', lambda: response_with_pagination(get_user_book_list(page), 1, 3, 1000)),
+		('jsonify page of 100 books', lambda: response_with_pagination(get_user_book_list(big_page), 1, 3, 1000)),
+		('validate book', lambda: validate_book_schema.validate({'title': 'hello books', 'isbn': '5698745124'})),
+		('validate pagination args', lambda: validate_pagination_schema.validate({'limit': '20', 'page': '3'})),
+		('validate registration', lambda: validate_user_schema.validate({
+			'username': 'tester', 'email': 'tester@mail.com', 'password': 'tester#Password1', 'confirm_password': 'tester#Password1'
+		})),
+		('User.generate_token', lambda: user.generate_token(user.id)),
+		('User.decode_token access token', lambda: User.decode_token(token)),
+	]
+
+
+def measure_allocations(func):
+	"""
+	:param func: callable, called once beforehand so lazy setup isn't counted
+	:return: (peak bytes traced during a call, bytes still held by its result)
+	"""
+	func()
+	tracemalloc.start()
+	try:
+		result = func()
+		retained, peak = tracemalloc.get_traced_memory()
+		del result
+	finally:
+		tracemalloc.stop()
+	return peak, retained
+
+
+def calibrate(func, min_time=0.02):
+	"""
+	:param func: callable
+	:param min_time: seconds a round should last at least
+	:return: calls per round
+	"""
+	iterations = 1
+	while True:
+		seconds = time_per_call(func, iterations) * iterations
+		if seconds >= min_time:
+			return iterations
+		iterations = max(iterations * 2, int(iterations * min_time / max(seconds, 1e-9)) + 1)
+
+
+def run(rounds):
+	"""
+	:param rounds: timed rounds, the fastest of each case counts
+	:return: (dict of case name to results, us per call of the reference)
+	"""
+	app.config.from_object('app.config.BenchmarkConfig')
+	# access tokens skip the blacklist, so decoding needs no database like in production
+	app.config['AUTH_REFRESH_TOKENS'] = True
+	results = {}
+	with app.app_context():
+		timed = []
+		for name, func in cases():
+			peak, retained = measure_allocations(func)
+			results[name] = {'us_per_call': None, 'peak_bytes': peak, 'retained_bytes': retained}
+			timed.append((name, func, calibrate(func)))
+		timed.append((None, reference, calibrate(reference)))
+
+		# every round goes through all the cases, so drift on a busy machine hits them alike.
+		# Like timeit, collections would land on whichever case happens to trigger them
+		best = {}
+		gc.disable()
+		try:
+			for _ in range(rounds):
+				for name, func, iterations in timed:
+					seconds = time_per_call(func, iterations)
+					best[name] = min(seconds, best.get(name, seconds))
+		finally:
+			gc.enable()
+
+		for name, seconds in best.items():
+			if name is not None:
+				results[name]['us_per_call'] = round(seconds * 1e6, 3)
+	return results, round(best[None] * 1e6, 3)
+
+
+def changes(results, reference_us, baseline):
+	"""
+	:param reference_us: time of the reference in this run
+	:param baseline: saved baseline
+	:return: dict of case name to (time change, peak change), None for a case the baseline lacks
+	"""
+	# how much slower this run's machine is, times are compared after taking it out
+	speed = reference_us / baseline['reference_us']
+	changed = {}
+	for name, current in results.items():
+		base = baseline['cases'].get(name)
+		if base is None:
+			changed[name] = None
+			continue
+		time_change = current['us_per_call'] / speed / base['us_per_call'] - 1
+		peak_change = current['peak_bytes'] / base['peak_bytes'] - 1 if base['peak_bytes'] else 0.0
+		changed[name] = time_change, peak_change
+	return changed
+
+
+def regressions(changed, threshold, alloc_threshold):
+	"""
+	:param threshold: allowed fraction of growth in time, relative to the reference
+	:param alloc_threshold: allowed fraction of growth in peak memory
+	:return: names of the cases that regressed
+	"""
+	return [
+		name for name, change in changed.items()
+		if change is not None and (change[0] > threshold or change[1] > alloc_threshold)
+	]
+
+
+def compare(results, reference_us, baseline, threshold, alloc_threshold):
+	"""
+	print every case next to its baseline
+	:return: names of the cases that regressed
+	"""
+	if baseline['python'].split('.')[:2] != platform.python_version().split('.')[:2]:
+		print(f'baseline was saved on python {baseline["python"]}, allocations differ between versions')
+	print(f'reference {reference_us:.2f} us, baseline {baseline["reference_us"]:.2f} us')
+
+	changed = changes(results, reference_us, baseline)
+	regressed = regressions(changed, threshold, alloc_threshold)
+	print(f'{"case":<42} {"us/call":>10} {"base":>10} {"change":>8}  {"peak B":>9} {"base":>9} {"change":>8}')
+	for name, current in results.items():
+		if changed[name] is None:
+			print(f'{name:<42} {current["us_per_call"]:>10.2f} {"new":>10}')
+			continue
+
+		base = baseline['cases'][name]
+		time_change, peak_change = changed[name]
+		print(
+			f'{name:<42} {current["us_per_call"]:>10.2f} {base["us_per_call"]:>10.2f} {time_change:>+8.1%}  '
+			f'{current["peak_bytes"]:>9} {base["peak_bytes"]:>9} {peak_change:>+8.1%}'
+			f'{"  REGRESSION" if name in regressed else ""}'
+		)
+	return regressed
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	mode = parser.add_mutually_exclusive_group()
+	mode.add_argument('--save', action='store_true', help='write the results as the new baseline')
+	mode.add_argument('--compare', action='store_true', help='fail on regressions against the baseline')
+	parser.add_argument('--threshold', type=float, default=0.5, help='allowed growth in time against the reference, 0.5 is 50%%')
+	parser.add_argument('--alloc-threshold', type=float, default=0.1, help='allowed growth in peak memory')
+	parser.add_argument('--baseline', default=BASELINE)
+	parser.add_argument('--rounds', type=int, default=20)
+	parser.add_argument('--retries', type=int, default=2, help='runs repeated while a case looks slower')
+	args = parser.parse_args()
+
+	results, reference_us = run(args.rounds)
+
+	if args.compare:
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+		# a busy machine can slow every round of one case, so slower cases are timed
+		# again and their fastest run counts. Allocations come out the same every run
+		for _ in range(args.retries):
+			if not regressions(changes(results, reference_us, baseline), args.threshold, args.alloc_threshold):
+				break
+			retimed, retimed_reference_us = run(args.rounds)
+			for name, result in retimed.items():
+				results[name]['us_per_call'] = min(results[name]['us_per_call'], result['us_per_call'])
+			reference_us = min(reference_us, retimed_reference_us)
+
+		regressed = compare(results, reference_us, baseline, args.threshold, args.alloc_threshold)
+		if regressed:
+			print(f'{len(regressed)} regressions: {", ".join(regressed)}')
+			sys.exit(1)
+		return
+
+	print(f'{"reference":<42} {reference_us:>10.2f} us')
+	for name, result in results.items():
+		print(f'{name:<42} {result["us_per_call"]:>10.2f} us {result["peak_bytes"]:>9} B peak {result["retained_bytes"]:>9} B held')
+
+	if args.save:
+		os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+		with open(args.baseline, 'w') as f:
+			json.dump({
+				'commit': git_commit(),
+				'python': platform.python_version(),
+				'machine': platform.machine(),
+				'reference_us': reference_us,
+				'cases': results
+			}, f, indent=2)
+			f.write('\n')
+		print(f'baseline written to {args.baseline}')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,70 @@
+"""
+Measures login throughput for each password hasher and cost.
+
+Each configuration registers one user and then logs it in from --threads
+concurrent clients, hashing on the app's PASSWORD_HASH_WORKERS pool.
+
+usage: python -m benchmarks.bench_password_hashing [--logins N] [--threads N]
+"""
+from app import app, db
+from app.auth.hashers import HASHERS
+from app.models import User
+from benchmarks.utils import benchmark_app
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import time
+
+CONFIGURATIONS = (
+	('pbkdf2', 50000),
+	('pbkdf2', 260000),
+	('bcrypt', 10),
+	('bcrypt', 12),
+	('scrypt', 14),
+	('scrypt', 15),
+)
+
+
+def login(client):
+	res = client.post(
+		'/api/v2/auth/login',
+		content_type='application/json',
+		data=json.dumps({'username': 'bench', 'password': 'bench#Password1'})
+	)
+	assert res.status_code == 200, res.data
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--logins', type=int, default=40)
+	parser.add_argument('--threads', type=int, default=4)
+	args = parser.parse_args()
+
+	with benchmark_app():
+		app.config['PASSWORD_HASH_WORKERS'] = args.threads
+		print(f'{"hasher":<10}{"cost":>8}{"hash ms":>12}{"logins/s":>12}')
+
+		for name, cost in CONFIGURATIONS:
+			if not HASHERS[name].available:
+				print(f'{name:<10}{cost:>8}{"not available":>24}')
+				continue
+			app.config['PASSWORD_HASHER'] = name
+			app.config['PASSWORD_HASH_COST'] = cost
+			User.query.delete()
+			db.session.commit()
+
+			start = time.perf_counter()
+			User(username='bench', email='bench@mail.com', password='bench#Password1').save()
+			hash_time = time.perf_counter() - start
+
+			clients = [app.test_client() for _ in range(args.threads)]
+			start = time.perf_counter()
+			with ThreadPoolExecutor(max_workers=args.threads) as pool:
+				list(pool.map(login, (clients[i % args.threads] for i in range(args.logins))))
+			elapsed = time.perf_counter() - start
+
+			print(f'{name:<10}{cost:>8}{hash_time * 1000:>12.1f}{args.logins / elapsed:>12.1f}')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,57 @@
+"""
+Times GET /api/v2/books and GET /api/v2/books/<id> with and without the
+response cache, and a list read right after a write invalidated it.
+
+usage: python -m benchmarks.bench_response_cache [--books N] [--limit N] [--iterations N]
+"""
+from app import app, db
+from app.models import User
+from app.books.cache import response_cache
+from benchmarks.utils import benchmark_app, time_per_call, report
+import argparse
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--books', type=int, default=100000)
+	parser.add_argument('--limit', type=int, default=100)
+	parser.add_argument('--iterations', type=int, default=200)
+	args = parser.parse_args()
+
+	with benchmark_app():
+		db.session.execute(
+			"INSERT INTO books (title, isbn, is_borrowed, date_created, date_modified) "
+			"SELECT md5(i::text), lpad(i::text, 10, '0'), false, now(), now() FROM generate_series(1, :books) AS i",
+			{'books': args.books}
+		)
+		db.session.commit()
+		db.session.execute('ANALYZE books')
+
+		user = User(username='bench', email='bench@mail.com', password='bench#Password1', is_admin=True)
+		headers = dict(Authorization=f'Bearer {user.save().decode("utf-8")}')
+		client = app.test_client()
+
+		def get(url):
+			assert client.get(url, headers=headers).status_code == 200
+			return lambda: client.get(url, headers=headers)
+
+		urls = (
+			(f'list of {args.limit}', f'/api/v2/books?limit={args.limit}&page=1'),
+			(f'list of {args.limit} by title', f'/api/v2/books?limit={args.limit}&order=title'),
+			('single book', f'/api/v2/books/{args.books // 2}'),
+		)
+		for cache in (False, True):
+			app.config['BOOKS_CACHE_ENABLED'] = cache
+			for name, url in urls:
+				report(f'{name}, {"cached" if cache else "uncached"}', time_per_call(get(url), args.iterations))
+
+		def write_then_read():
+			client.put('/api/v2/books/1', headers=headers, json={'title': 'bench'})
+			client.get(urls[0][1], headers=headers)
+
+		report('update, then list (always a miss)', time_per_call(write_then_read, args.iterations // 10 or 1))
+		print(response_cache.as_dict())
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,74 @@
+"""
+Overhead of Server-Timing instrumentation: requests and single statements
+timed with SERVER_TIMING_ENABLED on and off.
+
+usage: python -m benchmarks.bench_server_timing [--books N] [--iterations N] [--rounds N]
+"""
+from app import app, db, timing
+from app.models import User
+from benchmarks.utils import benchmark_app, time_per_call, report
+import argparse
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--books', type=int, default=1000)
+	parser.add_argument('--iterations', type=int, default=1000)
+	parser.add_argument('--rounds', type=int, default=5)
+	args = parser.parse_args()
+
+	with benchmark_app():
+		db.session.execute(
+			"INSERT INTO books (title, isbn, is_borrowed, date_created, date_modified) "
+			"SELECT md5(i::text), lpad(i::text, 10, '0'), false, now(), now() FROM generate_series(1, :books) AS i",
+			{'books': args.books}
+		)
+		db.session.commit()
+		user = User(username='bench', email='bench@mail.com', password='bench#Password1', is_admin=True)
+		headers = dict(Authorization=f'Bearer {user.save().decode("utf-8")}')
+		client = app.test_client()
+
+		urls = (
+			('single book', '/api/v2/books/1'),
+			('list of 100', '/api/v2/books?limit=100&page=1'),
+		)
+		# on and off alternate and the best round counts, so drift on a busy machine cancels out
+		results = {}
+		for _ in range(args.rounds):
+			for enabled in (False, True):
+				app.config['SERVER_TIMING_ENABLED'] = enabled
+				for name, url in urls:
+					assert client.get(url, headers=headers).status_code == 200
+					seconds = time_per_call(lambda: client.get(url, headers=headers), args.iterations)
+					results[name, enabled] = min(seconds, results.get((name, enabled), seconds))
+
+				with app.test_request_context():
+					app.preprocess_request()
+					seconds = time_per_call(lambda: db.session.execute('SELECT 1'), args.iterations)
+					results['SELECT 1 in a request', enabled] = min(seconds, results.get(('SELECT 1 in a request', enabled), seconds))
+
+		names = [name for name, _ in urls] + ['SELECT 1 in a request']
+		for enabled in (False, True):
+			for name in names:
+				report(f'{name}, timing {"on" if enabled else "off"}', results[name, enabled])
+
+		# the per statement hooks on their own, too small to see through the noise above
+		with app.test_request_context():
+			app.config['SERVER_TIMING_ENABLED'] = True
+			app.preprocess_request()
+			connection = db.engine.connect()
+
+			def hooks():
+				timing.start_query_timer(connection, None, None, None, None, False)
+				timing.stop_query_timer(connection, None, None, None, None, False)
+
+			report('query hooks per statement, timing on', time_per_call(hooks, args.iterations * 100))
+			connection.close()
+
+		for name in names:
+			overhead = results[name, True] - results[name, False]
+			print(f'{name}: {overhead * 1e6:+.1f} us per call, {overhead / results[name, False]:+.1%}')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,88 @@
+from contextlib import contextmanager
+from app import app, db
+import subprocess
+import time
+
+
+@contextmanager
+def benchmark_app():
+	"""
+	Push an app context on freshly created tables in the test database.
+	The tables are dropped again when the benchmark finishes.
+	:return: app
+	"""
+	app.config.from_object('app.config.TestingConfig')
+	# test tokens expire in seconds, long runs would end up timing 401 responses
+	app.config['AUTH_TOKEN_EXPIRY_SECONDS'] = 3600
+	app.config['AUTH_ACCESS_TOKEN_EXPIRY_SECONDS'] = 3600
+	# repeated reads would time the response cache, benchmarks of it turn it back on
+	app.config['BOOKS_CACHE_ENABLED'] = False
+	with app.app_context():
+		db.drop_all()
+		db.create_all()
+		try:
+			yield app
+		finally:
+			db.session.remove()
+			db.drop_all()
+
+
+def time_per_call(func, iterations):
+	"""
+	average wall time of calling func
+	:param func: callable
+	:param iterations: number of calls
+	:return: seconds per call
+	"""
+	start = time.perf_counter()
+	for _ in range(iterations):
+		func()
+	return (time.perf_counter() - start) / iterations
+
+
+def report(name, seconds):
+	"""print one result line"""
+	print(f'{name:<50} {seconds * 1e6:>12.1f} us')
+
+
+def latencies(func, iterations):
+	"""
+	wall time of every call of func, sorted
+	:param func: callable
+	:param iterations: number of calls
+	:return: list of seconds
+	"""
+	times = []
+	for _ in range(iterations):
+		start = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - start)
+	return sorted(times)
+
+
+def percentile(times, fraction):
+	"""
+	:param times: sorted latencies
+	:param fraction: 0.5 for the median
+	:return: the latency at that fraction
+	"""
+	return times[min(len(times) - 1, int(len(times) * fraction))]
+
+
+def report_percentiles(name, times):
+	"""print the p50 and p99 of sorted latencies on one line"""
+	p50 = percentile(times, 0.5)
+	p99 = percentile(times, 0.99)
+	print(f'{name:<50} p50 {p50 * 1e6:>10.1f} us   p99 {p99 * 1e6:>10.1f} us')
+
+
+def git_commit():
+	"""
+	:return: the checked out commit, None outside a git checkout
+	"""
+	try:
+		return subprocess.run(
+			['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True
+		).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
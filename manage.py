@@ -1,11 +1,17 @@
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 from app import app, db
-from app.models import User, BorrowedBook, Book
+from app.models import User, BorrowedBook, Book, BlacklistToken, RefreshToken
 import getpass
 from app.auth.helper_funcs import format_inputs
+from app.books import catalog
+from app import dataset
+import os
 import re
+import time
 from faker import Faker
+from sqlalchemy.exc import DBAPIError
+import psycopg2
 
 fake = Faker()
 
@@ -68,11 +74,13 @@ def super_duper_user():
 		change_user = input('press 1 to upgrade user to admin or press 2 to demote admin to user: ')
 		if int(change_user) == 1:
 			find_user.is_admin = True
-			db.session.commit()
+			find_user.bump_token_version()
+			find_user.save()
 			return print('user upgraded')
 		if int(change_user) == 2:
 			find_user.is_admin = False
-			db.session.commit()
+			find_user.bump_token_version()
+			find_user.save()
 			return print('user downgraded')
 		return print('You did not press 1 or 2')
 
@@ -86,27 +94,81 @@ def return_user_book():
 	try:
 
 		find_user = User.get_by_email(user_email)
-		book_return = BorrowedBook.query.filter(
-			db.and_(
-				BorrowedBook.book_id == book_id,
-				BorrowedBook.user_id == find_user.id,
-				BorrowedBook.return_date == None
-			)).first()
-
-		if book_return is None:
-			return print('book not found')
-		else:
-			book_borrowed = Book.query.filter_by(id=book_id).first()
-			if book_borrowed.is_borrowed:
-				book_borrowed.is_borrowed = False
-				book_return.return_date = db.func.current_timestamp()
-				db.session.commit()
-				return print('Book has been returned')
+
+		if BorrowedBook.return_book(book_id, find_user.id):
+			return print('Book has been returned')
+		return print('book not found')
 
 	except Exception as e:
 		print(f"error: {e}")
 
 
+@manager.command
+def import_books(path):
+	"""imports books from a csv or ndjson file, existing isbns get the file's title"""
+	start = time.perf_counter()
+	try:
+		rows_read, rows_merged = catalog.import_books(path)
+	except (OSError, ValueError) as e:
+		return print(f"error: {e}")
+	except (psycopg2.DataError, DBAPIError) as e:
+		# copy runs on the raw connection and raises psycopg2's errors, the orm wraps them
+		db.session.rollback()
+		return print(f"error: {getattr(e, 'orig', e)}".strip())
+
+	seconds = time.perf_counter() - start
+	print(f'{rows_read} rows read, {rows_merged} books created or updated')
+	return print(f'{seconds:.1f}s, {rows_read / seconds:.0f} rows/s')
+
+
+@manager.command
+def export_books(path):
+	"""exports all books to a csv or ndjson file"""
+	start = time.perf_counter()
+	try:
+		rows_written = catalog.export_books(path)
+	except (OSError, ValueError) as e:
+		return print(f"error: {e}")
+	except (psycopg2.DataError, DBAPIError) as e:
+		# copy runs on the raw connection and raises psycopg2's errors, the orm wraps them
+		db.session.rollback()
+		return print(f"error: {getattr(e, 'orig', e)}".strip())
+
+	seconds = time.perf_counter() - start
+	print(f'{rows_written} books exported')
+	return print(f'{seconds:.1f}s, {rows_written / seconds:.0f} rows/s')
+
+
+@manager.option('-b', '--books', dest='books', type=int, default=10000, help='number of books')
+@manager.option('-u', '--users', dest='users', type=int, default=1000, help='number of users')
+@manager.option('-l', '--loans', dest='loans', type=int, default=50000, help='number of returned loans')
+@manager.option('-o', '--open-loans', dest='open_loans', type=int, default=500, help='number of books on loan')
+@manager.option('-s', '--skew', dest='skew', type=float, default=1.0, help='zipf exponent of book popularity, 0 for none')
+@manager.option('--seed', dest='seed', type=int, default=0, help='same seed, same rows')
+@manager.option('-w', '--workers', dest='workers', type=int, default=os.cpu_count(), help='generator processes')
+def generate_dataset(books, users, loans, open_loans, skew, seed, workers):
+	"""fills an empty catalog with generated books, users and loans for load testing"""
+	start = time.perf_counter()
+	try:
+		rows = dataset.generate(books, users, loans, open_loans, skew, seed, workers)
+	except ValueError as e:
+		return print(f"error: {e}")
+
+	seconds = time.perf_counter() - start
+	print(', '.join(f'{count} {table}' for table, count in rows.items()))
+	print(f'users log in with the password {dataset.PASSWORD}')
+	return print(f'{seconds:.1f}s, {sum(rows.values()) / seconds:.0f} rows/s')
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000, help='rows deleted per transaction')
+def purge_blacklist(batch_size):
+	"""deletes blacklisted and refresh tokens that have already expired"""
+	deleted = BlacklistToken.purge_expired(batch_size)
+	print(f'{deleted} expired blacklisted tokens purged')
+	deleted = RefreshToken.purge_expired(batch_size)
+	return print(f'{deleted} expired refresh tokens purged')
+
+
 @manager.command
 def dummy():
 	"""creates 100 fake books and saves them in the database"""
@@ -28,6 +28,14 @@ target_metadata = current_app.extensions['migrate'].db.metadata
 # ... etc.
 
 
+# indexes that need an extension some databases don't have live in migrations only
+MIGRATION_ONLY_INDEXES = {'ix_books_title_trgm'}
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    return not (type_ == 'index' and name in MIGRATION_ONLY_INDEXES)
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -73,6 +81,7 @@ def run_migrations_online():
     context.configure(connection=connection,
                       target_metadata=target_metadata,
                       process_revision_directives=process_revision_directives,
+                      include_object=include_object,
                       **current_app.extensions['migrate'].configure_args)
 
     try:
@@ -0,0 +1,24 @@
+"""add token_version to users
+
+Revision ID: 3c9e0d27a1b5
+Revises: 8f4415614237
+Create Date: 2026-10-18 10:02:47.118530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9e0d27a1b5'
+down_revision = '8f4415614237'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'token_version')
@@ -0,0 +1,57 @@
+"""add titles_version to catalog_version and a pg_trgm index on books.title
+
+Revision ID: 7b3e9f15c6d8
+Revises: d22b41c8f7ea
+Create Date: 2026-10-18 19:20:06.118342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import logging
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3e9f15c6d8'
+down_revision = 'd22b41c8f7ea'
+branch_labels = None
+depends_on = None
+
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def create_pg_trgm():
+    """
+    create pg_trgm when the server has it and this role may create it, which
+    before Postgres 13 takes a superuser
+    :return: whether pg_trgm is installed
+    """
+    conn = op.get_bind()
+    if conn.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").scalar():
+        return True
+    if not conn.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'").scalar():
+        return False
+
+    savepoint = conn.begin_nested()
+    try:
+        conn.execute('CREATE EXTENSION pg_trgm')
+    except sa.exc.DBAPIError:
+        savepoint.rollback()
+        return False
+    savepoint.commit()
+    return True
+
+
+def upgrade():
+    op.add_column('catalog_version', sa.Column('titles_version', sa.BigInteger(), server_default='0', nullable=False))
+    # the index only speeds up suggestions while a worker's suggest index is cold
+    if create_pg_trgm():
+        op.create_index('ix_books_title_trgm', 'books', ['title'], unique=False, postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'})
+    else:
+        logger.warning('pg_trgm is not available to this role, skipping ix_books_title_trgm. As a superuser run '
+                       'CREATE EXTENSION pg_trgm; CREATE INDEX ix_books_title_trgm ON books USING gin (title gin_trgm_ops)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_books_title_trgm')
+    op.drop_column('catalog_version', 'titles_version')
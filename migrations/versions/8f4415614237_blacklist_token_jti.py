@@ -0,0 +1,66 @@
+"""store blacklisted tokens by jti and expiry
+
+Revision ID: 8f4415614237
+Revises: 5d775931b44d
+Create Date: 2026-10-18 09:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from datetime import datetime
+import hashlib
+import jwt
+
+
+# revision identifiers, used by Alembic.
+revision = '8f4415614237'
+down_revision = '5d775931b44d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('black_list_tokens', sa.Column('jti', sa.String(length=64), nullable=True))
+    op.add_column('black_list_tokens', sa.Column('expires_at', sa.DateTime(), nullable=True))
+
+    # tokens issued before the jti claim are keyed by the sha256 digest of the token
+    conn = op.get_bind()
+    black_list_tokens = sa.table(
+        'black_list_tokens',
+        sa.column('id', sa.Integer),
+        sa.column('token', sa.String),
+        sa.column('jti', sa.String),
+        sa.column('expires_at', sa.DateTime)
+    )
+    for row_id, token in conn.execute(sa.select([black_list_tokens.c.id, black_list_tokens.c.token])).fetchall():
+        try:
+            payload = jwt.decode(token, algorithms=['HS256'], options={'verify_signature': False, 'verify_exp': False})
+            expires_at = datetime.utcfromtimestamp(payload['exp'])
+        except (jwt.InvalidTokenError, KeyError):
+            payload = {}
+            expires_at = datetime.utcnow()
+        conn.execute(
+            black_list_tokens.update().where(black_list_tokens.c.id == row_id).values(
+                jti=payload.get('jti') or hashlib.sha256(token.encode('utf-8')).hexdigest(),
+                expires_at=expires_at
+            )
+        )
+
+    op.alter_column('black_list_tokens', 'jti', nullable=False)
+    op.alter_column('black_list_tokens', 'expires_at', nullable=False)
+    op.alter_column('black_list_tokens', 'blacklisted_on', server_default=sa.text('now()'))
+    op.create_unique_constraint('black_list_tokens_jti_key', 'black_list_tokens', ['jti'])
+    op.create_index(op.f('ix_black_list_tokens_expires_at'), 'black_list_tokens', ['expires_at'], unique=False)
+    op.drop_column('black_list_tokens', 'token')
+
+
+def downgrade():
+    op.add_column('black_list_tokens', sa.Column('token', sa.String(), nullable=True))
+    op.execute('UPDATE black_list_tokens SET token = jti')
+    op.alter_column('black_list_tokens', 'token', nullable=False)
+    op.create_unique_constraint('black_list_tokens_token_key', 'black_list_tokens', ['token'])
+    op.drop_index(op.f('ix_black_list_tokens_expires_at'), table_name='black_list_tokens')
+    op.drop_constraint('black_list_tokens_jti_key', 'black_list_tokens', type_='unique')
+    op.alter_column('black_list_tokens', 'blacklisted_on', server_default=None)
+    op.drop_column('black_list_tokens', 'expires_at')
+    op.drop_column('black_list_tokens', 'jti')
@@ -0,0 +1,28 @@
+"""add open loan and history indexes to borrowed_books
+
+Revision ID: a93f6b2e0c58
+Revises: e4d51c7a9f02
+Create Date: 2026-10-18 14:05:52.871440
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a93f6b2e0c58'
+down_revision = 'e4d51c7a9f02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_borrowed_books_open_user_id', 'borrowed_books', ['user_id'], unique=False, postgresql_where=sa.text('return_date IS NULL'))
+    op.create_index('ix_borrowed_books_open_book_id', 'borrowed_books', ['book_id'], unique=False, postgresql_where=sa.text('return_date IS NULL'))
+    op.create_index('ix_borrowed_books_user_id_return_date', 'borrowed_books', ['user_id', 'return_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_borrowed_books_user_id_return_date', table_name='borrowed_books')
+    op.drop_index('ix_borrowed_books_open_book_id', table_name='borrowed_books')
+    op.drop_index('ix_borrowed_books_open_user_id', table_name='borrowed_books')
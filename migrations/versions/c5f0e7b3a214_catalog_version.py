@@ -0,0 +1,31 @@
+"""add catalog_version counter and book_availability_version sequence for the response cache
+
+Revision ID: c5f0e7b3a214
+Revises: a93f6b2e0c58
+Create Date: 2026-10-18 16:12:40.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5f0e7b3a214'
+down_revision = 'a93f6b2e0c58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('catalog_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('INSERT INTO catalog_version (id, version) VALUES (1, 0)')
+    op.execute(sa.schema.CreateSequence(sa.Sequence('book_availability_version')))
+
+
+def downgrade():
+    op.execute(sa.schema.DropSequence(sa.Sequence('book_availability_version')))
+    op.drop_table('catalog_version')
@@ -0,0 +1,24 @@
+"""add a GIN index on the title tsvector of books
+
+Revision ID: d22b41c8f7ea
+Revises: c5f0e7b3a214
+Create Date: 2026-10-18 17:41:28.270609
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd22b41c8f7ea'
+down_revision = 'c5f0e7b3a214'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_books_title_search', 'books', [sa.text("to_tsvector('simple', title)")], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_books_title_search', table_name='books')
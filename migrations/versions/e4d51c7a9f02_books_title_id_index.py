@@ -0,0 +1,24 @@
+"""add books (title, id) index for keyset pagination
+
+Revision ID: e4d51c7a9f02
+Revises: b71e2a9c4d10
+Create Date: 2026-10-18 12:41:19.220754
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4d51c7a9f02'
+down_revision = 'b71e2a9c4d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_books_title_id', 'books', ['title', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_books_title_id', table_name='books')
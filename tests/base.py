@@ -1,10 +1,35 @@
 from app import app, db
+from flask import request, _request_ctx_stack
 from flask_testing import TestCase
+from collections import Counter
+from contextlib import contextmanager
+from sqlalchemy import event
 from app.models import User
+from app.auth.blacklist_cache import blacklist_cache
+from app.auth.user_cache import user_cache
+from app.books.cache import response_cache
+from app.books.suggest import suggest_index
 import json
+import re
 
 
 class BaseTestCase(TestCase):
+	# most statements a request to each endpoint may run, for query_budget
+	query_budgets = {
+		'auth.register': 2,
+		'auth.login': 1,
+		'auth.logout': 3,
+		'auth.reset_password': 6,
+		'books.api_create_book': 5,
+		'books.api_get_all_books': 3,
+		'books.api_get_book_with_id': 3,
+		'books.api_update_book': 4,
+		'books.api_delete_book': 4,
+		'users.api_books_not_returned_or_history': 4,
+		'users.api_borrow_book': 2,
+		'users.api_return_book': 4
+	}
+
 	def create_app(self):
 		app.config.from_object('app.config.TestingConfig')
 		return app
@@ -16,6 +41,10 @@ class BaseTestCase(TestCase):
 		"""
 		db.create_all()
 		db.session.commit()
+		blacklist_cache.clear()
+		user_cache.clear()
+		response_cache.clear()
+		suggest_index.clear()
 		self.test_user = User(
 			username='tester',
 			email='tester@mail.com',
@@ -32,6 +61,86 @@ class BaseTestCase(TestCase):
 		db.session.remove()
 		db.drop_all()
 
+	@contextmanager
+	def capture_queries(self):
+		"""
+		Collect the SQL statements executed inside the block
+		:return: list of statements
+		"""
+		statements = []
+
+		def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+			statements.append(statement)
+
+		event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+		try:
+			yield statements
+		finally:
+			event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+	@contextmanager
+	def query_budget(self, budget=None, forbidden=(), repeats=False):
+		"""
+		Check the SQL run by each client request made inside the block: at most its
+		endpoint's budget of statements, none matching a forbidden pattern and,
+		unless repeats is set, no SELECT run twice. A failure shows every request's
+		statements in a table
+		:param budget: max statements per request, or dict of endpoint to max statements, query_budgets by default
+		:param forbidden: regular expressions no statement may match
+		:param repeats: allow a request to run the same SELECT more than once
+		:return: list of (request, endpoint, statements)
+		"""
+		if budget is None:
+			budget = self.query_budgets
+		requests = []
+
+		# hooks that run first and last, so the statements of every other hook count too
+		def start_request():
+			request.environ['tests.statements'] = []
+			name = f'{request.method} {request.full_path.rstrip("?")}'
+			requests.append((name, request.endpoint, request.environ['tests.statements']))
+
+		def finish_request(response):
+			request.environ.pop('tests.statements', None)
+			return response
+
+		def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+			ctx = _request_ctx_stack.top
+			statements = ctx.request.environ.get('tests.statements') if ctx is not None else None
+			if statements is not None:
+				statements.append(statement)
+
+		app.before_request_funcs.setdefault(None, []).insert(0, start_request)
+		# after request hooks run in reverse
+		app.after_request_funcs.setdefault(None, []).insert(0, finish_request)
+		event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+		try:
+			yield requests
+		finally:
+			event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+			app.before_request_funcs[None].remove(start_request)
+			app.after_request_funcs[None].remove(finish_request)
+
+		problems = []
+		for name, endpoint, statements in requests:
+			limit = budget.get(endpoint) if isinstance(budget, dict) else budget
+			if limit is None and statements:
+				problems.append(f'{name}: no query budget for {endpoint}')
+			elif limit is not None and len(statements) > limit:
+				problems.append(f'{name}: {len(statements)} statements, the budget is {limit}')
+			for pattern in forbidden:
+				matches = [statement for statement in statements if re.search(pattern, statement)]
+				if matches:
+					problems.append(f'{name}: {len(matches)} statements match {pattern!r}')
+			if not repeats:
+				selects = Counter(statement for statement in statements if statement.lstrip().upper().startswith('SELECT'))
+				for statement, count in selects.items():
+					if count > 1:
+						problems.append(f'{name}: {count} times {one_line(statement, 80)}')
+
+		if problems:
+			self.fail('\n'.join(problems) + '\n\n' + query_table(requests, budget))
+
 	def register_user(self, username, email, password, confirm_password):
 		"""
 		Helper method for registering a user with dummy data
@@ -49,3 +158,24 @@ class BaseTestCase(TestCase):
 		"""
 		auth_res = self.register_user('admin1', 'admin1@mail.com', 'PO,KL56mnopfg1', True)
 		return json.loads(auth_res.data.decode())['auth_token']
+
+
+def one_line(statement, width):
+	"""a statement on one line, cut to width"""
+	statement = ' '.join(statement.split())
+	return statement if len(statement) <= width else statement[:width - 3] + '...'
+
+
+def query_table(requests, budget):
+	"""
+	:param requests: list of (request, endpoint, statements)
+	:param budget: max statements per request, or dict of endpoint to max statements
+	:return: a table of the requests, their budget and statements
+	"""
+	lines = [f'{"request":<50} {"endpoint":<40} {"queries":>7} {"budget":>6}']
+	for name, endpoint, statements in requests:
+		limit = budget.get(endpoint) if isinstance(budget, dict) else budget
+		lines.append(f'{one_line(name, 50):<50} {endpoint or "-":<40} {len(statements):>7} {"-" if limit is None else limit:>6}')
+		for number, statement in enumerate(statements, start=1):
+			lines.append(f'  {number:>3}  {one_line(statement, 120)}')
+	return '\n'.join(lines)
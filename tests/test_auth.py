@@ -1,5 +1,14 @@
 from tests.base import BaseTestCase
+from app import app, db
+from app.models import BlacklistToken, RefreshToken, User
+from app.cache import BloomFilter, LRUCache
+from app.auth.blacklist_cache import blacklist_cache
+from app.auth.user_cache import user_cache, UserSnapshot
+from app.auth import hashers
+from datetime import datetime, timedelta
 import json
+import jwt
+import time
 
 URL_AUTH = '/api/v2/auth/'
 
@@ -8,7 +17,8 @@ class TestAuthBlueprint(BaseTestCase):
 	def test_register_user(self):
 		"""test api can register user"""
 		with self.client:
-			res = self.register_user('admin2', 'admin2@mail.com', "12345678Nine#", "12345678Nine#")
+			with self.query_budget():
+				res = self.register_user('admin2', 'admin2@mail.com', "12345678Nine#", "12345678Nine#")
 			data = json.loads(res.data.decode())
 			self.assertTrue(data['status'] == 'success')
 			self.assertTrue(data['message'], 'successfully registered')
@@ -47,7 +57,8 @@ class TestAuthBlueprint(BaseTestCase):
 	def test_user_login(self):
 		"""test api can login user"""
 		with self.client:
-			self.register_and_login_in_user()
+			with self.query_budget():
+				self.register_and_login_in_user()
 
 	def test_user_does_not_exist(self):
 		"""test api user doesn't exist"""
@@ -106,11 +117,12 @@ class TestAuthBlueprint(BaseTestCase):
 	def test_user_can_logout(self):
 		"""test api can logout user"""
 		with self.client:
-			# register and login user
-			login_res = self.register_and_login_in_user()
+			with self.query_budget():
+				# register and login user
+				login_res = self.register_and_login_in_user()
 
-			# logout user
-			logout_res = self.logout_user(login_res['auth_token'])
+				# logout user
+				logout_res = self.logout_user(login_res['auth_token'])
 			logout_data = json.loads(logout_res.data.decode())
 			self.assertEqual(logout_res.status_code, 200)
 			self.assertIn('successfully logged out', str(logout_data))
@@ -162,19 +174,21 @@ class TestAuthBlueprint(BaseTestCase):
 	def test_reset_password(self):
 		"""test api can reset password"""
 		with self.client:
-			login_data = self.register_and_login_in_user()
-			token = login_data['auth_token']
-			res = self.client.post(
-				f'{URL_AUTH}reset-password',
-				headers=dict(Authorization=f'Bearer {token}'),
-				content_type='application/json',
-				data=json.dumps(
-					dict(
-						old_password='test#op3456',
-						new_password='newPassword##popa985'
+			# the user is loaded for the cached snapshot on this first request, then again to be updated
+			with self.query_budget(repeats=True):
+				login_data = self.register_and_login_in_user()
+				token = login_data['auth_token']
+				res = self.client.post(
+					f'{URL_AUTH}reset-password',
+					headers=dict(Authorization=f'Bearer {token}'),
+					content_type='application/json',
+					data=json.dumps(
+						dict(
+							old_password='test#op3456',
+							new_password='newPassword##popa985'
+						)
 					)
 				)
-			)
 
 			res2 = json.loads(res.data.decode())
 			self.assertTrue(res2['message'] == 'password reset successful')
@@ -238,6 +252,248 @@ class TestAuthBlueprint(BaseTestCase):
 			res2 = json.loads(res.data.decode())
 			self.assertIn('required field', str(res2))
 
+	def test_blacklist_cache_answers_valid_tokens(self):
+		"""test valid tokens are not looked up in the blacklist table"""
+		with self.client:
+			login_data = self.register_and_login_in_user()
+			blacklist_cache.stats.reset()
+
+			for _ in range(2):
+				res = self.client.get(
+					'/api/v2/books',
+					headers=dict(Authorization=f'Bearer {login_data["auth_token"]}')
+				)
+				self.assertNotEqual(res.status_code, 401)
+
+			self.assertEqual(blacklist_cache.stats.hits, 2)
+			self.assertEqual(blacklist_cache.stats.misses, 0)
+
+	def test_blacklist_cache_loads_tokens_blacklisted_elsewhere(self):
+		"""test tokens blacklisted by another worker are rejected after a refresh"""
+		with self.client:
+			login_data = self.register_and_login_in_user()
+			token = login_data['auth_token']
+			self.assertFalse(BlacklistToken.check_blacklist(self.token_payload(token)['jti']))
+
+			# another worker writes straight to the table
+			db.session.add(BlacklistToken(token=token))
+			db.session.commit()
+			app.config['BLACKLIST_CACHE_REFRESH_SECONDS'] = 0
+
+			res = self.logout_user(token)
+			data = json.loads(res.data.decode())
+			self.assertEqual(res.status_code, 401)
+			self.assertTrue(data['message'] == 'Token was Blacklisted, Please login In')
+
+	def test_blacklist_stores_token_id_and_expiry(self):
+		"""test logout stores the token's jti and expiry instead of the token"""
+		with self.client:
+			login_data = self.register_and_login_in_user()
+			payload = self.token_payload(login_data['auth_token'])
+			self.logout_user(login_data['auth_token'])
+
+			blacklisted = BlacklistToken.query.one()
+			self.assertEqual(blacklisted.jti, payload['jti'])
+			self.assertEqual(blacklisted.expires_at, datetime.utcfromtimestamp(payload['exp']))
+			self.assertIsNotNone(blacklisted.blacklisted_on)
+
+	def test_purge_expired_blacklisted_tokens(self):
+		"""test purging deletes only expired tokens"""
+		db.session.bulk_insert_mappings(BlacklistToken, [
+			{'jti': f'expired-{i}', 'expires_at': datetime.utcnow() - timedelta(minutes=1)} for i in range(5)
+		] + [
+			{'jti': 'active', 'expires_at': datetime.utcnow() + timedelta(days=1)}
+		])
+		db.session.commit()
+
+		self.assertEqual(BlacklistToken.purge_expired(batch_size=2), 5)
+		self.assertEqual([token.jti for token in BlacklistToken.query.all()], ['active'])
+
+	def test_user_cache_resolves_repeat_requests(self):
+		"""test authenticated requests load the user from the cache after the first one"""
+		with self.client:
+			login_data = self.register_and_login_in_user()
+			user_cache.stats.reset()
+
+			with self.capture_queries() as statements:
+				for _ in range(3):
+					self.client.get(
+						'/api/v2/books',
+						headers=dict(Authorization=f'Bearer {login_data["auth_token"]}')
+					)
+
+			self.assertEqual(len([statement for statement in statements if 'FROM users' in statement]), 1)
+			self.assertEqual(user_cache.stats.hits, 2)
+
+	def test_user_cache_is_invalidated_on_save(self):
+		"""test changes saved to a user are seen by the next request"""
+		with self.client:
+			login_data = self.register_and_login_in_user()
+			headers = dict(Authorization=f'Bearer {login_data["auth_token"]}')
+			book = json.dumps({'title': 'Hello Books', 'isbn': '5698745124'})
+
+			res = self.client.post('/api/v2/books', headers=headers, content_type='application/json', data=book)
+			self.assertEqual(res.status_code, 403)
+
+			user = User.get_by_email('lilb@mail.com')
+			user.is_admin = True
+			user.save()
+
+			res = self.client.post('/api/v2/books', headers=headers, content_type='application/json', data=book)
+			self.assertEqual(res.status_code, 201)
+
+	def test_lru_cache_evicts_and_expires_entries(self):
+		"""test lru cache stays bounded and drops expired entries"""
+		cache = LRUCache(2, ttl=0.05)
+		cache.set(1, 'a')
+		cache.set(2, 'b')
+		cache.get(1)
+		cache.set(3, 'c')
+
+		self.assertIsNone(cache.get(2))
+		self.assertEqual(cache.get(1), 'a')
+		self.assertEqual(cache.evictions, 1)
+
+		time.sleep(0.06)
+		self.assertIsNone(cache.get(3))
+		self.assertEqual(cache.expirations, 1)
+
+	def test_user_snapshot_is_read_only(self):
+		"""test cached users can't be modified"""
+		snapshot = UserSnapshot.from_user(self.test_user)
+		self.assertEqual(snapshot.username, 'tester')
+		with self.assertRaises(AttributeError):
+			snapshot.is_admin = False
+
+	def test_login_rehashes_outdated_password(self):
+		"""test logging in upgrades a hash made with another hasher"""
+		with self.client:
+			self.register_and_login_in_user()
+			self.assertTrue(User.get_by_email('lilb@mail.com').password_hash.startswith('pbkdf2:'))
+
+			app.config['PASSWORD_HASHER'] = 'bcrypt'
+			app.config['PASSWORD_HASH_COST'] = 4
+			self.register_and_login_in_user(register=False)
+
+			user = User.get_by_email('lilb@mail.com')
+			self.assertTrue(user.password_hash.startswith('$2b$04$'))
+			self.assertFalse(user.password_needs_rehash())
+			self.register_and_login_in_user(register=False)
+
+	def test_password_hashers(self):
+		"""test every hasher verifies its own hashes and reports its cost"""
+		for name, cost in (('pbkdf2', 1000), ('bcrypt', 4), ('scrypt', 10)):
+			hasher = hashers.HASHERS[name]
+			if not hasher.available:
+				continue
+			hashed = hasher.hash('test#op3456', cost)
+
+			self.assertIs(hashers.identify(hashed), hasher)
+			self.assertTrue(hashers.verify_password('test#op3456', hashed))
+			self.assertFalse(hashers.verify_password('test#op3457', hashed))
+			self.assertEqual(hasher.cost(hashed), cost)
+
+	def test_unusable_password_hasher_fails_at_startup(self):
+		"""test an unknown or unavailable PASSWORD_HASHER is rejected when the app starts"""
+		unavailable = [name for name, hasher in hashers.HASHERS.items() if not hasher.available]
+		for name in ['argon2'] + unavailable:
+			app.config['PASSWORD_HASHER'] = name
+			with self.assertRaises(RuntimeError):
+				hashers.init_app(app)
+
+		# hashes stay recognised without the hasher, so the error names the cause
+		scrypt_hash = 'scrypt:1024:8:1$salt$digest'
+		self.assertIs(hashers.identify(scrypt_hash), hashers.HASHERS['scrypt'])
+
+	def test_bloom_filter_has_no_false_negatives(self):
+		"""test bloom filter always finds keys that were added"""
+		bloom = BloomFilter(1000, 0.01)
+		keys = [f'token-{i}' for i in range(1000)]
+		for key in keys:
+			bloom.add(key)
+
+		self.assertTrue(all(key in bloom for key in keys))
+		false_positives = sum(f'other-{i}' in bloom for i in range(1000))
+		self.assertLess(false_positives, 50)
+
+	def test_login_returns_refresh_token(self):
+		"""test short lived access tokens and a refresh token are issued in refresh token mode"""
+		app.config['AUTH_REFRESH_TOKENS'] = True
+		with self.client:
+			login_data = self.register_and_login_in_user()
+			access = self.token_payload(login_data['auth_token'])
+			refresh = self.token_payload(login_data['refresh_token'])
+
+			self.assertEqual(access['typ'], 'access')
+			self.assertEqual(access['exp'] - access['iat'], app.config['AUTH_ACCESS_TOKEN_EXPIRY_SECONDS'])
+			self.assertEqual(refresh['typ'], 'refresh')
+			self.assertEqual(RefreshToken.query.filter_by(jti=refresh['jti']).count(), 1)
+
+	def test_refresh_token_is_rotated(self):
+		"""test a refresh token can only be used once and reuse revokes the whole family"""
+		app.config['AUTH_REFRESH_TOKENS'] = True
+		with self.client:
+			login_data = self.register_and_login_in_user()
+
+			res = self.refresh_user_token(login_data['refresh_token'])
+			data = json.loads(res.data.decode())
+			self.assertEqual(res.status_code, 200)
+			self.assertNotEqual(data['refresh_token'], login_data['refresh_token'])
+
+			res = self.refresh_user_token(login_data['refresh_token'])
+			self.assertEqual(res.status_code, 401)
+			self.assertIn('Token was revoked', str(res.data))
+
+			res = self.refresh_user_token(data['refresh_token'])
+			self.assertEqual(res.status_code, 401)
+
+	def test_refresh_token_is_not_an_access_token(self):
+		"""test refresh tokens are rejected by protected routes"""
+		app.config['AUTH_REFRESH_TOKENS'] = True
+		with self.client:
+			login_data = self.register_and_login_in_user()
+			res = self.client.get(
+				'/api/v2/books',
+				headers=dict(Authorization=f'Bearer {login_data["refresh_token"]}')
+			)
+			self.assertEqual(res.status_code, 401)
+
+	def test_access_tokens_skip_the_blacklist(self):
+		"""test access tokens are checked by expiry alone in refresh token mode"""
+		app.config['AUTH_REFRESH_TOKENS'] = True
+		with self.client:
+			login_data = self.register_and_login_in_user()
+			with self.query_budget(forbidden=['black_list_tokens']):
+				res = self.client.get(
+					'/api/v2/books',
+					headers=dict(Authorization=f'Bearer {login_data["auth_token"]}')
+				)
+
+			self.assertEqual(res.status_code, 204)
+
+	def test_logout_revokes_refresh_token(self):
+		"""test logging out revokes the refresh token instead of blacklisting the access token"""
+		app.config['AUTH_REFRESH_TOKENS'] = True
+		with self.client:
+			login_data = self.register_and_login_in_user()
+			res = self.client.post(
+				f'{URL_AUTH}logout',
+				headers=dict(Authorization=f'Bearer {login_data["auth_token"]}'),
+				content_type='application/json',
+				data=json.dumps(dict(refresh_token=login_data['refresh_token']))
+			)
+			self.assertEqual(res.status_code, 200)
+			self.assertEqual(BlacklistToken.query.count(), 0)
+
+			res = self.refresh_user_token(login_data['refresh_token'])
+			self.assertEqual(res.status_code, 401)
+
+	def test_refresh_route_is_disabled_by_default(self):
+		"""test the refresh route only exists in refresh token mode"""
+		with self.client:
+			res = self.refresh_user_token('token')
+			self.assertEqual(res.status_code, 404)
+
 	# use functions
 	def register_wrong_content_type(self, username, email, password):
 		"""this function uses content-type: text"""
@@ -253,15 +509,16 @@ class TestAuthBlueprint(BaseTestCase):
 			content_type='application/json',
 			data=json.dumps(dict(username=username, email=email)))
 
-	def register_and_login_in_user(self):
+	def register_and_login_in_user(self, register=True):
 		"""
 		Helper method to sign up and login a user
 		:return: Json login response
 		"""
-		reg_user = self.register_user('lilbaby', 'lilb@mail.com', 'test#op3456', 'test#op3456')
-		data = json.loads(reg_user.data.decode())
-		self.assertEqual(reg_user.status_code, 201)
-		self.assertIn('successfully registered', str(data))
+		if register:
+			reg_user = self.register_user('lilbaby', 'lilb@mail.com', 'test#op3456', 'test#op3456')
+			data = json.loads(reg_user.data.decode())
+			self.assertEqual(reg_user.status_code, 201)
+			self.assertIn('successfully registered', str(data))
 
 		# login user
 		login_res = self.client.post(
@@ -278,6 +535,17 @@ class TestAuthBlueprint(BaseTestCase):
 		self.assertIn('successfully logged in', str(login_data))
 		return login_data
 
+	def token_payload(self, token):
+		"""decode a token without verifying it"""
+		return jwt.decode(token, algorithms=['HS256'], options={'verify_signature': False})
+
+	def refresh_user_token(self, refresh_token):
+		return self.client.post(
+			f'{URL_AUTH}refresh',
+			content_type='application/json',
+			data=json.dumps(dict(refresh_token=refresh_token))
+		)
+
 	def logout_user(self, token):
 		logout_res = self.client.post(
 			f'{URL_AUTH}logout',
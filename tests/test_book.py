@@ -1,5 +1,16 @@
 from tests.base import BaseTestCase
+from app import app, db
+from app.models import Book, CatalogVersion, TITLE_SEARCH
+from app.books import catalog
+from app.books.cache import response_cache
+from app.books.suggest import suggest_index
+from werkzeug.http import http_date
+import manage
+from contextlib import redirect_stdout
+import io
 import json
+import os
+import tempfile
 
 URL_BOOKS = '/api/v2/books'
 URL_AUTH = '/api/v2/auth/'
@@ -23,14 +34,15 @@ class TestBookMethods(BaseTestCase):
 				'title': 'Hello Books',
 				'isbn': '5698745124'
 			}
-			login_data = self.login_test_user()
-			token = login_data['auth_token']
-			res = self.client.post(
-				f'{URL_BOOKS}',
-				headers=dict(Authorization=f'Bearer {token}'),
-				content_type='application/json',
-				data=json.dumps(add_book)
-			)
+			with self.query_budget():
+				login_data = self.login_test_user()
+				token = login_data['auth_token']
+				res = self.client.post(
+					f'{URL_BOOKS}',
+					headers=dict(Authorization=f'Bearer {token}'),
+					content_type='application/json',
+					data=json.dumps(add_book)
+				)
 			res2 = json.loads(res.data.decode())
 			self.assertIn('success', str(res2))
 
@@ -118,21 +130,22 @@ class TestBookMethods(BaseTestCase):
 			'title': 'Hello Books',
 			'isbn': '5698745124'
 		}
-		login_data = self.login_test_user()
-		token = login_data['auth_token']
-		res = self.client.post(
-			f'{URL_BOOKS}',
-			headers=dict(Authorization=f'Bearer {token}'),
-			content_type='application/json',
-			data=json.dumps(add_book)
-		)
+		with self.query_budget():
+			login_data = self.login_test_user()
+			token = login_data['auth_token']
+			res = self.client.post(
+				f'{URL_BOOKS}',
+				headers=dict(Authorization=f'Bearer {token}'),
+				content_type='application/json',
+				data=json.dumps(add_book)
+			)
 
-		# get book id
-		book = self.client.get(
-			f'{URL_BOOKS}/1',
-			headers=dict(Authorization=f'Bearer {token}'),
-			content_type='application/json'
-		)
+			# get book id
+			book = self.client.get(
+				f'{URL_BOOKS}/1',
+				headers=dict(Authorization=f'Bearer {token}'),
+				content_type='application/json'
+			)
 
 		book_res = json.loads(book.data.decode())
 		self.assertTrue(book_res['books']['title'] == 'hello books')
@@ -187,26 +200,27 @@ class TestBookMethods(BaseTestCase):
 			'title': 'Hello Books',
 			'isbn': '5698745124'
 		}
-		login_data = self.login_test_user()
-		token = login_data['auth_token']
-		res = self.client.post(
-			f'{URL_BOOKS}',
-			headers=dict(Authorization=f'Bearer {token}'),
-			content_type='application/json',
-			data=json.dumps(add_book)
-		)
+		with self.query_budget():
+			login_data = self.login_test_user()
+			token = login_data['auth_token']
+			res = self.client.post(
+				f'{URL_BOOKS}',
+				headers=dict(Authorization=f'Bearer {token}'),
+				content_type='application/json',
+				data=json.dumps(add_book)
+			)
 
-		# update book
-		book = self.client.put(
-			f'{URL_BOOKS}/1',
-			headers=dict(Authorization=f'Bearer {token}'),
-			content_type='application/json',
-			data=json.dumps(
-				dict(
-					title='updated book'
+			# update book
+			book = self.client.put(
+				f'{URL_BOOKS}/1',
+				headers=dict(Authorization=f'Bearer {token}'),
+				content_type='application/json',
+				data=json.dumps(
+					dict(
+						title='updated book'
+					)
 				)
 			)
-		)
 
 		book_res = json.loads(book.data.decode())
 		self.assertTrue(book_res['title'] == 'updated book')
@@ -397,19 +411,20 @@ class TestBookMethods(BaseTestCase):
 			'isbn': '5698745124'
 		}
 
-		login_data = self.login_test_user()
-		token = login_data['auth_token']
-		res = self.client.post(
-			f'{URL_BOOKS}',
-			headers=dict(Authorization=f'Bearer {token}'),
-			content_type='application/json',
-			data=json.dumps(add_book)
-		)
+		with self.query_budget():
+			login_data = self.login_test_user()
+			token = login_data['auth_token']
+			res = self.client.post(
+				f'{URL_BOOKS}',
+				headers=dict(Authorization=f'Bearer {token}'),
+				content_type='application/json',
+				data=json.dumps(add_book)
+			)
 
-		# get books
-		res = self.client.get(
-			f'{URL_BOOKS}?limit=1&page=1',
-			headers=dict(Authorization=f'Bearer {token}'))
+			# get books
+			res = self.client.get(
+				f'{URL_BOOKS}?limit=1&page=1',
+				headers=dict(Authorization=f'Bearer {token}'))
 
 		pagination = json.loads(res.data.decode())
 		self.assertTrue(pagination['current_page'] == 1)
@@ -417,6 +432,438 @@ class TestBookMethods(BaseTestCase):
 		self.assertTrue(pagination['has_prev'] == False)
 		self.assertTrue(pagination['total_pages'] == 1)
 
+	def test_get_books_with_cursor(self):
+		"""test cursor pagination walks every book once in id and title order"""
+		for i, title in enumerate(['b', 'a', 'c', 'a', 'b']):
+			db.session.add(Book(title=title, isbn=f'{i:010}'))
+		db.session.commit()
+		token = self.login_test_user()['auth_token']
+
+		for order, expected in (('id', [1, 2, 3, 4, 5]), ('title', [2, 4, 1, 5, 3])):
+			seen = []
+			url = f'{URL_BOOKS}?limit=2&order={order}'
+			while url:
+				res = self.client.get(url, headers=dict(Authorization=f'Bearer {token}'))
+				self.assertEqual(res.status_code, 200)
+				page = json.loads(res.data.decode())
+				self.assertNotIn('total_pages', page)
+				seen.extend(book['id'] for book in page['books'])
+				url = f'{URL_BOOKS}?limit=2&after={page["next_cursor"]}' if page['has_next'] else None
+			self.assertEqual(seen, expected)
+
+	def test_get_books_with_cursor_total_and_errors(self):
+		"""test cursor pagination counts pages on request and rejects bad cursors"""
+		for i in range(3):
+			db.session.add(Book(title=f'book {i}', isbn=f'{i:010}'))
+		db.session.commit()
+		headers = dict(Authorization=f'Bearer {self.login_test_user()["auth_token"]}')
+
+		res = self.client.get(f'{URL_BOOKS}?limit=2&include_total=true', headers=headers)
+		page = json.loads(res.data.decode())
+		self.assertEqual(page['total_pages'], 2)
+
+		res = self.client.get(f'{URL_BOOKS}?after=bm90IGEgY3Vyc29y', headers=headers)
+		self.assertEqual(res.status_code, 400)
+		self.assertIn('invalid cursor', str(res.data))
+
+		res = self.client.get(f'{URL_BOOKS}?after={page["next_cursor"]}&order=title', headers=headers)
+		self.assertEqual(res.status_code, 400)
+
+	def test_stream_all_books(self):
+		"""test the book list can be streamed as ndjson and as one json document"""
+		app.config['BOOKS_STREAM_BATCH_SIZE'] = 2
+		headers = dict(Authorization=f'Bearer {self.login_test_user()["auth_token"]}')
+
+		res = self.client.get(f'{URL_BOOKS}?stream=1', headers=headers)
+		self.assertEqual(res.status_code, 204)
+
+		for i in range(5):
+			db.session.add(Book(title=f'book {i}', isbn=f'{i:010}'))
+		db.session.commit()
+
+		res = self.client.get(f'{URL_BOOKS}?stream=1', headers=headers)
+		self.assertTrue(res.is_streamed)
+		self.assertEqual([book['id'] for book in json.loads(res.data.decode())['books']], [1, 2, 3, 4, 5])
+
+		res = self.client.get(URL_BOOKS, headers=dict(headers, Accept='application/x-ndjson'))
+		self.assertEqual(res.mimetype, 'application/x-ndjson')
+		lines = res.data.decode().splitlines()
+		self.assertEqual([json.loads(line)['title'] for line in lines], [f'book {i}' for i in range(5)])
+
+		# any other value gets the usual list, paginated or not
+		res = self.client.get(f'{URL_BOOKS}?stream=0', headers=headers)
+		self.assertEqual(res.status_code, 200)
+		self.assertEqual(len(json.loads(res.data.decode())['books']), 5)
+		res = self.client.get(f'{URL_BOOKS}?stream=0&limit=2&page=1', headers=headers)
+		self.assertEqual(len(json.loads(res.data.decode())['books']), 2)
+
+	def test_json_engines_agree_on_output(self):
+		"""test orjson and the stdlib encoder write the same compact json with http dates and escaped text"""
+		db.session.add(Book(title='Hello Books', isbn='5698745124'))
+		db.session.commit()
+		headers = dict(Authorization=f'Bearer {self.login_test_user()["auth_token"]}')
+		app.config['DEBUG'] = False
+
+		bodies, titles = [], []
+		for engine in ('orjson', 'stdlib'):
+			app.config['JSON_ENGINE'] = engine
+			res = self.client.get(URL_BOOKS, headers=headers)
+			bodies.append(res.data)
+			titles.append(app.json_encoder(separators=(',', ':')).encode({'title': 'Ngũgĩ wa Thiong’o'}))
+
+		self.assertEqual(bodies[0], bodies[1])
+		self.assertNotIn(b'\n ', bodies[0])
+		self.assertEqual(titles[0], titles[1])
+		self.assertEqual(titles[0], '{"title":"Ng\\u0169g\\u0129 wa Thiong\\u2019o"}')
+		book = json.loads(bodies[0].decode())['books'][0]
+		self.assertEqual(book['date_created'], http_date(Book.query.get(1).date_created.utctimetuple()))
+
+	def test_create_books_in_bulk(self):
+		"""test books can be created in bulk with a result for every row"""
+		app.config['BOOKS_BULK_BATCH_SIZE'] = 2
+		db.session.add(Book(title='Hello Books', isbn='5698745124'))
+		db.session.commit()
+		headers = dict(Authorization=f'Bearer {self.login_test_user()["auth_token"]}')
+		new_books = [
+			{'title': '  Hello   Books 2 ', 'isbn': '1111111111'},
+			{'title': 'Hello Books', 'isbn': '5698745124'},
+			{'title': 'Hello Books 3', 'isbn': '12345'},
+			{'title': 'Hello Books 4', 'isbn': '2222222222'},
+			{'title': 'Hello Books 2 again', 'isbn': '1111111111'},
+			{'isbn': '3333333333'},
+			{'title': 'a' * 151, 'isbn': '4444444444'}
+		]
+
+		res = self.client.post(
+			f'{URL_BOOKS}/bulk',
+			headers=headers,
+			content_type='application/json',
+			data=json.dumps(new_books)
+		)
+		res_data = json.loads(res.data.decode())
+		self.assertEqual(res.status_code, 201)
+		self.assertEqual(
+			[result['status'] for result in res_data['results']],
+			['created', 'duplicate', 'error', 'created', 'duplicate', 'error', 'error']
+		)
+		self.assertEqual(res_data['results'][2]['message'], 'isbn length must be 10')
+		self.assertEqual(res_data['results'][6]['message'], 'title must be at most 150 characters')
+		self.assertEqual(Book.query.get(res_data['results'][0]['id']).title, 'hello books 2')
+		self.assertEqual(Book.query.count(), 3)
+
+		res = self.client.post(
+			f'{URL_BOOKS}/bulk',
+			headers=headers,
+			content_type='application/x-ndjson',
+			data='\n'.join(json.dumps(book) for book in new_books[:2])
+		)
+		res_data = json.loads(res.data.decode())
+		self.assertEqual(res.status_code, 200)
+		self.assertEqual(res_data['duplicates'], 2)
+
+	def test_create_books_in_bulk_rejects_bad_bodies(self):
+		"""test bulk creation needs an admin and a list of books"""
+		headers = dict(Authorization=f'Bearer {self.login_test_user()["auth_token"]}')
+
+		res = self.client.post(f'{URL_BOOKS}/bulk', headers=headers, content_type='application/json', data='{"title"')
+		self.assertEqual(res.status_code, 400)
+		res = self.client.post(f'{URL_BOOKS}/bulk', headers=headers, content_type='application/json', data='{}')
+		self.assertEqual(res.status_code, 400)
+
+		token = self.register_and_login_in_user()['auth_token']
+		res = self.client.post(
+			f'{URL_BOOKS}/bulk',
+			headers=dict(Authorization=f'Bearer {token}'),
+			content_type='application/json',
+			data='[]'
+		)
+		self.assertEqual(res.status_code, 403)
+
+	def test_import_books_from_csv(self):
+		"""test csv import normalizes rows, skips invalid ones and upserts on isbn"""
+		db.session.add(Book(title='old title', isbn='1111111111'))
+		db.session.commit()
+		path = self.write_file(
+			'.csv',
+			'isbn,Title,author\n'
+			'1111111111,  New   Title ,someone\n'
+			'2222222222,"Books, Volume 2",someone\n'
+			'12345,short isbn,someone\n'
+			'3333333333,,someone\n'
+			'2222222222,Books Volume 2 again,someone\n'
+			f'4444444444,{"a" * 151},someone\n'
+		)
+
+		self.assertEqual(catalog.import_books(path), (6, 2))
+		self.assertEqual(Book.query.filter_by(isbn='1111111111').one().title, 'new title')
+		self.assertEqual(Book.query.filter_by(isbn='2222222222').one().title, 'books volume 2 again')
+		self.assertEqual(Book.query.count(), 2)
+
+	def test_import_command_reports_bad_rows(self):
+		"""test the import command reports a row copy can't read instead of failing"""
+		path = self.write_file('.csv', 'isbn,title\n1111111111,Hello Books,extra column\n')
+
+		output = io.StringIO()
+		with redirect_stdout(output):
+			manage.import_books(path)
+		self.assertTrue(output.getvalue().startswith('error: extra data after last expected column'))
+		self.assertEqual(Book.query.count(), 0)
+
+	def test_import_and_export_books_as_ndjson(self):
+		"""test books exported as ndjson or csv can be imported again"""
+		path = self.write_file(
+			'.ndjson',
+			json.dumps({'title': 'Hello Books', 'isbn': '1111111111'}) + '\n' +
+			'not json\n' +
+			json.dumps({'title': 'Hello,  Books 2', 'isbn': '2222222222'}) + '\n'
+		)
+		self.assertEqual(catalog.import_books(path), (3, 2))
+
+		for suffix in ('.ndjson', '.csv'):
+			export_path = self.write_file(suffix, '')
+			self.assertEqual(catalog.export_books(export_path, batch_size=1), 2)
+
+			Book.query.delete()
+			db.session.commit()
+			self.assertEqual(catalog.import_books(export_path), (2, 2))
+			self.assertEqual([book.title for book in Book.query.order_by(Book.isbn)], ['hello books', 'hello, books 2'])
+
+	def test_book_responses_are_cached_per_query(self):
+		"""test repeated reads are served from the response cache, keyed by their args"""
+		for i in range(3):
+			db.session.add(Book(title=f'book {i}', isbn=f'{i:010}'))
+		db.session.commit()
+		headers = dict(Authorization=f'Bearer {self.login_test_user()["auth_token"]}')
+
+		first = self.client.get(f'{URL_BOOKS}?limit=2', headers=headers)
+		second = self.client.get(f'{URL_BOOKS}?limit=2', headers=headers)
+		self.assertEqual(first.headers['X-Cache'], 'MISS')
+		self.assertEqual(second.headers['X-Cache'], 'HIT')
+		self.assertEqual(first.data, second.data)
+		self.assertEqual(second.mimetype, 'application/json')
+
+		res = self.client.get(f'{URL_BOOKS}?limit=1', headers=headers)
+		self.assertEqual(res.headers['X-Cache'], 'MISS')
+		self.assertEqual(len(json.loads(res.data.decode())['books']), 1)
+
+		res = self.client.get(f'{URL_BOOKS}/1', headers=headers)
+		self.assertEqual(res.headers['X-Cache'], 'MISS')
+		res = self.client.get(f'{URL_BOOKS}/1', headers=headers)
+		self.assertEqual(res.headers['X-Cache'], 'HIT')
+
+		# errors and streams are never stored
+		self.client.get(f'{URL_BOOKS}/9', headers=headers)
+		self.assertNotIn('X-Cache', self.client.get(f'{URL_BOOKS}/9', headers=headers).headers)
+		res = self.client.get(f'{URL_BOOKS}?stream=1', headers=headers)
+		self.assertEqual(len(json.loads(res.data.decode())['books']), 3)
+		self.assertNotIn('X-Cache', res.headers)
+		self.assertEqual(response_cache.as_dict()['hits'], 2)
+
+	def test_book_cache_is_invalidated_by_writes(self):
+		"""test no cached response survives a write to the catalog"""
+		headers = dict(Authorization=f'Bearer {self.login_test_user()["auth_token"]}')
+
+		def titles():
+			res = self.client.get(URL_BOOKS, headers=headers)
+			self.assertEqual(res.headers['X-Cache'], 'MISS')
+			self.assertEqual(self.client.get(URL_BOOKS, headers=headers).headers['X-Cache'], 'HIT')
+			if res.status_code == 204:
+				return []
+			return [(book['title'], book['is_borrowed']) for book in json.loads(res.data.decode())['books']]
+
+		self.assertEqual(titles(), [])
+		self.client.post(URL_BOOKS, headers=headers, content_type='application/json', data=json.dumps({'title': 'one', 'isbn': '1234567890'}))
+		self.assertEqual(titles(), [('one', False)])
+		self.client.put(f'{URL_BOOKS}/1', headers=headers, content_type='application/json', data=json.dumps({'title': 'two'}))
+		self.assertEqual(titles(), [('two', False)])
+		self.client.post('/api/v2/users/books/1', headers=headers)
+		self.assertEqual(titles(), [('two', True)])
+		self.client.put('/api/v2/users/books/1', headers=headers)
+		self.assertEqual(titles(), [('two', False)])
+		catalog.import_books(self.write_file('.csv', 'title,isbn\nthree,1234567890\n'))
+		self.assertEqual(titles(), [('three', False)])
+		self.client.delete(f'{URL_BOOKS}/1', headers=headers)
+		self.assertEqual(titles(), [])
+		self.assertEqual(response_cache.as_dict()['stale'], 6)
+
+	def test_loans_leave_the_catalog_version_alone(self):
+		"""test a loan retires cached lists and its own book but no other book or the catalog version"""
+		db.session.add_all([Book(title='one', isbn='0000000001'), Book(title='two', isbn='0000000002')])
+		db.session.commit()
+		headers = dict(Authorization=f'Bearer {self.login_test_user()["auth_token"]}')
+		for url in (URL_BOOKS, f'{URL_BOOKS}/1', f'{URL_BOOKS}/2'):
+			self.client.get(url, headers=headers)
+		version = CatalogVersion.current()[0]
+
+		self.assertEqual(self.client.post('/api/v2/users/books/1', headers=headers).status_code, 200)
+		self.assertEqual(CatalogVersion.current()[0], version)
+		self.assertEqual(self.client.get(f'{URL_BOOKS}/2', headers=headers).headers['X-Cache'], 'HIT')
+		self.assertEqual(self.client.get(f'{URL_BOOKS}/1', headers=headers).headers['X-Cache'], 'MISS')
+		res = self.client.get(URL_BOOKS, headers=headers)
+		self.assertEqual(res.headers['X-Cache'], 'MISS')
+		self.assertEqual({book['title']: book['is_borrowed'] for book in json.loads(res.data.decode())['books']}, {'one': True, 'two': False})
+
+	def test_unchanged_book_list_is_not_modified(self):
+		"""test revalidating an unchanged list returns an empty 304 without loading a book"""
+		app.config['BOOKS_CACHE_ENABLED'] = False
+		db.session.add_all(Book(title=f'book {i}', isbn=f'{i:010}') for i in range(500))
+		db.session.commit()
+		headers = dict(Authorization=f'Bearer {self.login_test_user()["auth_token"]}')
+
+		def get(**extra):
+			return self.client.get(URL_BOOKS, headers=dict(headers, **extra))
+
+		full = get()
+		self.assertEqual(full.status_code, 200)
+		etag = full.headers['ETag']
+
+		with self.capture_queries() as statements:
+			not_modified = get(**{'If-None-Match': etag})
+		self.assertEqual(not_modified.status_code, 304)
+		self.assertEqual(not_modified.data, b'')
+		self.assertEqual(not_modified.headers['ETag'], etag)
+		self.assertFalse([statement for statement in statements if 'FROM books' in statement])
+		self.assertGreater(len(full.data) - len(not_modified.data), 500 * 50)
+
+		# loans leave no time behind, so lists only revalidate by ETag
+		self.assertNotIn('Last-Modified', full.headers)
+
+		# other args are another representation, a write is a new version
+		res = self.client.get(f'{URL_BOOKS}?limit=2', headers=dict(headers, **{'If-None-Match': etag}))
+		self.assertEqual(res.status_code, 200)
+		Book.query.get(1).title = 'changed'
+		db.session.commit()
+		res = get(**{'If-None-Match': etag})
+		self.assertEqual(res.status_code, 200)
+		self.assertNotEqual(res.headers['ETag'], etag)
+
+	def test_unchanged_book_is_not_modified(self):
+		"""test a single book revalidates against its own date_modified"""
+		db.session.add_all([Book(title='one', isbn='0000000001'), Book(title='two', isbn='0000000002')])
+		db.session.commit()
+		headers = dict(Authorization=f'Bearer {self.login_test_user()["auth_token"]}')
+
+		full = self.client.get(f'{URL_BOOKS}/1', headers=headers)
+		etag = full.headers['ETag']
+		res = self.client.get(f'{URL_BOOKS}/1', headers=dict(headers, **{'If-None-Match': etag}))
+		self.assertEqual(res.status_code, 304)
+		res = self.client.get(f'{URL_BOOKS}/1', headers=dict(headers, **{'If-Modified-Since': full.headers['Last-Modified']}))
+		self.assertEqual(res.status_code, 304)
+
+		# a write to another book leaves this one valid
+		self.client.put(f'{URL_BOOKS}/2', headers=headers, content_type='application/json', data=json.dumps({'title': 'three'}))
+		res = self.client.get(f'{URL_BOOKS}/1', headers=dict(headers, **{'If-None-Match': etag}))
+		self.assertEqual(res.status_code, 304)
+
+		self.client.post('/api/v2/users/books/1', headers=headers)
+		res = self.client.get(f'{URL_BOOKS}/1', headers=dict(headers, **{'If-None-Match': etag}))
+		self.assertEqual(res.status_code, 200)
+		self.assertTrue(json.loads(res.data.decode())['books']['is_borrowed'])
+
+	def test_search_books_by_title(self):
+		"""test title search ranks better matches first and pages with a cursor"""
+		titles = ['the lost city', 'lost', 'city of gold', 'lost and found lost', 'found']
+		db.session.add_all(Book(title=title, isbn=f'{i:010}') for i, title in enumerate(titles))
+		db.session.commit()
+		headers = dict(Authorization=f'Bearer {self.login_test_user()["auth_token"]}')
+
+		def search(query):
+			res = self.client.get(f'{URL_BOOKS}/search?{query}', headers=headers)
+			self.assertEqual(res.status_code, 200)
+			return json.loads(res.data.decode())
+
+		result = search('q=Lost')
+		self.assertEqual([book['title'] for book in result['books']][0], 'lost and found lost')
+		self.assertEqual(len(result['books']), 3)
+
+		# a title needs every word
+		self.assertEqual([book['title'] for book in search('q=lost city')['books']], ['the lost city'])
+		self.assertEqual([book['title'] for book in search('q=City, gold!')['books']], ['city of gold'])
+		self.assertEqual(search('q=missing')['books'], [])
+
+		pages = [search('q=lost&limit=2')]
+		while pages[-1]['has_next']:
+			pages.append(search(f'q=lost&limit=2&after={pages[-1]["next_cursor"]}'))
+		self.assertEqual(len(pages), 2)
+		self.assertEqual(sorted(book['id'] for page in pages for book in page['books']), [1, 2, 4])
+
+		# the search repeats the index expression, so the index can serve it
+		query = db.session.query(Book.id).filter(TITLE_SEARCH.op('@@')(db.func.plainto_tsquery('simple', 'lost')))
+		statement = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+		db.session.execute('SET LOCAL enable_seqscan = off')
+		plan = ' '.join(row[0] for row in db.session.execute(f'EXPLAIN {statement}'))
+		self.assertIn('ix_books_title_search', plan)
+
+		res = self.client.get(f'{URL_BOOKS}/search?q=', headers=headers)
+		self.assertEqual(res.status_code, 400)
+		res = self.client.get(f'{URL_BOOKS}/search?q=lost&after=abc', headers=headers)
+		self.assertEqual(res.status_code, 400)
+
+	def test_suggest_titles_by_prefix(self):
+		"""test suggestions come from the suggest index, kept current by writes, and from the database when it's cold"""
+		titles = ['lost city', 'lost', 'lost and found', 'city of gold', 'lo_st']
+		db.session.add_all(Book(title=title, isbn=f'{i:010}') for i, title in enumerate(titles))
+		db.session.commit()
+		headers = dict(Authorization=f'Bearer {self.login_test_user()["auth_token"]}')
+
+		def suggest(query):
+			res = self.client.get(f'{URL_BOOKS}/suggest?{query}', headers=headers)
+			self.assertEqual(res.status_code, 200)
+			titles = [book['title'] for book in json.loads(res.data.decode())['suggestions']]
+			return titles, res.headers['X-Suggest-Source']
+
+		expected = ['lost', 'lost and found', 'lost city']
+		app.config['BOOKS_SUGGEST_INDEX_ENABLED'] = False
+		self.assertEqual(suggest('prefix=Lost'), (expected, 'database'))
+		self.assertEqual(suggest('prefix=lo_'), (['lo_st'], 'database'))
+
+		app.config['BOOKS_SUGGEST_INDEX_ENABLED'] = True
+		self.assertEqual(suggest('prefix=Lost'), (expected, 'memory'))
+		self.assertEqual(suggest('prefix=lost &limit=1'), (['lost and found'], 'memory'))
+		self.assertEqual(suggest('prefix=lo_'), (['lo_st'], 'memory'))
+
+		# this worker's writes are applied in place
+		self.client.put(f'{URL_BOOKS}/4', headers=headers, content_type='application/json', data=json.dumps({'title': 'lost gold'}))
+		self.client.delete(f'{URL_BOOKS}/2', headers=headers)
+		self.client.post('/api/v2/users/books/1', headers=headers)
+		self.assertEqual(suggest('prefix=lost'), (['lost and found', 'lost city', 'lost gold'], 'memory'))
+		self.assertEqual(suggest_index.titles_version, CatalogVersion.titles())
+
+		# writes the index didn't see are picked up on the next check
+		catalog.import_books(self.write_file('.csv', 'title,isbn\nlost world,0000000009\n'))
+		self.assertEqual(suggest('prefix=lost w'), ([], 'memory'))
+		app.config['BOOKS_SUGGEST_REFRESH_SECONDS'] = 0
+		self.assertEqual(suggest('prefix=lost w'), (['lost world'], 'memory'))
+
+		res = self.client.get(f'{URL_BOOKS}/suggest?prefix=%20', headers=headers)
+		self.assertEqual(res.status_code, 400)
+
+	def test_get_many_books_by_id_and_isbn(self):
+		"""test many books are fetched in the requested order in chunked queries, with the missing keys"""
+		app.config['BOOKS_CACHE_ENABLED'] = False
+		app.config['BOOKS_MULTI_GET_CHUNK_SIZE'] = 2
+		db.session.add_all(Book(title=f'book {i}', isbn=f'{i:010}') for i in range(1, 6))
+		db.session.commit()
+		headers = dict(Authorization=f'Bearer {self.login_test_user()["auth_token"]}')
+		self.client.get(URL_BOOKS, headers=headers)
+
+		with self.capture_queries() as statements:
+			res = self.client.get(f'{URL_BOOKS}?ids=5,9,1,3,1', headers=headers)
+		result = json.loads(res.data.decode())
+		self.assertEqual([book['id'] for book in result['books']], [5, 1, 3])
+		self.assertEqual(result['missing'], [9])
+		self.assertEqual(len([statement for statement in statements if 'ANY' in statement]), 2)
+
+		res = self.client.get(f'{URL_BOOKS}?isbn=0000000004,0000000099,0000000002', headers=headers)
+		result = json.loads(res.data.decode())
+		self.assertEqual([book['title'] for book in result['books']], ['book 4', 'book 2'])
+		self.assertEqual(result['missing'], ['0000000099'])
+
+		app.config['BOOKS_MULTI_GET_MAX_KEYS'] = 3
+		for query in ('ids=1,2,3,4', 'ids=1,x', 'ids=', 'ids=1&isbn=0000000001', 'ids=1&limit=2', 'ids=1,²', 'ids=2147483648'):
+			res = self.client.get(f'{URL_BOOKS}?{query}', headers=headers)
+			self.assertEqual(res.status_code, 400, query)
+
 	def test_delete_book(self):
 		"""test api can delete book with id"""
 
@@ -426,25 +873,76 @@ class TestBookMethods(BaseTestCase):
 			'isbn': '5698745124'
 		}
 
+		with self.query_budget():
+			login_data = self.login_test_user()
+			token = login_data['auth_token']
+			res = self.client.post(
+				f'{URL_BOOKS}',
+				headers=dict(Authorization=f'Bearer {token}'),
+				content_type='application/json',
+				data=json.dumps(add_book)
+			)
+
+			# delete book
+			del_book = self.client.delete(
+				f'{URL_BOOKS}/1',
+				headers=dict(Authorization=f'Bearer {token}')
+			)
+
+		res3 = json.loads(del_book.data.decode())
+		self.assertTrue(res3['message'] == 'book with id 1 has been deleted')
+
+	def test_stateless_book_reads_skip_users_table(self):
+		"""test book reads don't query the users table in stateless mode"""
+		app.config['AUTH_STATELESS'] = True
 		login_data = self.login_test_user()
 		token = login_data['auth_token']
-		res = self.client.post(
+		self.client.post(
 			f'{URL_BOOKS}',
 			headers=dict(Authorization=f'Bearer {token}'),
 			content_type='application/json',
-			data=json.dumps(add_book)
+			data=json.dumps({'title': 'Hello Books', 'isbn': '5698745124'})
 		)
 
-		# delete book
-		del_book = self.client.delete(
-			f'{URL_BOOKS}/1',
-			headers=dict(Authorization=f'Bearer {token}')
-		)
+		with self.query_budget(forbidden=[r'\busers\b']):
+			all_books = self.client.get(f'{URL_BOOKS}', headers=dict(Authorization=f'Bearer {token}'))
+			single_book = self.client.get(f'{URL_BOOKS}/1', headers=dict(Authorization=f'Bearer {token}'))
 
-		res3 = json.loads(del_book.data.decode())
-		self.assertTrue(res3['message'] == 'book with id 1 has been deleted')
+		self.assertEqual(all_books.status_code, 200)
+		self.assertEqual(single_book.status_code, 200)
+
+	def test_stateless_rejects_outdated_role_claims(self):
+		"""test a demoted admin's old token can't be used for admin actions"""
+		app.config['AUTH_STATELESS'] = True
+		login_data = self.login_test_user()
+		token = login_data['auth_token']
+
+		self.test_user.is_admin = False
+		self.test_user.bump_token_version()
+		db.session.commit()
+
+		res = self.client.post(
+			f'{URL_BOOKS}',
+			headers=dict(Authorization=f'Bearer {token}'),
+			content_type='application/json',
+			data=json.dumps({'title': 'Hello Books', 'isbn': '5698745124'})
+		)
+		res_data = json.loads(res.data.decode())
+		self.assertEqual(res.status_code, 401)
+		self.assertEqual(res_data['message'], 'Token is outdated, Please login In')
 
 	# useful functions
+	def write_file(self, suffix, content):
+		"""
+		write a temporary file that is removed after the test
+		:return: path
+		"""
+		fd, path = tempfile.mkstemp(suffix=suffix)
+		with os.fdopen(fd, 'w') as temp_file:
+			temp_file.write(content)
+		self.addCleanup(os.remove, path)
+		return path
+
 	def register_user(self, username, email, password, confirm_password):
 		"""
 		Helper method for registering a user with dummy data
@@ -0,0 +1,56 @@
+from tests.base import BaseTestCase
+from app import dataset
+from app.models import Book, BorrowedBook, User
+from multiprocessing import Pool
+import json
+
+
+class TestDataset(BaseTestCase):
+	"""test the synthetic dataset generator"""
+
+	def test_generate_dataset(self):
+		"""test the generator fills every table consistently"""
+		rows = dataset.generate(books=50, users=5, loans=200, open_loans=10, seed=3, chunk_size=30)
+
+		self.assertEqual(rows, {'books': 50, 'users': 5, 'borrowed_books': 210})
+		self.assertEqual(Book.query.count(), 50)
+		self.assertEqual(User.query.count(), 6)
+		open_loans = BorrowedBook.query.filter(BorrowedBook.return_date == None)
+		self.assertEqual(open_loans.count(), 10)
+		self.assertEqual(
+			sorted(loan.book_id for loan in open_loans),
+			sorted(book.id for book in Book.query.filter_by(is_borrowed=True))
+		)
+
+		# sequences continue after the generated ids
+		book = Book(title='hello books', isbn='5698745124')
+		book.save()
+		self.assertEqual(book.id, 51)
+
+		login_res = self.client.post(
+			'/api/v2/auth/login',
+			data=json.dumps(dict(username='loaduser3-2', password=dataset.PASSWORD)),
+			content_type='application/json'
+		)
+		self.assertEqual(login_res.status_code, 200)
+
+	def test_generated_rows_are_deterministic(self):
+		"""test a seed gives the same rows with and without worker processes"""
+		spec = {
+			'seed': 1, 'books': 100, 'users': 10, 'skew': 1.2, 'first_book': 1, 'first_user': 1,
+			'prefix': 'loaduser1-', 'password_hash': dataset.password_hash(1, 1000)
+		}
+		for func in (dataset.book_rows, dataset.user_rows, dataset.loan_rows):
+			local = list(dataset.generate_chunks(func, spec, 1, 500, 64))
+			with Pool(2) as pool:
+				parallel = list(dataset.generate_chunks(func, spec, 1, 500, 64, pool))
+			self.assertEqual(local, parallel)
+
+		spec['seed'] = 2
+		self.assertNotEqual(local, list(dataset.generate_chunks(dataset.loan_rows, spec, 1, 500, 64)))
+
+	def test_generate_needs_an_empty_catalog(self):
+		"""test the generator won't mix its rows with existing books"""
+		Book(title='hello books', isbn='5698745124').save()
+		with self.assertRaises(ValueError):
+			dataset.generate(books=10, users=1, loans=10)
@@ -0,0 +1,89 @@
+from tests.base import BaseTestCase
+from app import app, db
+from app.metrics import TimedQueuePool
+from prometheus_client.parser import text_string_to_metric_families
+from unittest import mock
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# a uWSGI worker in miniature: its own process, serving one unauthenticated request
+WORKER = '''
+from app import app
+assert app.test_client().get('/api/v2/books').status_code == 401
+'''
+
+
+class TestMetrics(BaseTestCase):
+	"""test the prometheus metrics"""
+
+	def scrape(self):
+		"""
+		:return: dict of (sample name, sorted label items) to value from /metrics
+		"""
+		res = self.client.get('/metrics')
+		self.assertEqual(res.status_code, 200)
+		self.assertTrue(res.content_type.startswith('text/plain'))
+		return {
+			(sample.name, tuple(sorted(sample.labels.items()))): sample.value
+			for family in text_string_to_metric_families(res.data.decode())
+			for sample in family.samples
+		}
+
+	def test_request_query_pool_and_cache_metrics(self):
+		"""test a request is counted with its latency, queries, pool checkout and cache lookups"""
+		res = self.client.post(
+			'/api/v2/auth/login',
+			content_type='application/json',
+			data=json.dumps(dict(username='tester', password='tester#Password1'))
+		)
+		headers = dict(Authorization=f'Bearer {json.loads(res.data.decode())["auth_token"]}')
+		before = self.scrape()
+
+		with self.capture_queries() as statements:
+			self.assertEqual(self.client.get('/api/v2/books', headers=headers).status_code, 204)
+		after = self.scrape()
+
+		def delta(name, **labels):
+			key = (name, tuple(sorted(labels.items())))
+			return after.get(key, 0) - before.get(key, 0)
+
+		endpoint = dict(blueprint='books', endpoint='books.api_get_all_books')
+		self.assertEqual(delta('http_requests_total', method='GET', status='204', **endpoint), 1)
+		self.assertEqual(delta('http_request_duration_seconds_count', **endpoint), 1)
+		self.assertGreater(delta('http_request_duration_seconds_sum', **endpoint), 0)
+		self.assertEqual(delta('db_queries_total', **endpoint), len(statements))
+		# the test keeps its session between requests, so look for any checkout at all
+		self.assertIsInstance(db.engine.pool, TimedQueuePool)
+		self.assertGreater(after[('db_pool_checkout_seconds_count', ())], 0)
+		self.assertEqual(delta('cache_lookups_total', cache='user', result='hit') + delta('cache_lookups_total', cache='user', result='miss'), 1)
+		self.assertEqual(delta('cache_lookups_total', cache='books_response', result='miss'), 1)
+		self.assertIn(('http_requests_total', (('blueprint', 'auth'), ('endpoint', 'auth.login'), ('method', 'POST'), ('status', '200'))), after)
+
+	def test_metrics_add_up_across_processes(self):
+		"""test a scrape reports the requests of every worker process, not just its own"""
+		with tempfile.TemporaryDirectory() as path:
+			env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=path, APP_SETTINGS='app.config.TestingConfig')
+			for _ in range(2):
+				subprocess.run([sys.executable, '-c', WORKER], env=env, check=True)
+
+			with mock.patch.dict(os.environ, PROMETHEUS_MULTIPROC_DIR=path):
+				samples = self.scrape()
+
+		labels = (('blueprint', 'books'), ('endpoint', 'books.api_get_all_books'), ('method', 'GET'), ('status', '401'))
+		self.assertEqual(samples[('http_requests_total', labels)], 2)
+
+	def test_metrics_endpoint_is_restricted(self):
+		"""test /metrics can be switched off and asks for the scrape token when there is one"""
+		app.config['METRICS_ENDPOINT_ENABLED'] = False
+		self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+		app.config['METRICS_ENDPOINT_ENABLED'] = True
+		app.config['METRICS_AUTH_TOKEN'] = 'scrape-token'
+		for headers in ({}, dict(Authorization='Bearer wrong'), dict(Authorization='Bearer scrapé')):
+			res = self.client.get('/metrics', headers=headers)
+			self.assertEqual(res.status_code, 401)
+			self.assertEqual(res.headers['WWW-Authenticate'], 'Bearer')
+		self.assertEqual(self.client.get('/metrics', headers=dict(Authorization='Bearer scrape-token')).status_code, 200)
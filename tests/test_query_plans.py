@@ -0,0 +1,64 @@
+from tests.base import BaseTestCase
+from app import db
+from app.models import BorrowedBook, BORROW_BOOK, RETURN_BOOK
+
+
+class TestQueryPlans(BaseTestCase):
+	"""test the loan queries are answered from indexes on a seeded dataset"""
+
+	def setUp(self):
+		super().setUp()
+		db.session.execute(
+			"INSERT INTO users (username, email, password_hash, is_admin) "
+			"SELECT 'user' || i, 'user' || i || '@mail.com', 'hash', false FROM generate_series(1, 500) AS i"
+		)
+		db.session.execute(
+			"INSERT INTO books (title, isbn, is_borrowed) "
+			"SELECT 'book ' || i, lpad(i::text, 10, '0'), i % 10 = 0 FROM generate_series(1, 20000) AS i"
+		)
+		# every book lent once, one loan in ten is still open
+		db.session.execute(
+			"INSERT INTO borrowed_books (user_id, book_id, borrow_date, return_date) "
+			"SELECT i % 500 + 2, i, now(), CASE WHEN i % 10 = 0 THEN NULL ELSE now() END "
+			"FROM generate_series(1, 20000) AS i"
+		)
+		db.session.commit()
+		db.session.execute('ANALYZE users')
+		db.session.execute('ANALYZE books')
+		db.session.execute('ANALYZE borrowed_books')
+
+	def test_borrow_and_return_use_indexes(self):
+		"""test borrowing and returning a book don't scan books or borrowed_books"""
+		self.assertNoSeqScan(BORROW_BOOK, {'book_id': 11, 'user_id': 12})
+		self.assertNoSeqScan(RETURN_BOOK, {'book_id': 10, 'user_id': 12})
+
+	def test_books_not_returned_uses_index(self):
+		"""test listing a user's open loans doesn't scan borrowed_books or books"""
+		query = BorrowedBook.query_with_books(user_id=12, returned=False)
+		self.assertNoSeqScan(query.limit(20))
+		self.assertNoSeqScan(query.order_by(None))
+
+	def test_borrowing_history_uses_index(self):
+		"""test a user's borrowing history doesn't scan borrowed_books or books"""
+		query = BorrowedBook.query_with_books(user_id=12, returned=True)
+		self.assertNoSeqScan(query.limit(20))
+		self.assertNoSeqScan(query.order_by(None))
+
+	# useful functions
+	def explain(self, query, params=None):
+		"""
+		get the plan postgres picks for a query, without running it
+		:param query: sqlalchemy query or text statement
+		:param params: bind parameters of a text statement
+		:return: plan text
+		"""
+		if isinstance(query, db.Query):
+			statement = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+			rows = db.session.execute(f'EXPLAIN {statement}')
+		else:
+			rows = db.session.execute(db.text(f'EXPLAIN {query.text}'), params)
+		return '\n'.join(row[0] for row in rows)
+
+	def assertNoSeqScan(self, query, params=None):
+		plan = self.explain(query, params)
+		self.assertNotIn('Seq Scan', plan, plan)
@@ -0,0 +1,47 @@
+from tests.base import BaseTestCase
+from app import app
+import json
+import re
+
+
+class TestServerTiming(BaseTestCase):
+	"""test per request timing"""
+
+	def login(self):
+		res = self.client.post(
+			'/api/v2/auth/login',
+			content_type='application/json',
+			data=json.dumps(dict(username='tester', password='tester#Password1'))
+		)
+		return dict(Authorization=f'Bearer {json.loads(res.data.decode())["auth_token"]}')
+
+	def test_server_timing_header_and_log(self):
+		"""test a request reports its queries, phases and total in a header and a log line"""
+		headers = self.login()
+
+		with self.capture_queries() as statements, self.assertLogs('app.timing', 'INFO') as logs:
+			res = self.client.post(
+				'/api/v2/books',
+				headers=headers,
+				content_type='application/json',
+				data=json.dumps({'title': 'hello books', 'isbn': '5698745124'})
+			)
+		self.assertEqual(res.status_code, 201)
+
+		metrics = dict(re.findall(r'(\w+);dur=([0-9.]+)', res.headers['Server-Timing']))
+		self.assertEqual(set(metrics), {'db', 'auth', 'validation', 'json', 'total'})
+		self.assertIn(f'desc="{len(statements)} queries"', res.headers['Server-Timing'])
+		self.assertGreater(float(metrics['validation']), 0)
+		self.assertGreaterEqual(float(metrics['total']), float(metrics['db']))
+
+		record = json.loads(logs.records[-1].getMessage())
+		self.assertEqual(record['endpoint'], 'books.api_create_book')
+		self.assertEqual(record['status'], 201)
+		self.assertEqual(record['queries'], len(statements))
+
+	def test_server_timing_can_be_turned_off(self):
+		"""test no header is sent when timing is off"""
+		headers = self.login()
+		app.config['SERVER_TIMING_ENABLED'] = False
+		res = self.client.get('/api/v2/books', headers=headers)
+		self.assertNotIn('Server-Timing', res.headers)
@@ -1,5 +1,11 @@
 from tests.base import BaseTestCase
+from app import app, db
+from app.models import Book, BorrowedBook, User
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from unittest import mock
 import json
+import threading
 
 URL_USERS = '/api/v2/users/'
 URL_AUTH = '/api/v2/auth/'
@@ -16,30 +22,167 @@ class TestUserCases(BaseTestCase):
 			'title': 'Hello Books',
 			'isbn': '5698745124'
 		}
-		login_data = self.login_test_user()
-		token = login_data['auth_token']
-		res = self.client.post(
-			'/api/v2/books',
-			headers=dict(Authorization=f'Bearer {token}'),
-			content_type='application/json',
-			data=json.dumps(add_book)
-		)
+		with self.query_budget():
+			login_data = self.login_test_user()
+			token = login_data['auth_token']
+			res = self.client.post(
+				'/api/v2/books',
+				headers=dict(Authorization=f'Bearer {token}'),
+				content_type='application/json',
+				data=json.dumps(add_book)
+			)
 
-		# borrow book
-		res3 = self.client.post(
-			f'{URL_USERS}books/1',
-			headers=dict(Authorization=f'Bearer {token}')
-		)
+			# borrow book
+			res3 = self.client.post(
+				f'{URL_USERS}books/1',
+				headers=dict(Authorization=f'Bearer {token}')
+			)
 
-		# get book not returned
-		res4 = self.client.get(
-			f'{URL_USERS}books?limit=2&page=1&returned=false',
-			headers=dict(Authorization=f'Bearer {token}')
-		)
+			# get book not returned
+			res4 = self.client.get(
+				f'{URL_USERS}books?limit=2&page=1&returned=false',
+				headers=dict(Authorization=f'Bearer {token}')
+			)
 		book_not_returned = json.loads(res4.data.decode())
 		self.assertIn('hello books', str(book_not_returned))
 
+	def test_books_not_returned_for_user_id(self):
+		"""test admins can list the books another user has not returned"""
+		self.add_borrowed_books(2, returned=False)
+		token = self.login_test_user()['auth_token']
+
+		res = self.client.get(
+			f'{URL_USERS}books?limit=5&page=1&returned=false&user_id={self.test_user.id}',
+			headers=dict(Authorization=f'Bearer {token}')
+		)
+		self.assertEqual(res.status_code, 200)
+		self.assertEqual(len(json.loads(res.data.decode())['books']), 2)
+
+	def test_borrowing_history_is_paginated(self):
+		"""test the borrowing history pages through returned books"""
+		self.add_borrowed_books(3, returned=True)
+		with self.query_budget():
+			token = self.login_test_user()['auth_token']
+
+			res = self.client.get(
+				f'{URL_USERS}books?limit=2&page=2&returned=true',
+				headers=dict(Authorization=f'Bearer {token}')
+			)
+			history = json.loads(res.data.decode())
+			self.assertEqual([book['title'] for book in history['books']], ['book 2'])
+			self.assertEqual(history['total_pages'], 2)
+			self.assertIn('return_date', history['books'][0])
+
+			res = self.client.get(f'{URL_USERS}books', headers=dict(Authorization=f'Bearer {token}'))
+			self.assertEqual(len(json.loads(res.data.decode())['books']), 3)
+
+	def test_borrowed_books_run_constant_queries(self):
+		"""test both branches run the same number of statements however long the history is"""
+		token = self.login_test_user()['auth_token']
+		headers = dict(Authorization=f'Bearer {token}')
+
+		# warm up the per-worker auth caches first
+		self.client.get(f'{URL_USERS}books', headers=headers)
+
+		counts = []
+		for borrowed in (1, 10):
+			self.add_borrowed_books(borrowed, returned=True)
+			self.add_borrowed_books(borrowed, returned=False)
+
+			with self.capture_queries() as statements:
+				for returned in ('true', 'false'):
+					res = self.client.get(
+						f'{URL_USERS}books?limit=20&page=1&returned={returned}',
+						headers=headers
+					)
+					self.assertEqual(len(json.loads(res.data.decode())['books']), borrowed)
+			counts.append(len(statements))
+
+			BorrowedBook.query.delete()
+			Book.query.delete()
+			db.session.commit()
+
+		self.assertEqual(counts[0], counts[1])
+
+	def test_query_budget_catches_lazy_loaded_books(self):
+		"""test the query budget fails a borrowed books list that loads each book with its own select"""
+		self.add_borrowed_books(3, returned=True)
+		headers = dict(Authorization=f'Bearer {self.login_test_user()["auth_token"]}')
+
+		def query_without_books(user_id, returned):
+			return BorrowedBook.query.filter(BorrowedBook.user_id == user_id, BorrowedBook.return_date != None)
+
+		with mock.patch.object(BorrowedBook, 'query_with_books', query_without_books):
+			with self.assertRaises(AssertionError) as failure:
+				with self.query_budget():
+					self.client.get(f'{URL_USERS}books', headers=headers)
+
+		message = str(failure.exception)
+		self.assertIn('3 times SELECT books.', message)
+		self.assertIn('users.api_books_not_returned_or_history', message)
+
+	def test_return_book_borrowed_by_someone_else(self):
+		"""test returning a book another user borrowed is refused instead of crashing"""
+		self.add_borrowed_books(1, returned=False)
+		with self.query_budget():
+			token = self.register_and_login_in_user()['auth_token']
+
+			res = self.client.put(f'{URL_USERS}books/1', headers=dict(Authorization=f'Bearer {token}'))
+			self.assertEqual(res.status_code, 403)
+			self.assertTrue(Book.query.get(1).is_borrowed)
+
+			res = self.client.put(f'{URL_USERS}books/2', headers=dict(Authorization=f'Bearer {token}'))
+			self.assertEqual(res.status_code, 404)
+
+	def test_concurrent_borrows_open_one_loan(self):
+		"""test many threads borrowing and returning one book succeed exactly once each way"""
+		threads = 10
+		db.session.add(Book(title='Hello Books', isbn='5698745124'))
+		db.session.add_all(User(username=f'user{i}', email=f'user{i}@mail.com', password='x') for i in range(threads))
+		db.session.commit()
+		user_ids = [user.id for user in User.query.filter(User.username.like('user%')).all()]
+		barrier = threading.Barrier(threads)
+
+		def hammer(method, user_id):
+			with app.app_context():
+				barrier.wait()
+				try:
+					return method(1, user_id)
+				finally:
+					db.session.remove()
+
+		with ThreadPoolExecutor(max_workers=threads) as executor:
+			borrowed = list(executor.map(lambda user_id: hammer(BorrowedBook.borrow, user_id), user_ids))
+		self.assertEqual(len([loan_id for loan_id in borrowed if loan_id]), 1)
+		self.assertEqual(BorrowedBook.query.filter(BorrowedBook.return_date == None).count(), 1)
+
+		borrower = user_ids[[bool(loan_id) for loan_id in borrowed].index(True)]
+		with ThreadPoolExecutor(max_workers=threads) as executor:
+			returned = list(executor.map(lambda user_id: hammer(BorrowedBook.return_book, user_id), [borrower] * threads))
+		self.assertEqual(returned.count(True), 1)
+		self.assertEqual(BorrowedBook.query.filter(BorrowedBook.return_date == None).count(), 0)
+		self.assertFalse(Book.query.get(1).is_borrowed)
+
 	# useful functions
+	def add_borrowed_books(self, count, returned):
+		"""
+		add books borrowed by the test user
+		:param count: number of books
+		:param returned: mark the books returned
+		:return:
+		"""
+		for i in range(count):
+			book = Book(title=f'book {i}', isbn=f'{int(returned)}{i:09}')
+			book.is_borrowed = not returned
+			db.session.add(book)
+			db.session.flush()
+			db.session.add(BorrowedBook(
+				user_id=self.test_user.id,
+				book_id=book.id,
+				return_date=datetime.utcnow() if returned else None
+			))
+		db.session.commit()
+
 	def login_test_user(self):
 		# login user
 		login_res = self.client.post(
@@ -61,7 +204,7 @@ class TestUserCases(BaseTestCase):
 		Helper method to sign up and login a user
 		:return: Json login response
 		"""
-		reg_user = self.register_user('lilbaby', 'lilb@mail.com', 'test#op3456', 'test#op3456', True)
+		reg_user = self.register_user('lilbaby', 'lilb@mail.com', 'test#op3456', 'test#op3456')
 		data = json.loads(reg_user.data.decode())
 		self.assertEqual(reg_user.status_code, 201)
 		self.assertIn('successfully registered', str(data))